@@ -0,0 +1,8 @@
+#!/bin/bash
+# Usage: ./bench.sh <benchmark-module> [args...]
+# e.g.   ./bench.sh stdlib_cache --iterations=50
+set -euo pipefail
+cd "$(dirname "${0}")/src"
+module="${1:?benchmark name required}"
+shift
+exec poetry run python -m "benchmarks.${module}" "$@"
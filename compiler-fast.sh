@@ -0,0 +1,13 @@
+#!/bin/bash
+# Like compiler.sh, but runs the project's Python directly instead of going
+# through `poetry run`, whose startup takes longer than most compilations.
+# The interpreter is looked up with Poetry once and remembered in .python-path.
+set -euo pipefail
+dir="$(cd "$(dirname "${0}")" && pwd)"
+python_path_file="${dir}/.python-path"
+python="$(cat "${python_path_file}" 2>/dev/null || true)"
+if [[ ! -x "${python}" ]]; then
+    python="$(poetry -C "${dir}" env info --executable)"
+    echo "${python}" > "${python_path_file}"
+fi
+PYTHONPATH="${dir}/src${PYTHONPATH:+:${PYTHONPATH}}" exec "${python}" -m compiler "$@"
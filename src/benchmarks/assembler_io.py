@@ -0,0 +1,100 @@
+"""Compares the I/O done per request by the two toolchain paths.
+
+'tempdir' writes every intermediate file to a fresh temporary directory,
+as the assembler used to. 'piped' streams the assembly to `as` and keeps
+the object and the executable in reusable scratch files.
+
+File operations done by this process are counted with audit hooks.
+If `strace` is installed, the system calls of the whole process tree,
+including `as` and `ld`, are counted too.
+
+Run with `./bench.sh assembler_io [--iterations=N]`.
+"""
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Any
+
+from compiler.assembler import assemble_and_get_executable, default_stdlib_cache
+from compiler.assembly_generator import generate_assembly
+from compiler.ir_generator import generate_ir, ROOT_TYPES
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.type_checker import annotate_types, build_typechecker_root_symtab
+
+SOURCE = "var x = 3; while x > 0 do { print_int(x); x = x - 1; }"
+
+FILE_EVENTS = {
+    'open', 'os.mkdir', 'os.remove', 'os.rmdir', 'os.rename', 'os.truncate',
+    'shutil.rmtree', 'shutil.move', 'tempfile.mkdtemp', 'subprocess.Popen',
+}
+
+counts: Counter[str] = Counter()
+
+
+def audit(event: str, args: tuple[Any, ...]) -> None:
+    if event in FILE_EVENTS:
+        counts[event] += 1
+
+
+def compile_once(assembly: str, mode: str) -> bytes:
+    if mode == 'tempdir':
+        with tempfile.TemporaryDirectory(prefix='compiler_') as wd:
+            return assemble_and_get_executable(assembly, workdir=wd, backend='toolchain')
+    return assemble_and_get_executable(assembly, backend='toolchain')
+
+
+def strace_counts(mode: str, iterations: int) -> str:
+    if shutil.which('strace') is None:
+        return "strace not installed, skipping whole-process-tree syscall counts"
+    with tempfile.NamedTemporaryFile('r', suffix='.strace') as log:
+        subprocess.run(
+            ['strace', '-f', '-c', '-o', log.name, sys.executable, '-m', 'benchmarks.assembler_io',
+             f'--iterations={iterations}', f'--only={mode}'],
+            check=True, capture_output=True)
+        summary = log.read().strip().splitlines()
+    total = next((line for line in summary if line.rstrip().endswith('total')), '')
+    calls = int(total.split()[2]) if total else 0
+    return f"{calls / iterations:.0f} syscalls/request (strace -f, including as and ld)"
+
+
+def main() -> int:
+    iterations = 20
+    modes = ['tempdir', 'piped']
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--iterations=(\d+)', arg)) is not None:
+            iterations = int(m[1])
+        elif (m := re.fullmatch(r'--only=(tempdir|piped)', arg)) is not None:
+            modes = [m[1]]
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    tree = parse(tokenize(SOURCE))
+    annotate_types(tree, build_typechecker_root_symtab())
+    assembly = generate_assembly(generate_ir(ROOT_TYPES, tree)) + "\n"
+    default_stdlib_cache.warm()
+    sys.addaudithook(audit)
+
+    for mode in modes:
+        compile_once(assembly, mode)  # warm up the scratch files
+        counts.clear()
+        start = time.perf_counter()
+        for _ in range(iterations):
+            compile_once(assembly, mode)
+        elapsed = (time.perf_counter() - start) / iterations
+        events = ', '.join(f"{name}={n / iterations:g}" for name, n in sorted(counts.items()))
+        print(f"{mode}:")
+        print(f"  {elapsed * 1000:.2f} ms/request")
+        print(f"  per request in this process: {events}")
+        if len(modes) > 1:
+            print(f"  {strace_counts(mode, iterations)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
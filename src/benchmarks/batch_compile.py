@@ -0,0 +1,52 @@
+"""Compares compiling a corpus with single requests against one `compile_many` batch.
+
+The executable cache is disabled. Programs differ slightly so that none
+of them would be cache hits anyway.
+
+Run with `./bench.sh batch_compile [--programs=N] [--workers=N]`.
+"""
+import os
+import re
+import sys
+import time
+
+from benchmarks.server_throughput import SOURCE, start_server
+from compiler.client import send_request
+
+
+def main() -> int:
+    programs = 200
+    workers = os.cpu_count() or 1
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--programs=(\d+)', arg)) is not None:
+            programs = int(m[1])
+        elif (m := re.fullmatch(r'--workers=(\d+)', arg)) is not None:
+            workers = int(m[1])
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    sources = [f"{SOURCE} print_int({i});" for i in range(programs)]
+    process, port = start_server([f"--workers={workers}"])
+    try:
+        start = time.perf_counter()
+        for source_code in sources:
+            send_request("127.0.0.1", port, {"command": "compile", "code": source_code})
+        single = time.perf_counter() - start
+
+        start = time.perf_counter()
+        response = send_request("127.0.0.1", port, {"command": "compile_many", "programs": sources})
+        batch = time.perf_counter() - start
+        assert all("program" in result for result in response["results"])
+    finally:
+        process.terminate()
+        process.wait()
+
+    print(f"{programs} programs, {workers} workers")
+    print(f"single requests: {single * 1000:8.1f} ms ({programs / single:7.1f} programs/s)")
+    print(f"compile_many:    {batch * 1000:8.1f} ms ({programs / batch:7.1f} programs/s)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,131 @@
+"""Times each compile stage on synthetic programs of growing size.
+
+Programs come from `benchmarks.synthetic`. Every shape and size is
+compiled `--repeat` times with the builtin backend and the fastest time of
+each stage is kept, which filters out most scheduling noise.
+
+With `--save-baseline` the timings are written to the baseline file.
+With `--check` they're compared against it instead, and the benchmark
+fails if any stage got slower than `--threshold` times its baseline (plus
+half a millisecond, so the tiniest stages can't fail on jitter alone).
+Baselines depend on the machine, so save one before changing the code and
+check against it after.
+
+Run with `./bench.sh compile_stages [--repeat=N] [--shapes=nested,wide]
+[--save-baseline | --check [--threshold=1.25]] [--baseline=FILE]`.
+"""
+import json
+import os
+import platform
+import re
+import sys
+
+from benchmarks.synthetic import SHAPES, generate
+from compiler.metrics import collect_stages
+from compiler.pipeline import call_compiler
+
+STAGES = ('tokenize', 'parse', 'annotate_types', 'generate_ir', 'generate_assembly', 'assemble')
+
+SIZES = {
+    # The compiler recurses once per nesting level
+    'nested': (8, 16, 32, 64),
+    'while': (250, 1000, 4000),
+    'wide': (250, 1000, 4000),
+    'variables': (250, 1000, 4000),
+}
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(__file__), 'baselines', 'compile_stages.json')
+
+ABSOLUTE_SLACK = 0.0005
+
+
+def measure(shape: str, size: int, repeat: int) -> dict[str, float]:
+    """Returns the fastest time of each stage, in seconds."""
+    source_code = generate(shape, size)
+    best: dict[str, float] = {}
+    for _ in range(repeat):
+        with collect_stages() as stages:
+            call_compiler(source_code, f"({shape} {size})", 'builtin')
+        for name, seconds in stages:
+            if name in STAGES:
+                best[name] = min(best.get(name, seconds), seconds)
+    return best
+
+
+def find_regressions(
+    baseline: dict[str, dict[str, float]],
+    results: dict[str, dict[str, float]],
+    threshold: float,
+) -> list[str]:
+    regressions = []
+    for case, stages in results.items():
+        for name, seconds in stages.items():
+            before = baseline.get(case, {}).get(name)
+            if before is not None and seconds > before * threshold + ABSOLUTE_SLACK:
+                regressions.append(
+                    f"{case} {name}: {before * 1000:.2f} ms -> {seconds * 1000:.2f} ms "
+                    f"({seconds / before:.2f}x)")
+    return regressions
+
+
+def main() -> int:
+    repeat = 5
+    shapes = list(SHAPES)
+    baseline_file = DEFAULT_BASELINE
+    save = False
+    check = False
+    threshold = 1.25
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--repeat=(\d+)', arg)) is not None:
+            repeat = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--shapes=(.+)', arg)) is not None:
+            shapes = m[1].split(',')
+        elif (m := re.fullmatch(r'--baseline=(.+)', arg)) is not None:
+            baseline_file = m[1]
+        elif arg == '--save-baseline':
+            save = True
+        elif arg == '--check':
+            check = True
+        elif (m := re.fullmatch(r'--threshold=(\d+(?:\.\d+)?)', arg)) is not None:
+            threshold = float(m[1])
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+    if unknown := [shape for shape in shapes if shape not in SHAPES]:
+        print(f"Unknown shapes: {', '.join(unknown)}", file=sys.stderr)
+        return 1
+
+    print(f"{'case':<16}" + "".join(f"{name:>18}" for name in STAGES) + "   (ms)")
+    results: dict[str, dict[str, float]] = {}
+    for shape in shapes:
+        for size in SIZES[shape]:
+            case = f"{shape}/{size}"
+            results[case] = measure(shape, size, repeat)
+            print(f"{case:<16}" + "".join(f"{results[case][name] * 1000:>18.2f}" for name in STAGES))
+
+    if save:
+        os.makedirs(os.path.dirname(os.path.abspath(baseline_file)), exist_ok=True)
+        with open(baseline_file, 'w') as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            }, f, indent=2)
+        print(f"Saved baseline to {baseline_file}")
+    if check:
+        if not os.path.exists(baseline_file):
+            print(f"No baseline at {baseline_file}, save one with --save-baseline first", file=sys.stderr)
+            return 1
+        with open(baseline_file) as f:
+            baseline = json.load(f)["results"]
+        regressions = find_regressions(baseline, results, threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            return 1
+        print(f"No stage slower than {threshold}x its baseline")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Flags compile stages whose time grows faster than linearly with the input.
+
+Each shape from `benchmarks.synthetic` is generated at geometrically
+growing sizes, which vary one dimension of the input at a time: nesting
+depth, expression width, loop body length and variable count. The
+exponent k of time ~ size^k is fitted by least squares on log-log scale
+for every stage. A linear stage has k close to 1, a quadratic one close
+to 2. The benchmark fails if any exponent is above `--max-exponent`.
+
+Run with `./bench.sh complexity [--repeat=N] [--max-exponent=1.3]`.
+"""
+import math
+import re
+import sys
+
+from benchmarks.compile_stages import STAGES, measure
+
+SIZES = {
+    'nested': (8, 16, 32, 64),
+    'while': (500, 1000, 2000, 4000),
+    'wide': (500, 1000, 2000, 4000),
+    'variables': (500, 1000, 2000, 4000),
+}
+
+
+def growth_exponent(sizes: list[int], seconds: list[float]) -> float:
+    """Returns the slope of log(seconds) against log(size)."""
+    xs = [math.log(size) for size in sizes]
+    ys = [math.log(max(t, 1e-9)) for t in seconds]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    covariance = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    variance = sum((x - mean_x) ** 2 for x in xs)
+    return covariance / variance
+
+
+def stage_exponents(shape: str, sizes: tuple[int, ...], repeat: int) -> dict[str, float]:
+    timings = [measure(shape, size, repeat) for size in sizes]
+    return {
+        name: growth_exponent(list(sizes), [timing[name] for timing in timings])
+        for name in STAGES
+    }
+
+
+def main() -> int:
+    repeat = 3
+    max_exponent = 1.3
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--repeat=(\d+)', arg)) is not None:
+            repeat = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--max-exponent=(\d+(?:\.\d+)?)', arg)) is not None:
+            max_exponent = float(m[1])
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    print(f"{'shape':<12}" + "".join(f"{name:>18}" for name in STAGES))
+    failures = []
+    for shape, sizes in SIZES.items():
+        exponents = stage_exponents(shape, sizes, repeat)
+        print(f"{shape:<12}" + "".join(f"{exponents[name]:>18.2f}" for name in STAGES))
+        failures += [
+            f"{shape} {name}: time grows as size^{exponent:.2f}"
+            for name, exponent in exponents.items() if exponent > max_exponent
+        ]
+    for failure in failures:
+        print(f"SUPER-LINEAR {failure}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
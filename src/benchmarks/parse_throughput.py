@@ -0,0 +1,60 @@
+"""Measures how many tokens per second `parse` handles.
+
+The input is the corpus of `tokenizer_throughput`, tokenized before the
+clock starts. It's parsed both from a `TokenStream` and from a list of
+`Token` objects, and the benchmark fails if the two trees differ.
+
+Run with `./bench.sh parse_throughput [--megabytes=N] [--repeat=N]`.
+"""
+import gc
+import re
+import sys
+import time
+
+from benchmarks.tokenizer_throughput import corpus
+from compiler.parser import parse
+from compiler.tokenizer import Token, TokenStream, tokenize, tokenize_stream
+
+
+def best_time(tokens: TokenStream | list[Token], repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        gc.disable()
+        try:
+            start = time.perf_counter()
+            parse(tokens)
+            best = min(best, time.perf_counter() - start)
+        finally:
+            gc.enable()
+    return best
+
+
+def main() -> int:
+    megabytes = 1.0
+    repeat = 3
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--megabytes=(\d+(?:\.\d+)?)', arg)) is not None:
+            megabytes = float(m[1])
+        elif (m := re.fullmatch(r'--repeat=(\d+)', arg)) is not None:
+            repeat = max(1, int(m[1]))
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    source_code = corpus(megabytes)
+    stream = tokenize_stream(source_code)
+    token_list = tokenize(source_code)
+    if parse(stream) != parse(token_list):
+        print("parsing a TokenStream and a token list disagree", file=sys.stderr)
+        return 1
+
+    print(f"{len(source_code) / (1024 * 1024):.1f} MB, {len(stream)} tokens")
+    print(f"{'parse from':<16}{'best (s)':>12}{'tokens/s':>14}")
+    for name, tokens in (('TokenStream', stream), ('list of Token', token_list)):
+        seconds = best_time(tokens, repeat)
+        print(f"{name:<16}{seconds:>12.3f}{len(stream) / seconds:>14,.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
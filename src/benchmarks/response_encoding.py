@@ -0,0 +1,63 @@
+"""Measures the size and CPU cost of each response encoding for executables.
+
+For both assembler backends, reports the bytes on the wire for a compile
+response and the CPU time the server spends encoding it, next to the wall
+time of compiling the program in the first place.
+
+Run with `./bench.sh response_encoding [--iterations=N]`.
+"""
+import re
+import sys
+import time
+from typing import Callable
+
+from benchmarks.server_throughput import SOURCE
+from compiler.pipeline import call_compiler
+from compiler.protocol import COMPRESSIONS, ENCODINGS, decode_executable, encode_executables, encode_frame
+
+
+def cpu_time(f: Callable[[], object], iterations: int) -> float:
+    start = time.process_time()
+    for _ in range(iterations):
+        f()
+    return (time.process_time() - start) / iterations
+
+
+def main() -> int:
+    iterations = 200
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--iterations=(\d+)', arg)) is not None:
+            iterations = int(m[1])
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    for backend in ["builtin", "toolchain"]:
+        executable = call_compiler(SOURCE, "(benchmark)", backend)
+        start = time.perf_counter()
+        for _ in range(10):
+            call_compiler(SOURCE, "(benchmark)", backend)
+        compile_time = (time.perf_counter() - start) / 10
+        print(f"{backend} backend: {len(executable)} byte executable, compiled in {compile_time * 1e3:.2f} ms")
+        print(f"  {'encoding':<8} {'compression':<11} {'bytes':>7} {'saved':>7} {'encode':>10} {'decode':>10}")
+        baseline = None
+        for encoding in ENCODINGS:
+            for compression in COMPRESSIONS:
+                request = {"encoding": encoding, "compression": compression}
+
+                def encode() -> bytes:
+                    return encode_frame(encode_executables({"id": 0, "program": executable}, request, framed=True))
+
+                size = len(encode())
+                if baseline is None:
+                    baseline = size
+                program = encode_executables({"program": executable}, request, framed=True)["program"]
+                encode_time = cpu_time(encode, iterations)
+                decode_time = cpu_time(lambda: decode_executable(program, compression), iterations)
+                print(f"  {encoding:<8} {compression:<11} {size:7d} {1 - size / baseline:7.1%} "
+                      f"{encode_time * 1e6:7.1f} us {decode_time * 1e6:7.1f} us")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
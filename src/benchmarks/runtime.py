@@ -0,0 +1,162 @@
+"""Measures how fast the executables produced by the compiler run.
+
+Every program in `benchmarks/runtime_programs` is compiled, checked against
+its `.out` file and run `--runs` times. For each program the fastest wall
+time and CPU time are recorded, along with the executable size and the
+number of instructions in the generated assembly. If `perf` is installed,
+the number of instructions executed in user space is recorded too.
+
+Results are saved as `<commit>.json` in the results directory, with
+`-dirty` appended when the working tree has uncommitted changes, so runs on
+different commits can be compared with `--compare=<commit>`.
+
+Run with `./bench.sh runtime [--runs=N] [--backend=builtin|toolchain]
+[--programs=primes,gcd] [--results-dir=DIR] [--compare=COMMIT]`.
+"""
+import json
+import os
+import re
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any
+
+from compiler.pipeline import compile_with_stats
+
+PROGRAMS_DIR = os.path.join(os.path.dirname(__file__), 'runtime_programs')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DEFAULT_RESULTS_DIR = os.path.join(REPO_DIR, 'bench-results', 'runtime')
+
+
+def program_names() -> list[str]:
+    return sorted(name[:-len('.src')] for name in os.listdir(PROGRAMS_DIR) if name.endswith('.src'))
+
+
+def read_program(name: str) -> tuple[str, str]:
+    """Returns the source code and the expected output of a program."""
+    with open(os.path.join(PROGRAMS_DIR, f'{name}.src')) as f:
+        source_code = f.read()
+    with open(os.path.join(PROGRAMS_DIR, f'{name}.out')) as f:
+        return source_code, f.read()
+
+
+def run_once(path: str) -> tuple[str, float, float]:
+    """Runs an executable and returns its output, wall time and CPU time."""
+    before = resource.getrusage(resource.RUSAGE_CHILDREN)
+    start = time.perf_counter()
+    result = subprocess.run([path], stdout=subprocess.PIPE, stdin=subprocess.DEVNULL, check=True)
+    wall = time.perf_counter() - start
+    after = resource.getrusage(resource.RUSAGE_CHILDREN)
+    cpu = (after.ru_utime - before.ru_utime) + (after.ru_stime - before.ru_stime)
+    return result.stdout.decode(), wall, cpu
+
+
+def executed_instructions(path: str) -> int | None:
+    """Counts user-space instructions with `perf stat`, if it's available and permitted."""
+    if shutil.which('perf') is None:
+        return None
+    result = subprocess.run(
+        ['perf', 'stat', '-x,', '-e', 'instructions:u', path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    for line in result.stderr.splitlines():
+        fields = line.split(',')
+        if len(fields) > 2 and fields[2].startswith('instructions') and fields[0].isdigit():
+            return int(fields[0])
+    return None
+
+
+def measure(name: str, runs: int, backend: str, workdir: str) -> dict[str, Any]:
+    source_code, expected = read_program(name)
+    executable, stats = compile_with_stats(source_code, f'{name}.src', backend)
+    path = os.path.join(workdir, name)
+    with open(path, 'wb') as f:
+        f.write(executable)
+    os.chmod(path, 0o755)
+
+    walls = []
+    cpus = []
+    for _ in range(runs):
+        output, wall, cpu = run_once(path)
+        if output != expected:
+            raise RuntimeError(f"{name} printed {output!r}, expected {expected!r}")
+        walls.append(wall)
+        cpus.append(cpu)
+    return {
+        "wall_seconds": min(walls),
+        "cpu_seconds": min(cpus),
+        "executable_bytes": len(executable),
+        "assembly_instructions": stats["assembly_instructions"],
+        "executed_instructions": executed_instructions(path),
+    }
+
+
+def commit_name() -> str:
+    def git(*args: str) -> str:
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    commit = git('rev-parse', '--short', 'HEAD') or 'unknown'
+    return commit + ('-dirty' if git('status', '--porcelain', '--untracked-files=no') else '')
+
+
+def main() -> int:
+    runs = 5
+    backend = 'builtin'
+    names = program_names()
+    results_dir = DEFAULT_RESULTS_DIR
+    compare: str | None = None
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--runs=(\d+)', arg)) is not None:
+            runs = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--backend=(builtin|toolchain)', arg)) is not None:
+            backend = m[1]
+        elif (m := re.fullmatch(r'--programs=(.+)', arg)) is not None:
+            names = m[1].split(',')
+        elif (m := re.fullmatch(r'--results-dir=(.+)', arg)) is not None:
+            results_dir = m[1]
+        elif (m := re.fullmatch(r'--compare=(.+)', arg)) is not None:
+            compare = m[1]
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    before: dict[str, Any] = {}
+    if compare is not None:
+        with open(os.path.join(results_dir, f'{compare}.json')) as f:
+            before = json.load(f)["results"]
+
+    results = {}
+    print(f"{'program':<18}{'wall (ms)':>12}{'cpu (ms)':>12}{'exe bytes':>12}{'asm insns':>12}{'executed':>14}")
+    with tempfile.TemporaryDirectory() as workdir:
+        for name in names:
+            result = measure(name, runs, backend, workdir)
+            results[name] = result
+            executed = result["executed_instructions"]
+            print(
+                f"{name:<18}{result['wall_seconds'] * 1000:>12.1f}{result['cpu_seconds'] * 1000:>12.1f}"
+                f"{result['executable_bytes']:>12}{result['assembly_instructions']:>12}"
+                f"{executed if executed is not None else '-':>14}")
+
+    os.makedirs(results_dir, exist_ok=True)
+    path = os.path.join(results_dir, f'{commit_name()}.json')
+    with open(path, 'w') as f:
+        json.dump({"backend": backend, "runs": runs, "results": results}, f, indent=2)
+    print(f"Saved results to {path}")
+
+    if compare is not None:
+        print(f"\nCompared with {compare}:")
+        for name, result in results.items():
+            if name not in before:
+                continue
+            changes = ", ".join(
+                f"{key} {result[key] / before[name][key]:.2f}x"
+                for key in ("cpu_seconds", "executable_bytes", "assembly_instructions")
+                if before[name][key]
+            )
+            print(f"{name:<18}{changes}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
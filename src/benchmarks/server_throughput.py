@@ -0,0 +1,120 @@
+"""Compares the throughput of the compile server's process models.
+
+Starts `compiler serve` in each model with the executable cache disabled,
+then keeps `--concurrency` clients busy sending compile requests.
+
+Run with `./bench.sh server_throughput [--requests=N] [--concurrency=N] [--models=prefork,forking,async]
+[--protocol=oneshot|framed]`.
+"""
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from compiler.client import Connection, send_request
+
+SOURCE = "var x = 10; while x > 0 do { print_int(x); x = x - 1; }"
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+def start_server(args: list[str]) -> tuple[subprocess.Popen[bytes], int]:
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, "-m", "compiler", "serve", f"--port={port}", "--cache-entries=0", *args],
+        stdout=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 10
+    while True:
+        try:
+            send_request("127.0.0.1", port, {"command": "ping"}, timeout=1)
+            return process, port
+        except OSError:
+            if time.monotonic() > deadline:
+                process.kill()
+                raise
+            time.sleep(0.05)
+
+
+def run_load(port: int, requests: int, concurrency: int, framed: bool) -> tuple[float, list[float]]:
+    # With the framed protocol each client thread keeps one connection open.
+    local = threading.local()
+    connections: list[Connection] = []
+
+    def one(_: int) -> float:
+        start = time.perf_counter()
+        request = {"command": "compile", "code": SOURCE}
+        if framed:
+            if not hasattr(local, "connection"):
+                local.connection = Connection("127.0.0.1", port)
+                connections.append(local.connection)
+            response = local.connection.request(request)
+        else:
+            response = send_request("127.0.0.1", port, request)
+        if "program" not in response:
+            raise RuntimeError(response.get("error"))
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        latencies = list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - start
+    for connection in connections:
+        connection.close()
+    return elapsed, latencies
+
+
+def percentile(values: list[float], p: float) -> float:
+    return statistics.quantiles(values, n=100)[int(p) - 1]
+
+
+def main() -> int:
+    requests = 200
+    concurrency = 8
+    models = {
+        "prefork": ["--server=prefork"],
+        "forking": ["--server=forking"],
+        "async": ["--async", "--backpressure=wait"],
+    }
+    selected = list(models)
+    framed = False
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--requests=(\d+)', arg)) is not None:
+            requests = int(m[1])
+        elif (m := re.fullmatch(r'--concurrency=(\d+)', arg)) is not None:
+            concurrency = int(m[1])
+        elif (m := re.fullmatch(r'--models=(.+)', arg)) is not None:
+            selected = m[1].split(",")
+        elif (m := re.fullmatch(r'--protocol=(oneshot|framed)', arg)) is not None:
+            framed = m[1] == "framed"
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    print(f"{requests} compile requests, {concurrency} concurrent clients, "
+          f"{'framed' if framed else 'one-shot'} protocol")
+    for name in selected:
+        process, port = start_server(models[name])
+        try:
+            run_load(port, min(requests, 20), concurrency, framed)  # warm up
+            elapsed, latencies = run_load(port, requests, concurrency, framed)
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{name:>10}: {requests / elapsed:7.1f} req/s   "
+              f"p50 {percentile(latencies, 50) * 1000:6.1f} ms   "
+              f"p99 {percentile(latencies, 99) * 1000:6.1f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
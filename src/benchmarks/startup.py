@@ -0,0 +1,108 @@
+"""Measures the startup cost of compiling a tiny program from the CLI.
+
+Each way of starting the compiler compiles a one-line program `--runs`
+times, and the fastest and median wall times are reported next to a bare
+`python -c pass`, which is the floor. Entry points whose tools are missing
+(Poetry, or the interpreter path of compiler-fast.sh) are skipped. The
+last entry hands the work to a `compiler daemon` started for the benchmark.
+
+Then `python -X importtime` shows where the import time of `compile` goes:
+the total, and the modules that take longest including what they import.
+
+Run with `./bench.sh startup [--runs=N] [--top=N]`.
+"""
+import os
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from compiler.daemon import send_to_daemon
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+SRC_DIR = os.path.join(REPO_DIR, 'src')
+
+
+def time_command(args: list[str], runs: int) -> list[float]:
+    env = {**os.environ, "PYTHONPATH": SRC_DIR}
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(args, check=True, env=env, stdout=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def import_times(args: list[str]) -> list[tuple[int, int, str]]:
+    """Returns (self microseconds, cumulative microseconds, module) of every import."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', *args],
+        check=True, env={**os.environ, "PYTHONPATH": SRC_DIR},
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    imports = []
+    for line in result.stderr.splitlines():
+        if (m := re.fullmatch(r'import time:\s*(\d+) \|\s*(\d+) \| ( *)(\S+)', line)) is not None:
+            imports.append((int(m[1]), int(m[2]), m[3] + m[4]))
+    return imports
+
+
+def main() -> int:
+    runs = 20
+    top = 15
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--runs=(\d+)', arg)) is not None:
+            runs = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--top=(\d+)', arg)) is not None:
+            top = int(m[1])
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'program.src')
+        with open(source, 'w') as f:
+            f.write("print_int(1 + 2)\n")
+        compile_args = ['compile', source, f'--output={os.path.join(directory, "a.out")}', '--no-daemon']
+        socket_path = os.path.join(directory, 'compiler.sock')
+
+        entry_points = {
+            'python -c pass': [sys.executable, '-c', 'pass'],
+            'python -m compiler': [sys.executable, '-m', 'compiler', *compile_args],
+        }
+        if os.path.exists(os.path.join(REPO_DIR, '.python-path')):
+            entry_points['compiler-fast.sh'] = [os.path.join(REPO_DIR, 'compiler-fast.sh'), *compile_args]
+        if shutil.which('poetry') is not None:
+            entry_points['compiler.sh'] = [os.path.join(REPO_DIR, 'compiler.sh'), *compile_args]
+
+        entry_points['python -m compiler (daemon)'] = [
+            sys.executable, '-m', 'compiler', *compile_args[:-1], f'--socket={socket_path}']
+
+        print(f"{'entry point':<30}{'fastest (ms)':>14}{'median (ms)':>14}")
+        daemon = subprocess.Popen(
+            [sys.executable, '-m', 'compiler', 'daemon', f'--socket={socket_path}'],
+            env={**os.environ, "PYTHONPATH": SRC_DIR}, stdout=subprocess.DEVNULL)
+        try:
+            while send_to_daemon(socket_path, {"command": "ping"}) is None:
+                time.sleep(0.05)
+            for name, args in entry_points.items():
+                times = time_command(args, runs)
+                print(f"{name:<30}{min(times) * 1000:>14.1f}{statistics.median(times) * 1000:>14.1f}")
+        finally:
+            daemon.terminate()
+            daemon.wait()
+
+        imports = import_times(['-m', 'compiler', *compile_args])
+
+    total = sum(self_time for self_time, _, _ in imports)
+    print(f"\nImport time of `compile`: {total / 1000:.1f} ms in {len(imports)} modules")
+    print(f"{'cumulative (ms)':>16}{'self (ms)':>12}  module")
+    for self_time, cumulative, module in sorted(imports, key=lambda i: -i[1])[:top]:
+        print(f"{cumulative / 1000:>16.1f}{self_time / 1000:>12.1f}  {module}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
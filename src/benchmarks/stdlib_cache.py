@@ -0,0 +1,60 @@
+"""Measures the per-request cost saved by caching the assembled stdlib.
+
+Run with `./bench.sh stdlib_cache [--iterations=N]`.
+"""
+import re
+import sys
+import time
+
+from compiler.assembler import assemble_and_get_executable, StdlibObjectCache
+from compiler.assembly_generator import generate_assembly
+from compiler.ir_generator import generate_ir, ROOT_TYPES
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.type_checker import annotate_types, build_typechecker_root_symtab
+
+SOURCE = """
+var n: Int = 27;
+while n > 1 do {
+    if n % 2 == 0 then { n = n / 2; } else { n = 3 * n + 1; }
+}
+print_int(n);
+"""
+
+
+def time_per_request(assembly: str, iterations: int, cached: bool) -> float:
+    shared = StdlibObjectCache()
+    shared.warm()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        cache = shared if cached else StdlibObjectCache()
+        # The builtin backend never runs `as` on the stdlib, which is what we measure.
+        assemble_and_get_executable(assembly, stdlib_cache=cache, backend='toolchain')
+    return (time.perf_counter() - start) / iterations
+
+
+def main() -> int:
+    iterations = 30
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--iterations=(\d+)', arg)) is not None:
+            iterations = int(m[1])
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    tree = parse(tokenize(SOURCE))
+    annotate_types(tree, build_typechecker_root_symtab())
+    assembly = generate_assembly(generate_ir(ROOT_TYPES, tree)) + "\n"
+
+    uncached = time_per_request(assembly, iterations, cached=False)
+    cached = time_per_request(assembly, iterations, cached=True)
+    print(f"iterations:          {iterations}")
+    print(f"stdlib rebuilt:      {uncached * 1000:8.2f} ms/request")
+    print(f"stdlib cached:       {cached * 1000:8.2f} ms/request")
+    print(f"saving:              {(uncached - cached) * 1000:8.2f} ms/request "
+          f"({100 * (uncached - cached) / uncached:.1f}%)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
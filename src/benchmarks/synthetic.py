@@ -0,0 +1,78 @@
+"""A seeded generator of valid programs of a chosen shape and size.
+
+Each shape stresses one dimension of the input:
+
+    nested     `size` blocks, ifs and whiles nested inside each other
+    while      one loop whose body has `size` statements
+    wide       an expression of `size` operands
+    variables  `size` variables, all declared in one scope and all read
+
+The same shape, size and seed always give the same program. Wide
+expressions are grouped with parentheses into a balanced tree, so that
+the compiler's recursive passes only recurse about log2(size) levels.
+"""
+import random
+
+SHAPES = ('nested', 'while', 'wide', 'variables')
+
+
+def generate(shape: str, size: int, seed: int = 0) -> str:
+    rng = random.Random(f"{shape}/{size}/{seed}")
+    if shape == 'nested':
+        return _nested(rng, size)
+    if shape == 'while':
+        return _long_while(rng, size)
+    if shape == 'wide':
+        return f"var v0 = {rng.randint(1, 9)};\nprint_int({_wide_expression(rng, size, 1)});\n"
+    if shape == 'variables':
+        return _many_variables(rng, size)
+    raise ValueError(f"Unknown shape: {shape}")
+
+
+def _nested(rng: random.Random, depth: int) -> str:
+    opening = []
+    for level in range(depth):
+        kind = rng.choice(('block', 'if', 'while'))
+        declaration = f"var v{level + 1} = v{level} + {rng.randint(1, 9)};"
+        if kind == 'block':
+            opening.append(f"{{ {declaration}")
+        elif kind == 'if':
+            opening.append(f"if v{level} > {rng.randint(0, 9)} then {{ {declaration}")
+        else:
+            # Runs at most once: the body sets the counter past the bound
+            opening.append(f"var w{level} = 0; while w{level} < 1 do {{ w{level} = 1; {declaration}")
+    # Each level opens one brace that's closed in reverse order
+    lines = ["var v0 = 1;", *opening, f"print_int(v{depth});", *["}"] * depth]
+    return "\n".join(lines) + "\n"
+
+
+def _long_while(rng: random.Random, statements: int) -> str:
+    lines = ["var i = 0;", "var a = 1;", "var b = 2;", "while i < 10 do {"]
+    for _ in range(statements):
+        target = rng.choice(('a', 'b'))
+        op = rng.choice(('+', '-', '*'))
+        lines.append(f"    {target} = {rng.choice(('a', 'b', 'i'))} {op} {rng.randint(1, 9)} % 7;")
+    lines += ["    i = i + 1;", "}", "print_int(a + b);"]
+    return "\n".join(lines) + "\n"
+
+
+def _wide_expression(rng: random.Random, operands: int, variables: int) -> str:
+    if operands == 1:
+        if rng.random() < 0.5:
+            return str(rng.randint(0, 99))
+        return f"v{rng.randrange(variables)}"
+    left = operands // 2
+    op = rng.choice(('+', '-', '*'))
+    return (
+        f"({_wide_expression(rng, left, variables)} {op} "
+        f"{_wide_expression(rng, operands - left, variables)})"
+    )
+
+
+def _many_variables(rng: random.Random, count: int) -> str:
+    lines = [f"var v{i}: Int = {rng.randint(0, 99)};" for i in range(count)]
+    # Read every variable, a few per statement
+    for start in range(0, count, 8):
+        names = [f"v{i}" for i in range(start, min(count, start + 8))]
+        lines.append(f"print_int({' + '.join(names)});")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,133 @@
+"""Measures how many megabytes of source code per second `tokenize` handles.
+
+The input is the runtime benchmark programs and synthetic programs of
+every shape, each wrapped in a block, repeated until it's `--megabytes`
+long. It's compared against the regex-alternation tokenizer that
+`tokenize` replaced, which the tests keep as `regex_tokenize`, and the
+benchmark fails if the two disagree on any token or location.
+
+`tokenize_stream` is timed too, which returns a `TokenStream` instead of
+a list of `Token` objects, and with more than one `--jobs` (by default
+one per core) it's timed tokenizing in parallel, whatever the size.
+
+With `--memory`, the peak memory of tokenizing and parsing the input is
+measured with tracemalloc: from the whole file read into a string, as a
+list of tokens and as a `TokenStream`, and streamed from the file with
+`iter_tokens`.
+
+Run with `./bench.sh tokenizer_throughput [--megabytes=N] [--repeat=N] [--jobs=N] [--memory]`.
+"""
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+
+from benchmarks.runtime import program_names, read_program
+from benchmarks.synthetic import SHAPES, generate
+from compiler.parser import parse
+from compiler.tokenizer import iter_tokens, read_chunks, tokenize, tokenize_stream
+from tests.tokenizer_reference import regex_tokenize, token_tuples
+
+def corpus(megabytes: float) -> str:
+    """A valid program of at least `megabytes` megabytes."""
+    pieces = [read_program(name)[0] for name in program_names()]
+    pieces += [generate(shape, 200) for shape in SHAPES if shape != 'nested'] + [generate('nested', 32)]
+    program = "".join(f"{{\n{piece}}}\n" for piece in pieces)
+    return program * int(megabytes * 1024 * 1024 // len(program) + 1)
+
+
+def best_time(function: Callable[[str], object], source_code: str, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function(source_code)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def parse_whole_file(path: str) -> None:
+    with open(path) as f:
+        parse(tokenize(f.read()))
+
+
+def parse_token_stream(path: str) -> None:
+    with open(path) as f:
+        parse(tokenize_stream(f.read()))
+
+
+def parse_streamed_file(path: str) -> None:
+    with open(path, 'rb') as f:
+        parse(iter_tokens(read_chunks(f)))
+
+
+def peak_memory(function: Callable[[str], None], path: str) -> int:
+    tracemalloc.start()
+    try:
+        function(path)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def main() -> int:
+    megabytes = 4.0
+    repeat = 3
+    jobs = os.cpu_count() or 1
+    memory = False
+    for arg in sys.argv[1:]:
+        if (m := re.fullmatch(r'--megabytes=(\d+(?:\.\d+)?)', arg)) is not None:
+            megabytes = float(m[1])
+        elif (m := re.fullmatch(r'--repeat=(\d+)', arg)) is not None:
+            repeat = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--jobs=(\d+)', arg)) is not None:
+            jobs = max(1, int(m[1]))
+        elif arg == '--memory':
+            memory = True
+        else:
+            print(f"Unknown argument: {arg}", file=sys.stderr)
+            return 1
+
+    source_code = corpus(megabytes)
+    size = len(source_code) / (1024 * 1024)
+    if token_tuples(tokenize(source_code)) != token_tuples(regex_tokenize(source_code)):
+        print("tokenize and regex_tokenize disagree", file=sys.stderr)
+        return 1
+
+    if jobs > 1 and token_tuples(list(tokenize_stream(source_code, jobs))) != token_tuples(tokenize(source_code)):
+        print("parallel and serial tokenize_stream disagree", file=sys.stderr)
+        return 1
+
+    print(f"{size:.1f} MB, {len(tokenize(source_code))} tokens")
+    print(f"{'tokenizer':<16}{'best (s)':>12}{'MB/s':>10}")
+    baseline = best_time(regex_tokenize, source_code, repeat)
+    print(f"{'regex':<16}{baseline:>12.3f}{size / baseline:>10.2f}")
+    functions: list[tuple[str, Callable[[str], object]]] = [
+        ('tokenize', tokenize),
+        ('tokenize_stream', lambda source_code: tokenize_stream(source_code, jobs=1)),
+    ]
+    if jobs > 1:
+        functions.append((f'{jobs} jobs', lambda source_code: tokenize_stream(source_code, jobs)))
+    for name, function in functions:
+        seconds = best_time(function, source_code, repeat)
+        print(f"{name:<16}{seconds:>12.3f}{size / seconds:>10.2f}   {baseline / seconds:.2f}x")
+
+    if memory:
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'program.src')
+            with open(path, 'w') as f:
+                f.write(source_code)
+            print(f"\n{'tokenize + parse':<26}{'peak memory (MB)':>18}")
+            for name, parse_file in (
+                ('whole file', parse_whole_file),
+                ('whole file, TokenStream', parse_token_stream),
+                ('streamed', parse_streamed_file),
+            ):
+                print(f"{name:<26}{peak_memory(parse_file, path) / (1024 * 1024):>18.1f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,62 +1,110 @@
-from base64 import b64encode
-import json
+import os
 import re
 import sys
-from socketserver import ForkingTCPServer, StreamRequestHandler
-from traceback import format_exception
-from typing import Any
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Any, Iterable, Iterator
 
-from compiler.tokenizer import tokenize
-from compiler.parser import parse
-from compiler.type_checker import annotate_types, build_typechecker_root_symtab
-from compiler.ir_generator import generate_ir, ROOT_TYPES
-from compiler.assembly_generator import generate_assembly
-from compiler.assembler import assemble_and_get_executable
-
-
-def call_compiler(source_code: str, input_file_name: str) -> bytes:
-    try:
-        tree = parse(tokenize(source_code))
-        annotate_types(tree, build_typechecker_root_symtab())
-        instructions = generate_ir(ROOT_TYPES, tree)
-        assembly = generate_assembly(instructions)
-        return assemble_and_get_executable(
-            assembly_code=assembly,
-            workdir=None,
-            tempfile_basename="program",
-            link_with_c=False,
-            extra_libraries=[]
-        )
-    except Exception as e:
-        raise RuntimeError(f"Failed to compile: {e}")
+# Everything else is imported by the commands that need it, so that a
+# `compile` doesn't pay for loading the servers and profiling tools.
 
 
 def main() -> int:
     # === Option parsing ===
     command: str | None = None
-    input_file: str | None = None
+    input_files: list[str] = []
     output_file: str | None = None
-    host = "127.0.0.1"
-    port = 3000
+    output_dir: str | None = None
+    jobs = os.cpu_count() or 1
+    server_settings: dict[str, Any] = {}
+    backend = 'builtin'
+    cache_entries = 256
+    cache_dir: str | None = None
+    cache_max_bytes = 256 * 1024 * 1024
+    use_asyncio = False
+    trace_file: str | None = None
+    show_pass_times = False
+    emit_stats = False
+    profile_file: str | None = None
+    stdlib_cache_dir: str | None = None
+    socket_path = os.path.join(os.environ.get('XDG_RUNTIME_DIR') or '/tmp', f'compiler-{os.getuid()}.sock')
+    use_daemon = True
     for arg in sys.argv[1:]:
         if (m := re.fullmatch(r'--output=(.+)', arg)) is not None:
             output_file = m[1]
+        elif (m := re.fullmatch(r'--output-dir=(.+)', arg)) is not None:
+            output_dir = m[1]
+        elif (m := re.fullmatch(r'--jobs=(\d+)', arg)) is not None:
+            jobs = max(1, int(m[1]))
         elif (m := re.fullmatch(r'--host=(.+)', arg)) is not None:
-            host = m[1]
+            server_settings["host"] = m[1]
         elif (m := re.fullmatch(r'--port=(.+)', arg)) is not None:
-            port = int(m[1])
+            server_settings["port"] = int(m[1])
+        elif (m := re.fullmatch(r'--server=(.+)', arg)) is not None:
+            server_settings["model"] = m[1]
+        elif (m := re.fullmatch(r'--workers=(\d+)', arg)) is not None:
+            server_settings["workers"] = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--max-requests-per-worker=(\d+)', arg)) is not None:
+            server_settings["max_requests_per_worker"] = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--max-worker-rss-mb=(\d+)', arg)) is not None:
+            server_settings["max_worker_rss_bytes"] = int(m[1]) * 1024 * 1024
+        elif arg == '--async':
+            use_asyncio = True
+        elif (m := re.fullmatch(r'--queue-depth=(\d+)', arg)) is not None:
+            server_settings["queue_depth"] = int(m[1])
+        elif (m := re.fullmatch(r'--backpressure=(.+)', arg)) is not None:
+            server_settings["backpressure"] = m[1]
+        elif (m := re.fullmatch(r'--queue-timeout=(\d+(?:\.\d+)?)', arg)) is not None:
+            server_settings["queue_timeout"] = float(m[1])
+        elif (m := re.fullmatch(r'--max-connections=(\d+)', arg)) is not None:
+            server_settings["max_connections"] = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--max-frames-in-flight=(\d+)', arg)) is not None:
+            server_settings["max_frames_in_flight"] = max(1, int(m[1]))
+        elif (m := re.fullmatch(r'--max-request-bytes=(\d+)', arg)) is not None:
+            server_settings["max_request_bytes"] = int(m[1])
+        elif (m := re.fullmatch(r'--read-timeout=(\d+(?:\.\d+)?)', arg)) is not None:
+            server_settings["read_timeout"] = float(m[1])
+        elif (m := re.fullmatch(r'--keep-alive-timeout=(\d+(?:\.\d+)?)', arg)) is not None:
+            server_settings["keep_alive_timeout"] = float(m[1])
+        elif (m := re.fullmatch(r'--jit-timeout=(\d+(?:\.\d+)?)', arg)) is not None:
+            server_settings["jit_timeout"] = float(m[1])
+        elif arg == '--emit-stats':
+            emit_stats = True
+        elif arg == '--time-passes':
+            show_pass_times = True
+        elif (m := re.fullmatch(r'--profile=(.+)', arg)) is not None:
+            profile_file = m[1]
+        elif (m := re.fullmatch(r'--trace=(.+)', arg)) is not None:
+            trace_file = m[1]
+        elif (m := re.fullmatch(r'--stats-file=(.+)', arg)) is not None:
+            server_settings["stats_file"] = m[1]
+        elif (m := re.fullmatch(r'--backend=(builtin|toolchain)', arg)) is not None:
+            backend = m[1]
+        elif (m := re.fullmatch(r'--stdlib-cache-dir=(.+)', arg)) is not None:
+            stdlib_cache_dir = m[1]
+        elif (m := re.fullmatch(r'--socket=(.+)', arg)) is not None:
+            socket_path = m[1]
+        elif arg == '--no-daemon':
+            use_daemon = False
+        elif (m := re.fullmatch(r'--cache-entries=(\d+)', arg)) is not None:
+            cache_entries = int(m[1])
+        elif (m := re.fullmatch(r'--cache-dir=(.+)', arg)) is not None:
+            cache_dir = m[1]
+        elif (m := re.fullmatch(r'--cache-max-bytes=(\d+)', arg)) is not None:
+            cache_max_bytes = int(m[1])
         elif arg.startswith('-'):
             raise Exception(f"Unknown argument: {arg}")
         elif command is None:
             command = arg
-        elif input_file is None:
-            input_file = arg
         else:
-            raise Exception("Multiple input files not supported")
+            input_files.append(arg)
 
     if command is None:
         print(f"Error: command argument missing", file=sys.stderr)
         return 1
+    if len(input_files) > 1 and command != 'compile-batch':
+        raise Exception("Multiple input files not supported")
+    input_file = input_files[0] if input_files else None
 
     def read_source_code() -> str:
         if input_file is not None:
@@ -65,18 +113,103 @@ def main() -> int:
         else:
             return sys.stdin.read()
 
+    if stdlib_cache_dir is not None:
+        from compiler.assembler import default_stdlib_cache
+        default_stdlib_cache.cache_dir = stdlib_cache_dir
+
+    if trace_file is not None:
+        if command == 'serve':
+            server_settings["trace_file"] = trace_file
+        else:
+            from compiler.instrument import add_observer, add_recorder
+            from compiler.trace import Tracer
+            tracer = Tracer(trace_file)
+            add_observer(tracer.span)
+            add_recorder(tracer.record_stage)
+
     # === Command implementations ===
 
     if command == 'compile':
-        source_code = read_source_code()
         if output_file is None:
             raise Exception("Output file flag --output=... required")
-        executable = call_compiler(source_code, input_file or '(source code)')
+        source_code = read_source_code() if input_file is None else None
+        # The daemon doesn't know about options that only affect this process
+        only_here = emit_stats or show_pass_times or profile_file or trace_file or stdlib_cache_dir
+        if use_daemon and not only_here and os.path.exists(socket_path):
+            from compiler.daemon import compile_with_daemon
+            if compile_with_daemon(socket_path, output_file, backend, input_file, source_code):
+                return 0
+        from compiler.pipeline import call_compiler, compile_with_stats
+        from compiler.tokenizer import read_source
+        with ExitStack() as files, profile(profile_file), time_passes(show_pass_times):
+            source: str | Iterable[str]
+            if input_file is not None:
+                # Read while it's compiled, unless it's big enough to tokenize in parallel
+                source = read_source(files.enter_context(open(input_file, 'rb')))
+            else:
+                assert source_code is not None
+                source = source_code
+            if emit_stats:
+                import json
+                executable, stats = compile_with_stats(source, input_file or '(source code)', backend)
+                print(json.dumps(stats, indent=2))
+            else:
+                executable = call_compiler(source, input_file or '(source code)', backend)
         with open(output_file, 'wb') as f:
             f.write(executable)
+    elif command == 'jit':
+        from compiler.pipeline import call_jit
+        if input_file is None:
+            raise Exception("The jit command needs a source file, since stdin is the program's input")
+        source_code = read_source_code()
+        with profile(profile_file), time_passes(show_pass_times):
+            result = call_jit(source_code, sys.stdin)
+        sys.stdout.write(result.stdout)
+        sys.stderr.write(result.stderr)
+        return result.exit_code
+    elif command == 'compile-batch':
+        from compiler.batch import compile_batch, find_sources
+        if output_dir is None:
+            raise Exception("Output directory flag --output-dir=... required")
+        if not input_files:
+            raise Exception("No input files given")
+        sources = find_sources(input_files)
+        failed = 0
+        start = time.perf_counter()
+        for batch_result in compile_batch(sources, output_dir, jobs, backend):
+            if batch_result.error is None:
+                print(f"ok      {batch_result.source} ({batch_result.seconds * 1000:.1f} ms)")
+            else:
+                failed += 1
+                print(f"FAILED  {batch_result.source} ({batch_result.seconds * 1000:.1f} ms): {batch_result.error}")
+        print(f"{len(sources) - failed} compiled, {failed} failed in {time.perf_counter() - start:.2f} s")
+        return 1 if failed else 0
+    elif command == 'daemon':
+        from compiler.daemon import run_daemon
+        try:
+            run_daemon(socket_path, backend)
+        except KeyboardInterrupt:
+            pass
     elif command == 'serve':
+        from compiler.executable_cache import ExecutableCache
+        from compiler.metrics import Metrics
+        from compiler.server_options import BACKPRESSURE_POLICIES, SERVER_MODELS, ServerOptions
+        if server_settings.get("model", SERVER_MODELS[0]) not in SERVER_MODELS:
+            raise Exception(f"Unknown argument: --server={server_settings['model']}")
+        if server_settings.get("backpressure", BACKPRESSURE_POLICIES[0]) not in BACKPRESSURE_POLICIES:
+            raise Exception(f"Unknown argument: --backpressure={server_settings['backpressure']}")
+        server_settings["backend"] = backend
+        if cache_entries > 0:
+            server_settings["cache"] = ExecutableCache(cache_entries, cache_dir, cache_max_bytes)
+        server_settings["metrics"] = Metrics()
+        server_options = ServerOptions(**server_settings)
         try:
-            run_server(host, port)
+            if use_asyncio:
+                from compiler.async_server import run_async_server
+                run_async_server(server_options)
+            else:
+                from compiler.server import run_server
+                run_server(server_options)
         except KeyboardInterrupt:
             pass
     else:
@@ -85,33 +218,24 @@ def main() -> int:
     return 0
 
 
-def run_server(host: str, port: int) -> None:
-    class Server(ForkingTCPServer):
-        allow_reuse_address = True
-        request_queue_size = 32
+@contextmanager
+def profile(profile_file: str | None) -> Iterator[None]:
+    if profile_file is None:
+        yield
+        return
+    from compiler import profiling
+    with profiling.profile(profile_file):
+        yield
 
-    class Handler(StreamRequestHandler):
-        def handle(self) -> None:
-            result: dict[str, Any] = {}
-            try:
-                input_str = self.rfile.read().decode()
-                input = json.loads(input_str)
-                if input["command"] == "compile":
-                    source_code = input["code"]
-                    executable = call_compiler(source_code, "(source code)")
-                    result["program"] = b64encode(executable).decode()
-                elif input["command"] == "ping":
-                    pass
-                else:
-                    result["error"] = "Unknown command: " + input['command']
-            except Exception as e:
-                result["error"] = "".join(format_exception(e))
-            result_str = json.dumps(result)
-            self.request.sendall(str.encode(result_str))
 
-    print(f"Starting TCP server at {host}:{port}")
-    with Server((host, port), Handler) as server:
-        server.serve_forever()
+@contextmanager
+def time_passes(enabled: bool) -> Iterator[None]:
+    if not enabled:
+        yield
+        return
+    from compiler import profiling
+    with profiling.time_passes(True):
+        yield
 
 
 if __name__ == '__main__':
@@ -1,12 +1,101 @@
-import subprocess
-import tempfile
+import atexit
+import os
+import threading
 from os import path
 from typing import Callable, TypeVar
-import shutil
-from pathlib import Path
+
+from compiler import elf_writer, x86_encoder
+# hashlib, shutil, subprocess and tempfile are imported where the toolchain
+# needs them. Builtin backend compilations never do, and they slow down startup.
+from compiler.instrument import stage
 
 T = TypeVar('T')
 
+BACKENDS = ('builtin', 'toolchain')
+
+
+class StdlibObjectCache:
+    """Assembles the stdlib once and reuses the object file for every link.
+
+    Objects are keyed by a hash of the exact assembly text, so the variant
+    without `_start` (used when linking with C) is cached separately.
+    If `cache_dir` is given, objects are stored there and shared with later
+    processes. Otherwise they live in a scratch directory owned by this process.
+    """
+    cache_dir: str | None
+    _objects: dict[str, str]
+    _scratch_dir: str | None
+    _scratch_owner: int | None
+
+    def __init__(self, cache_dir: str | None = None) -> None:
+        self.cache_dir = cache_dir
+        self._objects = {}
+        self._scratch_dir = None
+        self._scratch_owner = None
+        self._unit: x86_encoder.Unit | None = None
+
+    def get(self, link_with_c: bool) -> str:
+        """Returns the path of the assembled stdlib object, building it if needed."""
+        import hashlib
+        import subprocess
+        import tempfile
+        code = drop_start_symbol(stdlib_asm_code) if link_with_c else stdlib_asm_code
+        key = hashlib.sha256(code.encode()).hexdigest()
+        object_path = self._objects.get(key)
+        if object_path is not None and path.exists(object_path):
+            return object_path
+
+        object_path = path.join(self._directory(), f'stdlib-{key[:16]}.o')
+        if not path.exists(object_path):
+            # Assemble under a unique name and rename, so that concurrent
+            # processes sharing `cache_dir` never see a partial object.
+            fd, tmp_path = tempfile.mkstemp(dir=path.dirname(object_path), suffix='.o.tmp')
+            os.close(fd)
+            try:
+                subprocess.run(['as', '-g', '-o', tmp_path], input=code.encode(), check=True)
+                os.replace(tmp_path, object_path)
+            except BaseException:
+                if path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+        self._objects[key] = object_path
+        return object_path
+
+    def get_unit(self) -> x86_encoder.Unit:
+        """Returns the stdlib encoded by the built-in backend."""
+        if self._unit is None:
+            self._unit = x86_encoder.parse_unit(stdlib_asm_code)
+        return self._unit
+
+    def warm(self) -> None:
+        """Builds all variants up front, e.g. before forking workers."""
+        import shutil
+        self.get_unit()
+        if shutil.which('as') is not None:
+            self.get(link_with_c=False)
+            self.get(link_with_c=True)
+
+    def _directory(self) -> str:
+        if self.cache_dir is not None:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            return self.cache_dir
+        if self._scratch_dir is None:
+            import tempfile
+            self._scratch_dir = tempfile.mkdtemp(prefix='compiler_stdlib_')
+            self._scratch_owner = os.getpid()
+            atexit.register(self._remove_scratch_dir)
+        return self._scratch_dir
+
+    def _remove_scratch_dir(self) -> None:
+        # Forked children inherit atexit handlers but must not delete
+        # the directory that their parent and siblings still use.
+        if self._scratch_dir is not None and self._scratch_owner == os.getpid():
+            import shutil
+            shutil.rmtree(self._scratch_dir, ignore_errors=True)
+
+
+default_stdlib_cache = StdlibObjectCache()
+
 
 def assemble(
     assembly_code: str,
@@ -15,18 +104,28 @@ def assemble(
     tempfile_basename: str = 'program',
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    stdlib_cache: StdlibObjectCache | None = None,
+    backend: str = 'builtin',
 ) -> None:
-    """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
+    """Generates an executable file from Assembly code.
 
     The file is written to the given path.
+    See `assemble_and_get_executable` for the meaning of `backend`.
     """
+    executable = _assemble_builtin(assembly_code, link_with_c, extra_libraries, stdlib_cache, backend)
+    if executable is not None:
+        with open(output_file, 'wb') as f:
+            f.write(executable)
+        os.chmod(output_file, 0o755)
+        return
     _assemble(
         assembly_code=assembly_code,
         workdir=workdir,
         tempfile_basename=tempfile_basename,
         link_with_c=link_with_c,
         extra_libraries=extra_libraries,
-        take_output=lambda f: shutil.move(f, output_file)
+        stdlib_cache=stdlib_cache,
+        take_output=lambda fd: _copy_fd_to_file(fd, output_file)
     )
 
 
@@ -36,35 +135,68 @@ def assemble_and_get_executable(
     tempfile_basename: str = 'program',
     link_with_c: bool = False,
     extra_libraries: list[str] = [],
+    stdlib_cache: StdlibObjectCache | None = None,
+    backend: str = 'builtin',
 ) -> bytes:
-    """Invokes 'as' and 'ld' to generate an executable file from Assembly code.
+    """Generates an executable file from Assembly code.
 
     The file is returned.
+
+    The 'builtin' backend encodes the code in-process and writes the ELF file
+    itself. It falls back to the 'toolchain' backend, which invokes 'as' and 'ld',
+    when linking with C or other libraries, or when it does not support
+    an instruction in the code.
     """
+    executable = _assemble_builtin(assembly_code, link_with_c, extra_libraries, stdlib_cache, backend)
+    if executable is not None:
+        return executable
     return _assemble(
         assembly_code=assembly_code,
         workdir=workdir,
         tempfile_basename=tempfile_basename,
         link_with_c=link_with_c,
         extra_libraries=extra_libraries,
-        take_output=lambda f: Path(f).read_bytes()
+        stdlib_cache=stdlib_cache,
+        take_output=_read_fd
     )
 
 
+def _assemble_builtin(
+    assembly_code: str,
+    link_with_c: bool,
+    extra_libraries: list[str],
+    stdlib_cache: StdlibObjectCache | None,
+    backend: str,
+) -> bytes | None:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown assembler backend: {backend}")
+    if backend != 'builtin' or link_with_c or extra_libraries:
+        return None
+    cache = stdlib_cache if stdlib_cache is not None else default_stdlib_cache
+    with stage('encode'):
+        try:
+            program = x86_encoder.parse_unit(assembly_code)
+            linked = x86_encoder.link([program, cache.get_unit()], elf_writer.code_address())
+        except x86_encoder.AssemblyError:
+            return None
+        return elf_writer.write_executable(linked.code, entry=linked.symbols['_start'])
+
+
 def _assemble(
     assembly_code: str,
     workdir: str | None,
     tempfile_basename: str,
     link_with_c: bool,
     extra_libraries: list[str],
-    take_output: Callable[[str], T],
+    stdlib_cache: StdlibObjectCache | None,
+    take_output: Callable[[int], T],
 ) -> T:
+    cache = stdlib_cache if stdlib_cache is not None else default_stdlib_cache
     if workdir is not None:
-        wd = Path(workdir).absolute().as_posix()
-        return _assemble_impl(assembly_code, wd, tempfile_basename, link_with_c, extra_libraries, take_output)
+        wd = path.abspath(workdir)
+        return _assemble_impl(assembly_code, wd, tempfile_basename, link_with_c, extra_libraries, cache, take_output)
     else:
-        with tempfile.TemporaryDirectory(prefix='compiler_') as wd:
-            return _assemble_impl(assembly_code, wd, tempfile_basename, link_with_c, extra_libraries, take_output)
+        return _assemble_piped(assembly_code, link_with_c, extra_libraries, cache, take_output)
 
 
 def _assemble_impl(
@@ -73,39 +205,143 @@ def _assemble_impl(
     tempfile_basename: str,
     link_with_c: bool,
     extra_libraries: list[str],
-    take_output: Callable[[str], T],
+    stdlib_cache: StdlibObjectCache,
+    take_output: Callable[[int], T],
 ) -> T:
-    stdlib_asm = path.join(workdir, 'stdlib.s')
-    stdlib_obj = path.join(workdir, 'stdlib.o')
+    import subprocess
+    stdlib_obj = stdlib_cache.get(link_with_c)
     program_asm = path.join(workdir, f'{tempfile_basename}.s')
     program_obj = path.join(workdir, f'{tempfile_basename}.o')
     output_file = path.join(workdir, 'a.out')
 
-    if link_with_c:
-        final_stdlib_asm_code = drop_start_symbol(stdlib_asm_code)
-    else:
-        final_stdlib_asm_code = stdlib_asm_code
-
-    with open(stdlib_asm, 'w') as f:
-        f.write(final_stdlib_asm_code)
     with open(program_asm, 'w') as f:
         f.write(assembly_code)
-    subprocess.run(['as', '-g', '-o' +
-                    stdlib_obj, stdlib_asm], check=True)
-    subprocess.run(['as', '-g', '-o' +
-                    program_obj, program_asm], check=True)
-    linker_flags = ['-static', *[f'-l{lib}' for lib in extra_libraries]]
-    if link_with_c:
-        # Linking with the C standard library correctly is complicated,
-        # as evidenced by the complicated linker command shown by `cc -v something.c`.
-        # Instead of trying to build the right `ld` command ourselves, we use the C compiler
-        # to do the linking.
-        subprocess.run(
-            ['cc', '-o' + output_file, *linker_flags, stdlib_obj, program_obj], check=True)
-    else:
+    with stage('as'):
+        subprocess.run(['as', '-g', '-o' +
+                        program_obj, program_asm], check=True)
+    _link(output_file, stdlib_obj, program_obj, link_with_c, extra_libraries, pass_fds=())
+    fd = os.open(output_file, os.O_RDONLY)
+    try:
+        return take_output(fd)
+    finally:
+        os.close(fd)
+
+
+def _assemble_piped(
+    assembly_code: str,
+    link_with_c: bool,
+    extra_libraries: list[str],
+    stdlib_cache: StdlibObjectCache,
+    take_output: Callable[[int], T],
+) -> T:
+    """Like `_assemble_impl`, but without a temporary directory.
+
+    The assembly is piped to `as`, and the object file and executable
+    are written to this thread's reusable scratch files.
+    """
+    import subprocess
+    stdlib_obj = stdlib_cache.get(link_with_c)
+    scratch = _scratch_files()
+    for fd in (scratch.object_fd, scratch.output_fd):
+        os.ftruncate(fd, 0)
+    with stage('as'):
         subprocess.run(
-            ['ld', '-o' + output_file, *linker_flags, stdlib_obj, program_obj], check=True)
-    return take_output(output_file)
+            ['as', '-g', '-o', scratch.object_path, '-'],
+            input=assembly_code.encode(),
+            pass_fds=scratch.pass_fds,
+            check=True,
+        )
+    _link(scratch.output_path, stdlib_obj, scratch.object_path,
+          link_with_c, extra_libraries, pass_fds=scratch.pass_fds)
+    return take_output(scratch.output_fd)
+
+
+def _link(
+    output_file: str,
+    stdlib_obj: str,
+    program_obj: str,
+    link_with_c: bool,
+    extra_libraries: list[str],
+    pass_fds: tuple[int, ...],
+) -> None:
+    import subprocess
+    linker_flags = ['-static', *[f'-l{lib}' for lib in extra_libraries]]
+    with stage('ld'):
+        if link_with_c:
+            # Linking with the C standard library correctly is complicated,
+            # as evidenced by the complicated linker command shown by `cc -v something.c`.
+            # Instead of trying to build the right `ld` command ourselves, we use the C compiler
+            # to do the linking.
+            subprocess.run(
+                ['cc', '-o' + output_file, *linker_flags, stdlib_obj, program_obj],
+                pass_fds=pass_fds, check=True)
+        else:
+            subprocess.run(
+                ['ld', '-o' + output_file, *linker_flags, stdlib_obj, program_obj],
+                pass_fds=pass_fds, check=True)
+
+
+class _ScratchFiles:
+    """An object file and an executable that are reused across compilations.
+
+    They are anonymous memfds where supported. Tools reach them through
+    `/dev/fd/N`, so the file descriptors must be passed to subprocesses.
+    Elsewhere they are plain files in a tmpfs-backed directory if one exists.
+    """
+    object_fd: int
+    output_fd: int
+    object_path: str
+    output_path: str
+    pass_fds: tuple[int, ...]
+
+    def __init__(self) -> None:
+        if hasattr(os, 'memfd_create') and path.isdir('/dev/fd'):
+            self.object_fd = os.memfd_create('program.o', os.MFD_CLOEXEC)
+            self.output_fd = os.memfd_create('a.out', os.MFD_CLOEXEC)
+            self.object_path = f'/dev/fd/{self.object_fd}'
+            self.output_path = f'/dev/fd/{self.output_fd}'
+            self.pass_fds = (self.object_fd, self.output_fd)
+        else:
+            import shutil
+            import tempfile
+            tmpfs = '/dev/shm' if path.isdir('/dev/shm') else None
+            directory = tempfile.mkdtemp(prefix='compiler_scratch_', dir=tmpfs)
+            atexit.register(shutil.rmtree, directory, True)
+            self.object_path = path.join(directory, 'program.o')
+            self.output_path = path.join(directory, 'a.out')
+            self.object_fd = os.open(self.object_path, os.O_RDWR | os.O_CREAT, 0o600)
+            self.output_fd = os.open(self.output_path, os.O_RDWR | os.O_CREAT, 0o700)
+            self.pass_fds = ()
+
+
+_scratch = threading.local()
+
+
+def _scratch_files() -> _ScratchFiles:
+    # Forked children must not share their parent's files, and neither may threads.
+    files: _ScratchFiles | None = getattr(_scratch, 'files', None)
+    if files is None or getattr(_scratch, 'pid', None) != os.getpid():
+        files = _ScratchFiles()
+        _scratch.files = files
+        _scratch.pid = os.getpid()
+    return files
+
+
+def _read_fd(fd: int) -> bytes:
+    return os.pread(fd, os.fstat(fd).st_size, 0)
+
+
+def _copy_fd_to_file(fd: int, output_file: str) -> None:
+    size = os.fstat(fd).st_size
+    with open(output_file, 'wb') as f:
+        # Copies inside the kernel, without passing the data through Python.
+        offset = 0
+        while offset < size:
+            copied = os.sendfile(f.fileno(), fd, offset, size - offset)
+            if copied == 0:
+                break
+            offset += copied
+    os.chmod(output_file, 0o755)
 
 
 def drop_start_symbol(code: str) -> str:
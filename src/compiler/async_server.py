@@ -0,0 +1,418 @@
+"""An asyncio variant of the compile server, started with `serve --async`.
+
+Connections are handled by a single event loop, which makes idle and
+slow clients cheap. Cache hits are answered on the event loop, and other
+work goes to a pool of worker processes.
+
+At most `workers` requests run at once and at most `queue_depth` more
+wait for a worker. What happens to the rest depends on `backpressure`:
+'reject' answers them at once with an error, while 'wait' lets them wait
+up to `queue_timeout` seconds for a place in the queue before erroring.
+Requests are limited to `max_request_bytes` and must arrive within
+`read_timeout` seconds, so memory use and latency stay bounded under bursts.
+Each program of a `compile_many` batch counts as a request of its own.
+
+Requests on a framed connection (see `compiler.protocol`) run concurrently,
+and each is answered as soon as it completes. Once `max_frames_in_flight`
+of them are running, the connection isn't read until one of them is done.
+
+Workers report how long each compile stage took, and the event loop records
+that in `options.metrics` along with how long the request waited for a worker.
+Reads and writes on the event loop of concurrent requests overlap, so their
+trace spans don't nest, and accepting isn't traced.
+"""
+import asyncio
+import dataclasses
+import json
+import multiprocessing
+import signal
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from traceback import format_exception
+from typing import Any
+
+from compiler.assembler import default_stdlib_cache
+from compiler.executable_cache import ExecutableCache
+from compiler.instrument import add_observer, add_recorder, stage
+from compiler.metrics import collect_stages
+from compiler.protocol import (
+    MAGIC, ProtocolError, encode_executables, encode_frame, frame_request, frame_size, read_frame_async,
+)
+from compiler.server import (
+    ServerOptions, dump_stats, handle_command, record_request, run_command, warm_up,
+)
+from compiler.trace import Tracer
+
+# Commands cheap enough to answer on the event loop.
+INLINE_COMMANDS = {"ping", "stats"}
+
+_worker_options: ServerOptions | None = None
+
+
+class ServerBusy(Exception):
+    pass
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _init_worker(options: ServerOptions, stdlib_cache_dir: str | None) -> None:
+    global _worker_options
+    # Ctrl-C reaches the whole process group. The server shuts us down.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _worker_options = options
+    default_stdlib_cache.cache_dir = stdlib_cache_dir
+    warm_up(options)
+    if options.trace_file is not None:
+        tracer = Tracer(options.trace_file)
+        add_observer(tracer.span)
+        add_recorder(tracer.record_stage)
+
+
+def _run_in_worker(request: dict[str, Any]) -> tuple[dict[str, Any], list[tuple[str, float]], float]:
+    """Runs a request. Also returns the durations of its stages and the total time it took."""
+    assert _worker_options is not None
+    start = time.perf_counter()
+    with collect_stages() as stages:
+        try:
+            result = run_command(request, _worker_options)
+        except Exception as e:
+            result = {"error": "".join(format_exception(e))}
+    return result, stages, time.perf_counter() - start
+
+
+def _ready() -> None:
+    pass
+
+
+class _WorkerPool:
+    """A process pool that is replaced if one of its workers dies.
+
+    Workers are forked from a forkserver rather than from this process,
+    so they never inherit the event loop's threads or client sockets.
+    JIT runs crash in children of the workers, so they don't count.
+    """
+    options: ServerOptions
+    _executor: ProcessPoolExecutor
+    _restart_lock: asyncio.Lock | None
+
+    def __init__(self, options: ServerOptions) -> None:
+        # Workers get no cache or metrics. They're kept on the event loop instead.
+        self.options = dataclasses.replace(options, cache=None, metrics=None)
+        self._restart_lock = None
+        self._executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        executor = ProcessPoolExecutor(
+            max_workers=self.options.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.options, default_stdlib_cache.cache_dir),
+        )
+        # Each submission to an idle pool starts one more worker.
+        for future in [executor.submit(_ready) for _ in range(self.options.workers)]:
+            future.result()
+        return executor
+
+    async def run(self, request: dict[str, Any]) -> tuple[dict[str, Any], list[tuple[str, float]], float]:
+        """Returns what `_run_in_worker` does."""
+        executor = self._executor
+        try:
+            future = executor.submit(_run_in_worker, request)
+        except BrokenProcessPool:
+            # A worker died earlier. This request never ran, so run it on a new pool.
+            executor = await self._restart(executor)
+            future = executor.submit(_run_in_worker, request)
+        try:
+            return await asyncio.wrap_future(future)
+        except BrokenProcessPool:
+            await self._restart(executor)
+            return {"error": "Worker process died while handling the request"}, [], 0.0
+
+    async def _restart(self, broken: ProcessPoolExecutor) -> ProcessPoolExecutor:
+        if self._restart_lock is None:
+            self._restart_lock = asyncio.Lock()
+        async with self._restart_lock:
+            if self._executor is broken:
+                self._executor = await asyncio.get_running_loop().run_in_executor(None, self._start)
+                broken.shutdown(wait=False)
+        return self._executor
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+
+class _AdmissionControl:
+    """Limits the number of requests that are running or queued."""
+    capacity: int
+    in_system: int
+    options: ServerOptions
+    _slot_freed: asyncio.Condition
+
+    def __init__(self, options: ServerOptions) -> None:
+        self.options = options
+        self.capacity = options.workers + options.queue_depth
+        self.in_system = 0
+        self._slot_freed = asyncio.Condition()
+
+    async def acquire(self) -> None:
+        if self.in_system < self.capacity:
+            self.in_system += 1
+            return
+        if self.options.backpressure == 'reject':
+            raise ServerBusy(self._busy_message())
+        async with self._slot_freed:
+            try:
+                await asyncio.wait_for(
+                    self._slot_freed.wait_for(lambda: self.in_system < self.capacity),
+                    timeout=self.options.queue_timeout,
+                )
+            except TimeoutError:
+                raise ServerBusy(self._busy_message() + f" after waiting {self.options.queue_timeout}s")
+            self.in_system += 1
+
+    async def release(self) -> None:
+        async with self._slot_freed:
+            self.in_system -= 1
+            self._slot_freed.notify()
+
+    def _busy_message(self) -> str:
+        return (
+            f"Server busy: {self.options.queue_depth} requests already queued "
+            f"for {self.options.workers} workers"
+        )
+
+
+def run_async_server(options: ServerOptions) -> None:
+    warm_up(options)
+    if options.trace_file is not None:
+        tracer = Tracer(options.trace_file)
+        add_observer(tracer.span)
+        add_recorder(tracer.record_stage)
+    # Start the pool before the event loop's threads exist.
+    pool = _WorkerPool(options)
+    try:
+        asyncio.run(_serve(options, pool))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pool.shutdown()
+        dump_stats(options)
+
+
+async def _serve(options: ServerOptions, pool: _WorkerPool) -> None:
+    admission = _AdmissionControl(options)
+    connections = asyncio.Semaphore(options.max_connections)
+
+    async def handle_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if connections.locked():
+            await _respond(writer, json.dumps({"error": "Server busy: too many open connections"}).encode())
+            return
+        async with connections:
+            result: dict[str, Any]
+            start = time.perf_counter()
+            request_bytes = b""
+            try:
+                async with asyncio.timeout(options.read_timeout):
+                    first = await reader.read(1)
+                if first == MAGIC[:1]:
+                    await _serve_frames(reader, writer, options, admission, pool)
+                    return
+                with stage('read'):
+                    request_bytes = first + await _read_request(reader, options)
+                start = time.perf_counter()
+                result = await _dispatch(json.loads(request_bytes), options, admission, pool, framed=False)
+            except (ServerBusy, BadRequest, ProtocolError) as e:
+                result = {"error": str(e)}
+            except TimeoutError:
+                result = {"error": f"Request not received within {options.read_timeout}s"}
+            except Exception as e:
+                result = {"error": "".join(format_exception(e))}
+            response_bytes = json.dumps(result).encode()
+            with stage('write'):
+                await _respond(writer, response_bytes)
+            record_request(options.metrics, start, len(request_bytes), len(response_bytes))
+
+    loop = asyncio.get_running_loop()
+    stop = loop.create_future()
+    loop.add_signal_handler(signal.SIGTERM, stop.set_result, None)
+    loop.add_signal_handler(signal.SIGUSR1, dump_stats, options)
+
+    server = await asyncio.start_server(
+        handle_connection, options.host, options.port, reuse_address=True, backlog=1024)
+    print(f"Starting asyncio TCP server at {options.host}:{options.port}")
+    async with server:
+        await stop
+
+
+async def _read_request(reader: asyncio.StreamReader, options: ServerOptions) -> bytes:
+    chunks = []
+    size = 0
+    try:
+        async with asyncio.timeout(options.read_timeout):
+            while chunk := await reader.read(64 * 1024):
+                size += len(chunk)
+                if size > options.max_request_bytes:
+                    raise BadRequest(f"Request larger than {options.max_request_bytes} bytes")
+                chunks.append(chunk)
+    except TimeoutError:
+        raise BadRequest(f"Request not received within {options.read_timeout}s")
+    return b"".join(chunks)
+
+
+async def _serve_frames(
+    reader: asyncio.StreamReader,
+    writer: asyncio.StreamWriter,
+    options: ServerOptions,
+    admission: _AdmissionControl,
+    pool: _WorkerPool,
+) -> None:
+    """Runs the requests of a framed connection concurrently and answers each when done."""
+    in_flight: set[asyncio.Task[None]] = set()
+    slots = asyncio.Semaphore(options.max_frames_in_flight)
+
+    async def answer(header: dict[str, Any], body: bytes) -> None:
+        try:
+            start = time.perf_counter()
+            result: dict[str, Any]
+            try:
+                result = await _dispatch(frame_request(header, body), options, admission, pool, framed=True)
+            except (ServerBusy, ProtocolError) as e:
+                result = {"error": str(e)}
+            except Exception as e:
+                result = {"error": "".join(format_exception(e))}
+            result["id"] = header.get("id")
+            response = encode_frame(result)
+            with stage('write'):
+                writer.write(response)
+                await writer.drain()
+            record_request(options.metrics, start, frame_size(header, body), len(response))
+        finally:
+            slots.release()
+
+    try:
+        async with asyncio.timeout(options.read_timeout):
+            if MAGIC[:1] + await reader.readexactly(len(MAGIC) - 1) != MAGIC:
+                raise ProtocolError("Unknown protocol")
+        while True:
+            # Not reading more frames bounds the memory a single connection can take
+            await slots.acquire()
+            # An idle connection is closed after `read_timeout`.
+            async with asyncio.timeout(options.read_timeout):
+                with stage('read'):
+                    frame = await read_frame_async(reader, options.max_request_bytes)
+            if frame is None:
+                break
+            task = asyncio.create_task(answer(*frame))
+            in_flight.add(task)
+            task.add_done_callback(in_flight.discard)
+    except ProtocolError as e:
+        writer.write(encode_frame({"id": None, "error": str(e)}))
+    except (TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+        pass
+    try:
+        await asyncio.gather(*in_flight)
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+async def _dispatch(
+    request: dict[str, Any],
+    options: ServerOptions,
+    admission: _AdmissionControl,
+    pool: _WorkerPool,
+    framed: bool,
+) -> dict[str, Any]:
+    if request["command"] in INLINE_COMMANDS:
+        result = handle_command(request, options)
+        if request["command"] == "stats":
+            result["queue"] = {"in_system": admission.in_system, "capacity": admission.capacity}
+        return result
+    return encode_executables(await _run_cached(request, options, admission, pool), request, framed)
+
+
+async def _run_cached(
+    request: dict[str, Any],
+    options: ServerOptions,
+    admission: _AdmissionControl,
+    pool: _WorkerPool,
+) -> dict[str, Any]:
+    if request["command"] == "compile_many":
+        return {"results": await _compile_many(request["programs"], options, admission, pool)}
+    cache = options.cache
+    if cache is None or request["command"] != "compile" or request.get("code_stats"):
+        return await _run_in_pool(request, options, admission, pool)
+
+    # The workers have no cache, so look up and store executables here.
+    key = ExecutableCache.key(request["code"], {"backend": options.backend})
+    executable = cache.get(key)
+    if executable is not None:
+        return {"program": executable}
+    result = await _run_in_pool(request, options, admission, pool)
+    if "program" in result:
+        cache.put(key, result["program"])
+    return result
+
+
+async def _compile_many(
+    sources: list[str],
+    options: ServerOptions,
+    admission: _AdmissionControl,
+    pool: _WorkerPool,
+) -> list[dict[str, Any]]:
+    """Compiles each program of a batch as a request of its own, so each takes a place in the queue."""
+    cache = options.cache
+
+    async def compile_one(source_code: str) -> dict[str, Any]:
+        key = ExecutableCache.key(source_code, {"backend": options.backend})
+        executable = cache.get(key) if cache is not None else None
+        if executable is not None:
+            return {"program": executable}
+        try:
+            response = await _run_in_pool(
+                {"command": "compile_many", "programs": [source_code]}, options, admission, pool)
+        except ServerBusy as e:
+            return {"error": str(e)}
+        if "error" in response:
+            return response
+        result: dict[str, Any] = response["results"][0]
+        if "program" in result and cache is not None:
+            cache.put(key, result["program"])
+        return result
+
+    return list(await asyncio.gather(*(compile_one(source_code) for source_code in sources)))
+
+
+async def _run_in_pool(
+    request: dict[str, Any],
+    options: ServerOptions,
+    admission: _AdmissionControl,
+    pool: _WorkerPool,
+) -> dict[str, Any]:
+    start = time.perf_counter()
+    await admission.acquire()
+    try:
+        result, stages, run_time = await pool.run(request)
+    finally:
+        await admission.release()
+    metrics = options.metrics
+    if metrics is not None:
+        metrics.record_stages(stages)
+        metrics.record("queue_wait", time.perf_counter() - start - run_time)
+    return result
+
+
+async def _respond(writer: asyncio.StreamWriter, response: bytes) -> None:
+    try:
+        writer.write(response)
+        await writer.drain()
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
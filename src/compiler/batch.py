@@ -0,0 +1,81 @@
+"""Compiling many source files at once, behind `compiler.sh compile-batch`.
+
+Inputs are files, directories (searched recursively for `*.src` files) or
+glob patterns. Executables are written to an output directory, under the
+path of their source relative to the deepest directory containing all
+sources, without the `.src` extension. A file that fails to compile is
+reported and the rest are compiled anyway.
+"""
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Iterator
+
+from compiler.assembler import default_stdlib_cache
+from compiler.pipeline import call_compiler
+from compiler.tokenizer import read_source
+
+
+@dataclass
+class BatchResult:
+    source: str
+    output: str
+    seconds: float
+    error: str | None = None
+
+
+def find_sources(inputs: list[str]) -> list[str]:
+    """Expands directories and glob patterns, keeping the order of the inputs."""
+    sources: list[str] = []
+    for input in inputs:
+        if os.path.isdir(input):
+            matches = sorted(glob.glob(os.path.join(glob.escape(input), '**', '*.src'), recursive=True))
+        elif os.path.exists(input):
+            matches = [input]
+        else:
+            matches = sorted(path for path in glob.glob(input, recursive=True) if not os.path.isdir(path))
+        if not matches:
+            raise Exception(f"No source files found for {input}")
+        sources += [path for path in matches if path not in sources]
+    return sources
+
+
+def output_paths(sources: list[str], output_dir: str) -> list[str]:
+    base = os.path.commonpath([os.path.dirname(os.path.abspath(source)) for source in sources])
+    return [
+        os.path.join(output_dir, os.path.splitext(os.path.relpath(os.path.abspath(source), base))[0])
+        for source in sources
+    ]
+
+
+def compile_file(source: str, output: str, backend: str) -> BatchResult:
+    start = time.perf_counter()
+    try:
+        with open(source, 'rb') as f:
+            executable = call_compiler(read_source(f), source, backend)
+        os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+        with open(output, 'wb') as f:
+            f.write(executable)
+    except Exception as e:
+        return BatchResult(source, output, time.perf_counter() - start, str(e))
+    return BatchResult(source, output, time.perf_counter() - start)
+
+
+def compile_batch(sources: list[str], output_dir: str, jobs: int, backend: str = 'builtin') -> Iterator[BatchResult]:
+    """Compiles the sources on up to `jobs` cores, yielding results in the order of `sources`."""
+    outputs = output_paths(sources, output_dir)
+    jobs = min(jobs, len(sources))
+    if jobs <= 1:
+        for source, output in zip(sources, outputs):
+            yield compile_file(source, output, backend)
+        return
+    # Forked, so the children start with the warm stdlib
+    default_stdlib_cache.warm()
+    with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context('fork')) as pool:
+        yield from pool.map(
+            compile_file, sources, outputs, [backend] * len(sources),
+            chunksize=max(1, len(sources) // (jobs * 4)),
+        )
@@ -0,0 +1,76 @@
+"""Client side of the compile server protocol."""
+import json
+import socket
+from typing import Any
+
+from compiler.protocol import MAGIC, encode_frame, read_frame
+
+
+def send_request(host: str, port: int, request: dict[str, Any], timeout: float | None = None) -> dict[str, Any]:
+    """Sends one request on a new connection and returns the decoded response."""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.sendall(json.dumps(request).encode())
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+    response: dict[str, Any] = json.loads(b"".join(chunks))
+    return response
+
+
+class Connection:
+    """A keep-alive connection that speaks the framed protocol.
+
+    Pipeline requests with `send` and `receive`, or use `request`
+    to send one and wait for its response.
+    """
+    _sock: socket.socket
+    _next_id: int
+    _early: dict[Any, tuple[dict[str, Any], bytes]]
+
+    def __init__(self, host: str, port: int, timeout: float | None = None) -> None:
+        self._sock = socket.create_connection((host, port), timeout=timeout)
+        # Requests are small and the next one waits for the response
+        self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._file = self._sock.makefile('rb')
+        self._next_id = 0
+        self._early = {}
+        self._sock.sendall(MAGIC)
+
+    def send(self, request: dict[str, Any], body: bytes = b"") -> int:
+        """Sends a request without waiting and returns its id."""
+        request_id = self._next_id
+        self._next_id += 1
+        self._sock.sendall(encode_frame({**request, "id": request_id}, body))
+        return request_id
+
+    def receive(self) -> tuple[dict[str, Any], bytes]:
+        """Returns the next response header and body, whichever request it is for."""
+        if self._early:
+            return self._early.pop(next(iter(self._early)))
+        return self._read()
+
+    def request(self, request: dict[str, Any], body: bytes = b"") -> dict[str, Any]:
+        request_id = self.send(request, body)
+        while request_id not in self._early:
+            header, response_body = self._read()
+            if header.get("id") is None:
+                raise ConnectionError(header.get("error", "Protocol error"))
+            self._early[header["id"]] = (header, response_body)
+        return self._early.pop(request_id)[0]
+
+    def _read(self) -> tuple[dict[str, Any], bytes]:
+        frame = read_frame(self._file, max_bytes=1 << 32)
+        if frame is None:
+            raise ConnectionError("Server closed the connection")
+        return frame
+
+    def close(self) -> None:
+        self._file.close()
+        self._sock.close()
+
+    def __enter__(self) -> 'Connection':
+        return self
+
+    def __exit__(self, *args: object) -> None:
+        self.close()
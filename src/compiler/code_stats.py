@@ -0,0 +1,37 @@
+"""Measures of how good the generated code for a program is."""
+import re
+from collections import Counter
+from typing import Any
+
+from compiler import ir
+from compiler.assembly_generator import Locals, get_all_ir_variables
+
+_LOAD_FROM_STACK = re.compile(r'movq -\d+\(%rbp\), %rax')
+_STORE_TO_STACK = re.compile(r'movq %rax, -\d+\(%rbp\)')
+
+
+def code_stats(instructions: list[ir.Instruction], assembly: str, executable: bytes) -> dict[str, Any]:
+    """Returns the IR instruction mix, stack usage and size of the generated code.
+
+    A memory-to-memory move is a load of a stack slot into %rax that is
+    immediately stored to another stack slot, which is how every `Copy`
+    is emitted.
+    """
+    mix = Counter(type(insn).__name__ for insn in instructions)
+    lines = [line.strip() for line in assembly.splitlines()]
+    code_lines = [line for line in lines if line and not line.startswith('.') and not line.endswith(':')]
+    return {
+        "ir_instructions": len(instructions),
+        "ir_instruction_mix": dict(sorted(mix.items())),
+        "copies": mix["Copy"],
+        "jumps": mix["Jump"],
+        "cond_jumps": mix["CondJump"],
+        "stack_bytes": Locals(get_all_ir_variables(instructions)).stack_used(),
+        "memory_to_memory_moves": sum(
+            1 for load, store in zip(code_lines, code_lines[1:])
+            if _LOAD_FROM_STACK.fullmatch(load) and _STORE_TO_STACK.fullmatch(store)
+        ),
+        "assembly_lines": len(assembly.splitlines()),
+        "assembly_instructions": len(code_lines),
+        "executable_bytes": len(executable),
+    }
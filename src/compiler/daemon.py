@@ -0,0 +1,131 @@
+"""A local compile daemon behind `compiler.sh daemon`, and its client.
+
+The daemon warms up once, like `compiler.server`, and then forks a child
+for every request on a Unix domain socket. When the socket exists,
+`compile` sends the daemon the absolute paths of its source and output
+files, and the daemon reads the source and writes the executable itself.
+Source code read from stdin is sent along with the request instead.
+
+The socket is only accessible to the user who started the daemon, since
+the daemon reads and writes files on behalf of its clients. The client
+in turn only talks to a daemon run by the same user, since anyone can
+create the default socket in /tmp first and pose as one.
+
+Only the client is imported at the top, so that `compile` stays cheap to
+start when it hands its work to the daemon.
+"""
+import json
+import os
+import socket
+import struct
+from typing import Any
+
+
+def send_to_daemon(socket_path: str, request: dict[str, Any]) -> dict[str, Any] | None:
+    """Sends one request and returns the response, or None if no daemon is listening.
+
+    Raises PermissionError if the socket belongs to another user's process.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except (FileNotFoundError, ConnectionRefusedError):
+            return None
+        credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+        _, uid, _ = struct.unpack('3i', credentials)
+        if uid != os.getuid():
+            raise PermissionError(f"The compile daemon at {socket_path} is run by another user")
+        sock.sendall(json.dumps(request).encode())
+        sock.shutdown(socket.SHUT_WR)
+        chunks = []
+        while chunk := sock.recv(65536):
+            chunks.append(chunk)
+    response: dict[str, Any] = json.loads(b"".join(chunks))
+    return response
+
+
+def compile_with_daemon(
+    socket_path: str,
+    output_file: str,
+    backend: str,
+    input_file: str | None = None,
+    source_code: str | None = None,
+) -> bool:
+    """Compiles through the daemon. Returns False if it isn't running.
+
+    Either `input_file` or `source_code` must be given.
+    """
+    request: dict[str, Any] = {
+        "command": "compile",
+        "output_file": os.path.abspath(output_file),
+        "backend": backend,
+    }
+    if input_file is not None:
+        request["input_file"] = os.path.abspath(input_file)
+        request["name"] = input_file
+    else:
+        request["code"] = source_code
+    response = send_to_daemon(socket_path, request)
+    if response is None:
+        return False
+    if "error" in response:
+        raise RuntimeError(response["error"])
+    return True
+
+
+def run_request(request: dict[str, Any]) -> dict[str, Any]:
+    from compiler.pipeline import call_compiler
+    from compiler.tokenizer import read_source
+    if request["command"] == "compile":
+        if "input_file" in request:
+            with open(request["input_file"], 'rb') as f:
+                executable = call_compiler(read_source(f), request["name"], request["backend"])
+        else:
+            executable = call_compiler(request["code"], "(source code)", request["backend"])
+        with open(request["output_file"], 'wb') as f:
+            f.write(executable)
+        return {}
+    elif request["command"] == "ping":
+        return {"pid": os.getpid()}
+    else:
+        raise ValueError(f"Unknown command: {request['command']}")
+
+
+def run_daemon(socket_path: str, backend: str = 'builtin') -> None:
+    import signal
+    from socketserver import ForkingUnixStreamServer, StreamRequestHandler
+    from compiler.server import warm_up
+    from compiler.server_options import ServerOptions
+
+    class Handler(StreamRequestHandler):
+        def handle(self) -> None:
+            result: dict[str, Any]
+            try:
+                result = run_request(json.loads(self.rfile.read()))
+            except Exception as e:
+                result = {"error": str(e)}
+            self.wfile.write(json.dumps(result).encode())
+
+    if send_to_daemon(socket_path, {"command": "ping"}) is not None:
+        raise Exception(f"A daemon is already running at {socket_path}")
+    if os.path.exists(socket_path):
+        os.unlink(socket_path)  # Left behind by a daemon that was killed
+
+    warm_up(ServerOptions(backend=backend))
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    old_umask = os.umask(0o077)
+    try:
+        server = ForkingUnixStreamServer(socket_path, Handler)
+    finally:
+        os.umask(old_umask)
+    print(f"Starting compile daemon at {socket_path}", flush=True)
+    try:
+        with server:
+            server.serve_forever()
+    finally:
+        os.unlink(socket_path)
+
+
+def _raise_keyboard_interrupt(signum: int, frame: object) -> None:
+    raise KeyboardInterrupt
@@ -0,0 +1,68 @@
+"""Writes minimal static ELF64 executables for Linux x86-64."""
+import struct
+
+ELF_HEADER_SIZE = 64
+PROGRAM_HEADER_SIZE = 56
+DEFAULT_BASE_ADDRESS = 0x400000
+PAGE_SIZE = 0x1000
+PROGRAM_HEADER_COUNT = 2
+
+# Code starts right after the headers, aligned like `ld` would align a function.
+CODE_OFFSET = (ELF_HEADER_SIZE + PROGRAM_HEADER_SIZE * PROGRAM_HEADER_COUNT + 15) // 16 * 16
+
+_PT_LOAD = 1
+_PT_GNU_STACK = 0x6474E551
+_PF_X, _PF_W, _PF_R = 1, 2, 4
+
+
+def code_address(base_address: int = DEFAULT_BASE_ADDRESS) -> int:
+    """Returns the virtual address at which `write_executable` places the code."""
+    return base_address + CODE_OFFSET
+
+
+def write_executable(code: bytes, entry: int, base_address: int = DEFAULT_BASE_ADDRESS) -> bytes:
+    """Returns an executable that maps `code` at `code_address(base_address)`.
+
+    Headers and code share a single read+execute segment, and a second
+    program header asks for a non-executable stack. No section headers are
+    written, since the kernel does not need them to run the program.
+    """
+    if base_address % PAGE_SIZE != 0:
+        raise ValueError("base address must be page aligned")
+    file_size = CODE_OFFSET + len(code)
+
+    elf_header = struct.pack(
+        '<4sBBBBB7xHHIQQQIHHHHHH',
+        b'\x7fELF',
+        2,  # 64-bit
+        1,  # little endian
+        1,  # ELF version
+        0,  # System V ABI
+        0,  # ABI version
+        2,  # executable file
+        0x3E,  # x86-64
+        1,  # ELF version
+        entry,
+        ELF_HEADER_SIZE,  # program headers follow the ELF header
+        0,  # no section headers
+        0,  # flags
+        ELF_HEADER_SIZE,
+        PROGRAM_HEADER_SIZE,
+        PROGRAM_HEADER_COUNT,
+        0, 0, 0,  # section header entry size, count and name index
+    )
+    load_segment = struct.pack(
+        '<IIQQQQQQ',
+        _PT_LOAD, _PF_R | _PF_X,
+        0, base_address, base_address,
+        file_size, file_size,
+        PAGE_SIZE,
+    )
+    stack_segment = struct.pack(
+        '<IIQQQQQQ',
+        _PT_GNU_STACK, _PF_R | _PF_W,
+        0, 0, 0, 0, 0,
+        16,
+    )
+    headers = elf_header + load_segment + stack_segment
+    return headers + bytes(CODE_OFFSET - len(headers)) + code
@@ -0,0 +1,179 @@
+"""Content-addressed cache for compiled executables.
+
+Entries are keyed by a hash of the source code, the compiler options and
+the compiler's own source, so a changed compiler never serves stale output.
+
+There are two tiers:
+- a bounded in-memory LRU, private to each process, and
+- a size-capped directory shared by all processes forked from the one that
+  created the cache. By default it is a temporary directory on tmpfs that is
+  removed at exit. Given `directory`, it is kept and survives restarts.
+
+Hit, miss and eviction counters live in shared memory, so every worker
+reports the totals for the whole server.
+"""
+import atexit
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any
+
+_COUNTERS = ['memory_hits', 'disk_hits', 'misses', 'memory_evictions', 'disk_evictions', 'disk_bytes']
+
+_compiler_fingerprint: str | None = None
+
+
+def compiler_fingerprint() -> str:
+    """Returns a hash of the compiler's source files."""
+    global _compiler_fingerprint
+    if _compiler_fingerprint is None:
+        h = hashlib.sha256()
+        for source in sorted(Path(__file__).parent.glob('*.py')):
+            h.update(source.name.encode())
+            h.update(source.read_bytes())
+        _compiler_fingerprint = h.hexdigest()
+    return _compiler_fingerprint
+
+
+class ExecutableCache:
+    max_entries: int
+    max_disk_bytes: int
+    directory: str
+    _memory: OrderedDict[str, bytes]
+    _memory_lock: threading.Lock
+    _owner: int
+    _counters: Any  # multiprocessing.Array of int64, indexed like _COUNTERS
+
+    def __init__(
+        self,
+        max_entries: int = 256,
+        directory: str | None = None,
+        max_disk_bytes: int = 256 * 1024 * 1024,
+    ) -> None:
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_lock = threading.Lock()
+        self._owner = os.getpid()
+        self._counters = multiprocessing.Array('q', len(_COUNTERS))
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.directory = directory
+        else:
+            tmpfs = '/dev/shm' if os.path.isdir('/dev/shm') else None
+            self.directory = tempfile.mkdtemp(prefix='compiler_cache_', dir=tmpfs)
+            atexit.register(self._remove_directory)
+        self._set('disk_bytes', sum(entry.stat().st_size for entry in self._entries()))
+
+    @staticmethod
+    def key(source_code: str, options: dict[str, Any]) -> str:
+        """Returns the cache key of a compilation."""
+        text = json.dumps(
+            {'source': source_code, 'options': options, 'compiler': compiler_fingerprint()},
+            sort_keys=True,
+        )
+        return hashlib.sha256(text.encode()).hexdigest()
+
+    def get(self, key: str) -> bytes | None:
+        with self._memory_lock:
+            executable = self._memory.get(key)
+            if executable is not None:
+                self._memory.move_to_end(key)
+        if executable is not None:
+            self._increment('memory_hits')
+            return executable
+        path = self._path(key)
+        try:
+            executable = path.read_bytes()
+            os.utime(path)  # Mark as recently used for eviction
+        except FileNotFoundError:
+            self._increment('misses')
+            return None
+        self._increment('disk_hits')
+        self._remember(key, executable)
+        return executable
+
+    def put(self, key: str, executable: bytes) -> None:
+        self._remember(key, executable)
+        path = self._path(key)
+        if path.exists():
+            return
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(executable)
+            # Unlike a rename, linking fails if another worker got there first,
+            # so only the one that created the entry counts its size.
+            os.link(tmp_path, path)
+        except FileExistsError:
+            return
+        finally:
+            os.unlink(tmp_path)
+        if self._increment('disk_bytes', len(executable)) > self.max_disk_bytes:
+            self._evict_from_disk()
+
+    def stats(self) -> dict[str, int]:
+        with self._counters.get_lock():
+            result = dict(zip(_COUNTERS, self._counters))
+        result['memory_entries'] = len(self._memory)
+        return result
+
+    def _remember(self, key: str, executable: bytes) -> None:
+        with self._memory_lock:
+            self._memory[key] = executable
+            self._memory.move_to_end(key)
+            evicted = 0
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+                evicted += 1
+        if evicted:
+            self._increment('memory_evictions', evicted)
+
+    def _evict_from_disk(self) -> None:
+        with self._counters.get_lock():
+            entries = []
+            for entry in self._entries():
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry))
+            entries.sort()
+            total = sum(size for _, size, _ in entries)
+            evicted = 0
+            # Evict down to 90% of the limit, so we don't scan on every insert.
+            for _, size, entry in entries:
+                if total <= self.max_disk_bytes * 0.9:
+                    break
+                entry.unlink(missing_ok=True)
+                total -= size
+                evicted += 1
+            self._counters[_COUNTERS.index('disk_bytes')] = total
+            self._counters[_COUNTERS.index('disk_evictions')] += evicted
+
+    def _entries(self) -> list[Path]:
+        return list(Path(self.directory).glob('*.exe'))
+
+    def _path(self, key: str) -> Path:
+        return Path(self.directory) / f'{key}.exe'
+
+    def _increment(self, counter: str, amount: int = 1) -> int:
+        with self._counters.get_lock():
+            index = _COUNTERS.index(counter)
+            self._counters[index] += amount
+            return int(self._counters[index])
+
+    def _set(self, counter: str, value: int) -> None:
+        with self._counters.get_lock():
+            self._counters[_COUNTERS.index(counter)] = value
+
+    def _remove_directory(self) -> None:
+        # Forked workers inherit atexit handlers but must leave the directory alone.
+        if self._owner == os.getpid():
+            shutil.rmtree(self.directory, ignore_errors=True)
@@ -0,0 +1,84 @@
+"""Hooks for observing the stages of a compilation.
+
+The pipeline wraps each stage in `stage(name)`. Observers registered with
+`add_observer` are called with the stage name and return a context manager
+that is active while the stage runs. Without observers, `stage` costs one
+list check.
+
+A compilation is 'compile', made of the stages 'tokenize', 'parse',
+'annotate_types', 'generate_ir', 'generate_assembly' and 'assemble', which
+contains 'encode' for the builtin backend or 'as' and 'ld' for the
+toolchain. JIT runs are 'jit'. The server adds 'accept', 'read' and 'write'
+around its socket operations.
+
+Source code read in chunks is tokenized while it's parsed, so 'tokenize'
+runs in many small pieces inside 'parse'. `timed_iteration` adds those up
+and reports the total, when parsing is done, to the recorders registered
+with `add_recorder`, with the wall time and CPU time it took.
+"""
+import time
+from contextlib import AbstractContextManager, ExitStack, contextmanager, nullcontext
+from typing import Callable, Iterable, Iterator, TypeVar
+
+T = TypeVar('T')
+
+Observer = Callable[[str], AbstractContextManager[object]]
+Recorder = Callable[[str, float, float], None]
+
+_observers: list[Observer] = []
+_recorders: list[Recorder] = []
+
+
+def add_observer(observer: Observer) -> None:
+    _observers.append(observer)
+
+
+def remove_observer(observer: Observer) -> None:
+    _observers.remove(observer)
+
+
+def add_recorder(recorder: Recorder) -> None:
+    _recorders.append(recorder)
+
+
+def remove_recorder(recorder: Recorder) -> None:
+    _recorders.remove(recorder)
+
+
+def stage(name: str) -> AbstractContextManager[object]:
+    if not _observers:
+        return nullcontext()
+    return _observed_stage(name)
+
+
+@contextmanager
+def _observed_stage(name: str) -> Iterator[None]:
+    with ExitStack() as stack:
+        for observer in list(_observers):
+            stack.enter_context(observer(name))
+        yield
+
+
+def timed_iteration(name: str, items: Iterable[T]) -> Iterator[T]:
+    """Yields the items, and records the time spent producing them as the stage `name`."""
+    if not _recorders:
+        yield from items
+        return
+    wall = 0.0
+    cpu = 0.0
+    iterator = iter(items)
+    try:
+        while True:
+            start_wall = time.perf_counter()
+            start_cpu = time.process_time()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                wall += time.perf_counter() - start_wall
+                cpu += time.process_time() - start_cpu
+            yield item
+    finally:
+        for recorder in list(_recorders):
+            recorder(name, wall, cpu)
@@ -0,0 +1,235 @@
+"""Runs generated code in-process from executable memory.
+
+The program is encoded with `x86_encoder` into an anonymous mmap region and
+called through ctypes. Instead of the stdlib, `print_int`, `print_bool` and
+`read_int` are small stubs that call back into Python, which buffers the
+output and reads input from a text stream.
+
+Division by zero still raises SIGFPE and kills the calling process,
+just like it kills a compiled executable. Long-running callers such as the
+server use `run_in_child`, which only loses a forked child.
+"""
+import ctypes
+import faulthandler
+import io
+import mmap
+import os
+import select
+import signal
+import time
+from dataclasses import dataclass
+from typing import Callable, TextIO
+
+from compiler import ir, x86_encoder
+from compiler.assembly_generator import generate_assembly
+
+_PROT_READ = 1
+_PROT_EXEC = 4
+
+_PrintCallback = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64)
+_ReadCallback = ctypes.CFUNCTYPE(ctypes.c_int64)
+_Entry = ctypes.CFUNCTYPE(ctypes.c_int64)
+
+_libc = ctypes.CDLL(None, use_errno=True)
+_libc.mprotect.argtypes = [ctypes.c_void_p, ctypes.c_size_t, ctypes.c_int]
+_libc.mprotect.restype = ctypes.c_int
+
+READ_INT_ERROR = "Error: read_int() failed to read input\n"
+
+
+class JitError(Exception):
+    pass
+
+
+@dataclass
+class JitResult:
+    stdout: str
+    stderr: str
+    exit_code: int
+
+
+class _Runtime:
+    """The Python side of the built-in functions for one run."""
+    output: list[str]
+    write: Callable[[str], object]
+    stdin: TextIO
+    # slot 0: stack pointer to restore on abort, slot 1: nonzero if read_int failed
+    state: ctypes.Array[ctypes.c_int64]
+
+    def __init__(self, stdin: TextIO, write: Callable[[str], object] | None = None) -> None:
+        self.output = []
+        self.write = write if write is not None else self.output.append
+        self.stdin = stdin
+        self.state = (ctypes.c_int64 * 2)()
+        self.print_int = _PrintCallback(self._print_int)
+        self.print_bool = _PrintCallback(self._print_bool)
+        self.read_int = _ReadCallback(self._read_int)
+
+    def _print_int(self, value: int) -> int:
+        self.write(f"{value}\n")
+        return value
+
+    def _print_bool(self, value: int) -> int:
+        self.write("true\n" if value != 0 else "false\n")
+        return value
+
+    def _read_int(self) -> int:
+        # Same rules as the stdlib: read one line, skip junk characters
+        # and let every minus sign flip the sign.
+        line = self.stdin.readline()
+        if line == "":
+            self.state[1] = 1
+            return 0
+        negative = False
+        result = 0
+        for c in line.rstrip("\n"):
+            if c == "-":
+                negative = not negative
+            elif "0" <= c <= "9":
+                result = (result * 10 + ord(c) - ord("0")) & (2**64 - 1)
+        result = -result if negative else result
+        return ctypes.c_int64(result).value
+
+    def assembly(self) -> str:
+        """Returns the entry point and the stubs that replace the stdlib."""
+        state = ctypes.addressof(self.state)
+        stubs = []
+        for name, callback in [
+            ("print_int", self.print_int),
+            ("print_bool", self.print_bool),
+            ("read_int", self.read_int),
+        ]:
+            address = ctypes.cast(callback, ctypes.c_void_p).value
+            stubs.append(f"""
+            .global {name}
+            {name}:
+                pushq %rbp
+                movq %rsp, %rbp
+                andq $-16, %rsp         # The callback may use aligned SSE stores
+                movabsq ${address}, %rax
+                call *%rax
+                movq %rbp, %rsp
+                popq %rbp
+                movabsq ${state + 8}, %rcx
+                cmpq $0, (%rcx)         # Did read_int fail?
+                jne jit_abort
+                ret
+            """)
+        return f"""
+            .global jit_entry
+            jit_entry:
+                pushq %rbx
+                pushq %rbp
+                pushq %r12
+                pushq %r13
+                pushq %r14
+                pushq %r15
+                movabsq ${state}, %rax
+                movq %rsp, (%rax)       # Remember where to unwind to on abort
+                call main
+                xorq %rax, %rax
+                jmp jit_leave
+            jit_abort:
+                movabsq ${state}, %rax
+                movq (%rax), %rsp
+                movq $1, %rax
+            jit_leave:
+                popq %r15
+                popq %r14
+                popq %r13
+                popq %r12
+                popq %rbp
+                popq %rbx
+                ret
+            {"".join(stubs)}
+        """
+
+
+def run(
+    instructions: list[ir.Instruction],
+    stdin: TextIO | str = "",
+    write: Callable[[str], object] | None = None,
+) -> JitResult:
+    """Compiles the IR to machine code and runs it in this process.
+
+    Output is collected into the result, or passed to `write` as it is printed.
+    """
+    runtime = _Runtime(io.StringIO(stdin) if isinstance(stdin, str) else stdin, write)
+    try:
+        units = [
+            x86_encoder.parse_unit(generate_assembly(instructions)),
+            x86_encoder.parse_unit(runtime.assembly()),
+        ]
+        size = len(x86_encoder.link(units, origin=0).code)
+    except x86_encoder.AssemblyError as e:
+        raise JitError(f"Failed to encode program: {e}")
+
+    region = mmap.mmap(-1, max(size, 1), prot=mmap.PROT_READ | mmap.PROT_WRITE)
+    buffer = (ctypes.c_char * len(region)).from_buffer(region)
+    try:
+        origin = ctypes.addressof(buffer)
+        linked = x86_encoder.link(units, origin=origin)
+        ctypes.memmove(origin, linked.code, len(linked.code))
+        if _libc.mprotect(origin, len(region), _PROT_READ | _PROT_EXEC) != 0:
+            raise JitError(f"mprotect failed: {ctypes.get_errno()}")
+        exit_code = _Entry(linked.symbols["jit_entry"])()
+    finally:
+        del buffer
+        region.close()
+
+    return JitResult(
+        stdout="".join(runtime.output),
+        stderr=READ_INT_ERROR if exit_code != 0 else "",
+        exit_code=exit_code,
+    )
+
+
+def run_in_child(
+    instructions: list[ir.Instruction],
+    stdin: TextIO | str = "",
+    timeout: float | None = None,
+) -> JitResult:
+    """Like `run`, but in a forked child, so that a crashing program can't take us down.
+
+    Output printed before a crash is kept. A program killed by a signal
+    gets its negated number as the exit code, like `subprocess` reports it.
+    A program still running after `timeout` seconds is killed with SIGKILL.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        code = 1
+        try:
+            os.close(read_fd)
+            faulthandler.disable()  # Crashing is an expected outcome here
+            # Line buffered, so output before a crash reaches the parent
+            with open(write_fd, 'w', buffering=1) as output:
+                code = run(instructions, stdin, write=output.write).exit_code
+        finally:
+            os._exit(code)
+    os.close(write_fd)
+    deadline = None if timeout is None else time.monotonic() + timeout
+    timed_out = False
+    chunks = []
+    with open(read_fd, 'rb', buffering=0) as output:
+        while True:
+            if deadline is not None and not timed_out:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not select.select([output], [], [], remaining)[0]:
+                    os.kill(pid, signal.SIGKILL)
+                    timed_out = True
+            # After the kill, what was printed before it is still read
+            chunk = output.read(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    stdout = b"".join(chunks).decode()
+    _, status = os.waitpid(pid, 0)
+    exit_code = os.waitstatus_to_exitcode(status)
+    if timed_out:
+        stderr = f"Program timed out after {timeout}s\n"
+    elif exit_code < 0:
+        stderr = f"Program terminated by {signal.Signals(-exit_code).name}\n"
+    else:
+        stderr = READ_INT_ERROR if exit_code != 0 else ""
+    return JitResult(stdout=stdout, stderr=stderr, exit_code=exit_code)
@@ -0,0 +1,141 @@
+"""Latency and size histograms for the compile server.
+
+Histograms live in shared memory, like the executable cache's counters,
+so all workers forked from the process that created them report totals
+for the whole server.
+
+Buckets grow by a factor of sqrt(2), so percentiles are accurate to
+about 20%. Durations are kept in microseconds and reported in seconds.
+"""
+import json
+import math
+import multiprocessing
+import os
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+from compiler import instrument
+
+# Name and unit of every histogram. Stages are described in `compiler.instrument`.
+HISTOGRAMS = {
+    'request': 'seconds',
+    'queue_wait': 'seconds',
+    'tokenize': 'seconds',
+    'parse': 'seconds',
+    'annotate_types': 'seconds',
+    'generate_ir': 'seconds',
+    'generate_assembly': 'seconds',
+    'assemble': 'seconds',
+    'encode': 'seconds',
+    'as': 'seconds',
+    'ld': 'seconds',
+    'jit': 'seconds',
+    'request_bytes': 'bytes',
+    'response_bytes': 'bytes',
+}
+
+_BUCKETS = 64
+# Per histogram: count, sum, max, then the buckets
+_SLOTS = 3 + _BUCKETS
+
+
+class Metrics:
+    _data: Any  # multiprocessing.Array of int64
+
+    def __init__(self) -> None:
+        self._data = multiprocessing.Array('q', len(HISTOGRAMS) * _SLOTS)
+
+    def record(self, name: str, value: float) -> None:
+        """Adds a value to a histogram. Unknown names are ignored."""
+        if name not in HISTOGRAMS:
+            return
+        if HISTOGRAMS[name] == 'seconds':
+            value *= 1e6
+        amount = max(0, int(value))
+        base = list(HISTOGRAMS).index(name) * _SLOTS
+        bucket = min(_BUCKETS - 1, int(2 * math.log2(amount))) if amount > 1 else 0
+        with self._data.get_lock():
+            self._data[base] += 1
+            self._data[base + 1] += amount
+            self._data[base + 2] = max(self._data[base + 2], amount)
+            self._data[base + 3 + bucket] += 1
+
+    def record_stages(self, stages: list[tuple[str, float]]) -> None:
+        for name, seconds in stages:
+            self.record(name, seconds)
+
+    def record_stage(self, name: str, wall: float, cpu: float) -> None:
+        """A recorder for `instrument.add_recorder`."""
+        self.record(name, wall)
+
+    @contextmanager
+    def observe(self, name: str) -> Iterator[None]:
+        """An observer for `instrument.add_observer`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def snapshot(self) -> dict[str, dict[str, float]]:
+        """Returns count, mean, p50, p90, p99 and max of every histogram that has values."""
+        with self._data.get_lock():
+            data = list(self._data)
+        result = {}
+        for index, (name, unit) in enumerate(HISTOGRAMS.items()):
+            count, total, maximum = data[index * _SLOTS:index * _SLOTS + 3]
+            if count == 0:
+                continue
+            buckets = data[index * _SLOTS + 3:(index + 1) * _SLOTS]
+            scale = 1e-6 if unit == 'seconds' else 1
+            summary = {'count': count, 'mean': total / count * scale}
+            for p in (50, 90, 99):
+                summary[f'p{p}'] = min(_percentile(buckets, count * p / 100), maximum) * scale
+            summary['max'] = maximum * scale
+            result[name] = summary
+        return result
+
+    def dump(self, path: str) -> None:
+        """Writes the snapshot to a JSON file, atomically."""
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2)
+        os.replace(tmp_path, path)
+
+
+@contextmanager
+def collect_stages() -> Iterator[list[tuple[str, float]]]:
+    """Collects the durations of stages run in this process, for recording elsewhere."""
+    stages: list[tuple[str, float]] = []
+
+    @contextmanager
+    def observer(name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            stages.append((name, time.perf_counter() - start))
+
+    def recorder(name: str, wall: float, cpu: float) -> None:
+        stages.append((name, wall))
+
+    instrument.add_observer(observer)
+    instrument.add_recorder(recorder)
+    try:
+        yield stages
+    finally:
+        instrument.remove_observer(observer)
+        instrument.remove_recorder(recorder)
+
+
+def _percentile(buckets: list[int], rank: float) -> float:
+    seen = 0
+    for bucket, count in enumerate(buckets):
+        seen += count
+        if seen >= rank:
+            # Geometric middle of the bucket
+            return float(2 ** ((bucket + 0.5) / 2)) if bucket > 0 else 1.0
+    return 0.0
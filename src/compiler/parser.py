@@ -1,5 +1,7 @@
+from typing import Iterable
+
 import compiler.ast as ast
-from compiler.tokenizer import Token
+from compiler.tokenizer import END, IDENTIFIER, INT_LITERAL, KIND_TEXTS, KIND_TYPES, KINDS, Location, Token, TokenStream, kind_of
 from compiler.types import Int, Bool, Unit, Type
 
 # bottom level has highest precedence
@@ -15,6 +17,28 @@ BINARY_OPERATORS = [
 
 UNARY_OPERATORS = ["-", "not"]
 
+# The parser compares token kinds, never their text
+_BINARY_OPERATOR_KINDS = [frozenset(KINDS[op] for op in operators) for operators in BINARY_OPERATORS]
+_UNARY_OPERATOR_KINDS = frozenset(KINDS[op] for op in UNARY_OPERATORS)
+_LITERAL_KINDS = frozenset((INT_LITERAL, KINDS["true"], KINDS["false"]))
+# Kinds of tokens after which `-` is a unary operator
+_OPERAND_EXPECTED_KINDS = frozenset(
+    kind for kind, type in enumerate(KIND_TYPES) if type in ("binary_op", "unary_op", "punctuation", "keyword")
+)
+_STATEMENT_BOUNDARY_KINDS = frozenset((KINDS["{"], KINDS["}"], KINDS[";"]))
+_ASSIGN = KINDS["="]
+_TRUE = KINDS["true"]
+_INT = KINDS["Int"]
+_BOOL = KINDS["Bool"]
+_IF, _THEN, _ELSE = KINDS["if"], KINDS["then"], KINDS["else"]
+_WHILE, _DO, _VAR = KINDS["while"], KINDS["do"], KINDS["var"]
+_LEFT_PAREN, _RIGHT_PAREN = KINDS["("], KINDS[")"]
+_LEFT_BRACE, _RIGHT_BRACE = KINDS["{"], KINDS["}"]
+_COMMA, _SEMICOLON, _COLON = KINDS[","], KINDS[";"], KINDS[":"]
+
+# A token as its kind, text, line and column
+Row = tuple[int, str, int, int]
+
 
 class ParsingException(Exception):
     pass
@@ -24,137 +48,155 @@ class EmptyListException(Exception):
     pass
 
 
-def parse(tokens: list[Token]) -> ast.Expression:
-    pos = 0
-
-    def peek() -> Token:
-        if pos < len(tokens):
-            return tokens[pos]
-
-        return Token(
-            loc=tokens[-1].loc,
-            type="end",
-            text="",
-        )
-
-    def consume(expected: str | list[str] | None = None) -> Token:
-        nonlocal pos
-        token = peek()
-        if isinstance(expected, str) and token.text != expected:
-            raise ParsingException(
-                f"{token.loc}: expected '{expected}' but got {token.text}"
-            )
-        if isinstance(expected, list) and token.text not in expected:
-            comma_separated = ", ".join([f'"{e}"' for e in expected])
+def parse(tokens: TokenStream | Iterable[Token]) -> ast.Expression:
+    # Only the previous token and the next two are kept, so that tokens
+    # can be streamed from `tokenizer.iter_tokens` or a `TokenStream`.
+    remaining: Iterable[Row]
+    if isinstance(tokens, TokenStream):
+        remaining = tokens.rows()
+    else:
+        remaining = ((kind_of(token), token.text, token.loc.line, token.loc.column) for token in tokens)
+    remaining = iter(remaining)
+    lookahead: list[Row] = []
+    previous: Row | None = None
+    end: Row | None = None
+
+    def peek(offset: int = 0) -> Row:
+        nonlocal end
+        while len(lookahead) <= offset:
+            if end is not None:
+                return end
+            row = next(remaining, None)
+            if row is None:
+                last = lookahead[-1] if lookahead else previous
+                if last is None:
+                    raise EmptyListException("token list must not be empty.")
+                end = (END, "", last[2], last[3])
+                return end
+            lookahead.append(row)
+        return lookahead[offset]
+
+    def peek_kind() -> int:
+        return lookahead[0][0] if lookahead else peek()[0]
+
+    def location(row: Row) -> Location:
+        return Location(row[2], row[3])
+
+    def consume(expected: int | None = None) -> Row:
+        nonlocal previous
+        row = peek()
+        if expected is not None and row[0] != expected:
             raise ParsingException(
-                f"{token.loc}: expected one of: {comma_separated}"
+                f"{location(row)}: expected '{KIND_TEXTS[expected]}' but got {row[1]}"
             )
-        pos += 1
-        return token
+        if lookahead:
+            previous = lookahead.pop(0)
+        return row
 
     def parse_literal() -> ast.Literal:
-        token = consume()
-        if token.type == "int_literal":
-            return ast.Literal(value=int(token.text), location=token.loc)
-        elif token.type == "bool_literal":
+        row = consume()
+        if row[0] == INT_LITERAL:
+            return ast.Literal(value=int(row[1]), location=location(row))
+        elif row[0] in _LITERAL_KINDS:
             return ast.Literal(
-                value=True if token.text == "true" else False,
-                location=token.loc
+                value=row[0] == _TRUE,
+                location=location(row)
             )
         raise ParsingException(
-            f"{peek().loc}: expected an integer or boolean literal"
+            f"{location(peek())}: expected an integer or boolean literal"
         )
 
     def parse_identifier() -> ast.Identifier:
-        if peek().type != "identifier":
-            raise ParsingException(f"{peek().loc}: expected an identifier")
+        if peek_kind() != IDENTIFIER:
+            raise ParsingException(f"{location(peek())}: expected an identifier")
 
-        token = consume()
+        row = consume()
 
-        if pos < len(tokens) and tokens[pos].type == "identifier":
+        if peek_kind() == IDENTIFIER:
             raise ParsingException(
-                f"{peek().loc}: incorrect expression: "
+                f"{location(peek())}: incorrect expression: "
                 "identifier should be followed by a binary operator or a statement."
             )
 
-        return ast.Identifier(name=token.text, location=token.loc)
+        return ast.Identifier(name=row[1], location=location(row))
 
     def parse_func_expr() -> ast.FuncExpr:
-        token = consume()
-        consume("(")
+        row = consume()
+        consume(_LEFT_PAREN)
 
         arguments = []
 
-        if peek().text != ")":
+        if peek_kind() != _RIGHT_PAREN:
             arguments.append(parse_expression())
-            while peek().text == ",":
-                consume(",")
+            while peek_kind() == _COMMA:
+                consume(_COMMA)
                 arguments.append(parse_expression())
 
-        consume(")")
+        consume(_RIGHT_PAREN)
 
+        loc = location(row)
         return ast.FuncExpr(
-            identifier=ast.Identifier(name=token.text, location=token.loc),
+            identifier=ast.Identifier(name=row[1], location=loc),
             arguments=arguments,
-            location=token.loc
+            location=loc
         )
 
     def parse_if_expr() -> ast.IfExpr:
-        consume("if")
+        consume(_IF)
         condition = parse_expression()
-        token = consume("then")
+        row = consume(_THEN)
         then_expr = parse_expression()
 
         if isinstance(condition, ast.LiteralVarDecl):
             raise ParsingException(
-                f"{peek().loc}: variable declarations are not allowed as a part of 'if' condition."
+                f"{location(peek())}: variable declarations are not allowed as a part of 'if' condition."
             )
         if isinstance(then_expr, ast.LiteralVarDecl):
             raise ParsingException(
-                f"{peek().loc}: variable declarations are not allowed as a part of 'then' condition."
+                f"{location(peek())}: variable declarations are not allowed as a part of 'then' condition."
             )
 
-        if peek().text == "else":
-            token = consume("else")
+        if peek_kind() == _ELSE:
+            row = consume(_ELSE)
             else_expr = parse_expression()
             if isinstance(else_expr, ast.LiteralVarDecl):
                 raise ParsingException(
-                    f"{peek().loc}: variable declarations are not allowed as a part of 'else' condition."
+                    f"{location(peek())}: variable declarations are not allowed as a part of 'else' condition."
                 )
             return ast.IfExpr(
                 condition=condition,
                 then=then_expr,
                 else_=else_expr,
-                location=token.loc)
+                location=location(row))
 
         return ast.IfExpr(
             condition=condition,
             then=then_expr,
-            location=token.loc
+            location=location(row)
             )
 
     def parse_while_expr() -> ast.WhileExpr:
-        consume("while")
+        consume(_WHILE)
         condition = parse_expression()
         if isinstance(condition, ast.LiteralVarDecl):
             raise ParsingException(
-                f"{peek().loc}: variable declarations are not allowed as a part of 'while' condition."
+                f"{location(peek())}: variable declarations are not allowed as a part of 'while' condition."
             )
-        token = consume("do")
+        row = consume(_DO)
         body = parse_statements()
         return ast.WhileExpr(
             condition=condition,
             body=body,
-            location=token.loc)
+            location=location(row))
 
     def parse_literal_var_decl(require_semicolon: bool = False) -> ast.LiteralVarDecl:
-        consume("var")
+        consume(_VAR)
         identifier = parse_identifier()
-        declared_type = parse_type() if peek().text == ":" else Unit
-        consume("=")
+        declared_type = parse_type() if peek_kind() == _COLON else Unit
+        consume(_ASSIGN)
         initializer = parse_expression()
         if require_semicolon:
-            consume(";")
+            consume(_SEMICOLON)
         return ast.LiteralVarDecl(
             identifier=identifier,
             initializer=initializer,
@@ -163,119 +205,114 @@ def parse(tokens: list[Token]) -> ast.Expression:
         )
 
     def parse_type() -> Type:
-        consume(":")
-        token = consume()
-        if token.text == "Int":
+        consume(_COLON)
+        row = consume()
+        if row[0] == _INT:
             return Int
-        elif token.text == "Bool":
+        elif row[0] == _BOOL:
             return Bool
-        elif token.text == "Unit":
+        elif row[0] == IDENTIFIER and row[1] == "Unit":
             return Unit
-        raise ParsingException(f"{token.loc}: unknown literal type {token.text}")
+        raise ParsingException(f"{location(row)}: unknown literal type {row[1]}")
 
     def parse_unary_op() -> ast.UnaryOp:
-        if peek().text in UNARY_OPERATORS:
-            token = consume()
+        if peek_kind() in _UNARY_OPERATOR_KINDS:
+            row = consume()
             operand = parse_factor()
             return ast.UnaryOp(
-                op=token.text,
+                op=row[1],
                 operand=operand,
-                location=token.loc)
-        raise ParsingException(f"{peek().loc}: expected unary operator")
+                location=location(row))
+        raise ParsingException(f"{location(peek())}: expected unary operator")
 
     def parse_expression(
             precedence_level: int = 0) -> ast.Expression:
-        if precedence_level > len(BINARY_OPERATORS) - 1:
+        if precedence_level > len(_BINARY_OPERATOR_KINDS) - 1:
             return parse_factor()
 
         left = parse_expression(precedence_level + 1)
 
-        while peek().text in BINARY_OPERATORS[precedence_level]:
-            op_token = consume()
-            op = op_token.text
+        operator_kinds = _BINARY_OPERATOR_KINDS[precedence_level]
+        while peek_kind() in operator_kinds:
+            row = consume()
             right = parse_expression(
-                precedence_level if op == "=" else precedence_level + 1)
+                precedence_level if row[0] == _ASSIGN else precedence_level + 1)
             left = ast.BinaryOp(
                 left=left,
-                op=op,
+                op=row[1],
                 right=right,
-                location=op_token.loc
+                location=location(row)
             )
 
         return left
 
     def parse_factor() -> ast.Expression:
-        token = peek()
-        match token:
-            case Token(text="("):
-                return parse_parenthesized()
-            case Token(text="{"):
-                return parse_statements()
-            case Token(text="-") | Token(text="not") if is_unary():
-                return parse_unary_op()
-            case Token(type="int_literal" | "bool_literal"):
-                return parse_literal()
-            case Token(type="identifier"):
-                if pos + 1 < len(tokens) and tokens[pos + 1].text == "(":
-                    return parse_func_expr()
-                return parse_identifier()
-            case Token(type="keyword", text="if"):
-                return parse_if_expr()
-            case Token(type="keyword", text="while"):
-                return parse_while_expr()
-            case Token(type="keyword", text="var"):
-                return parse_literal_var_decl()
-            case _:
-                raise ParsingException(
-                    f"{token.loc}: expected an integer literal or an identifier"
-                )
+        kind = peek_kind()
+        if kind == _LEFT_PAREN:
+            return parse_parenthesized()
+        elif kind == _LEFT_BRACE:
+            return parse_statements()
+        elif kind in _UNARY_OPERATOR_KINDS and is_unary():
+            return parse_unary_op()
+        elif kind in _LITERAL_KINDS:
+            return parse_literal()
+        elif kind == IDENTIFIER:
+            if peek(1)[0] == _LEFT_PAREN:
+                return parse_func_expr()
+            return parse_identifier()
+        elif kind == _IF:
+            return parse_if_expr()
+        elif kind == _WHILE:
+            return parse_while_expr()
+        elif kind == _VAR:
+            return parse_literal_var_decl()
+        raise ParsingException(
+            f"{location(peek())}: expected an integer literal or an identifier"
+        )
 
     def parse_parenthesized() -> ast.Expression:
-        consume("(")
+        consume(_LEFT_PAREN)
         expr = parse_expression()
-        consume(")")
+        consume(_RIGHT_PAREN)
         return expr
 
     def parse_statements() -> ast.Statements:
-        consume("{")
+        consume(_LEFT_BRACE)
         expressions = []
-        while peek().text != "}":
+        while peek_kind() != _RIGHT_BRACE:
             expr = parse_expression()
-            token = peek()
-            if token.text == ";":
+            kind = peek_kind()
+            if kind == _SEMICOLON:
                 expressions.append(expr)
-                consume(";")
-            elif token.text == "}":
-                token = consume("}")
+                consume(_SEMICOLON)
+            elif kind == _RIGHT_BRACE:
+                row = consume(_RIGHT_BRACE)
                 return ast.Statements(
                     expressions=expressions,
                     result=expr,
-                    location=token.loc)
-            elif tokens[pos - 1].text not in ["{", "}", ";"]:
+                    location=location(row))
+            elif previous is not None and previous[0] not in _STATEMENT_BOUNDARY_KINDS:
                 raise ParsingException(
-                    f"{peek().loc}: consecutive result expressions are not allowed.")
+                    f"{location(peek())}: consecutive result expressions are not allowed.")
             else:
                 expressions.append(expr)
-        token = consume("}")
-        return ast.Statements(expressions=expressions, location=token.loc)
+        row = consume(_RIGHT_BRACE)
+        return ast.Statements(expressions=expressions, location=location(row))
 
     def parse_source_code() -> ast.Expression | ast.Statements:
-        if not tokens:
-            raise EmptyListException("token list must not be empty.")
-
         items: list[tuple[ast.Expression, bool]] = []
 
-        while peek().type != "end":
+        while peek_kind() != END:
             expr = parse_expression()
             if should_force_semicolon(expr):
-                if peek().type == "end":
+                if peek_kind() == END:
                     items.append((expr, False))
                 else:
-                    consume(";")
+                    consume(_SEMICOLON)
                     items.append((expr, True))
             else:
-                if peek().text == ";":
-                    consume(";")
+                if peek_kind() == _SEMICOLON:
+                    consume(_SEMICOLON)
                     items.append((expr, True))
                 else:
                     items.append((expr, False))
@@ -298,18 +335,11 @@ def parse(tokens: list[Token]) -> ast.Expression:
         return ast.Statements(
             expressions=exprs,
             result=result_expr,
-            location=peek().loc
+            location=location(peek())
         )
 
     def is_unary() -> bool:
-        if pos == 0:
-            return True
-        prev_token = tokens[pos - 1]
-        return prev_token.type in [
-            "binary_op",
-            "unary_op",
-            "punctuation",
-            "keyword"] or prev_token.text == "("
+        return previous is None or previous[0] in _OPERAND_EXPECTED_KINDS
 
     def should_force_semicolon(expr: ast.Expression) -> bool:
         if isinstance(expr, ast.LiteralVarDecl):
@@ -0,0 +1,82 @@
+from itertools import chain
+from typing import TYPE_CHECKING, Any, Iterable, TextIO
+
+from compiler.tokenizer import Token, iter_token_streams, tokenize_stream
+from compiler.parser import parse
+from compiler.type_checker import annotate_types, build_typechecker_root_symtab
+from compiler.ir_generator import generate_ir, ROOT_TYPES
+from compiler.assembly_generator import generate_assembly
+from compiler.assembler import assemble_and_get_executable
+from compiler import ir
+from compiler.code_stats import code_stats
+from compiler.instrument import stage, timed_iteration
+
+if TYPE_CHECKING:
+    # Imported by `call_jit`, so that compiling doesn't load ctypes
+    from compiler import jit
+
+
+def generate_program_ir(source_code: str | Iterable[str]) -> list[ir.Instruction]:
+    """Compiles source code to IR. It can be given as chunks, like `tokenizer.iter_tokens` takes it."""
+    tokens: Iterable[Token]
+    if isinstance(source_code, str):
+        with stage('tokenize'):
+            tokens = tokenize_stream(source_code)
+    else:
+        # Tokenized while it's parsed, in runs of lines whose time adds up to the tokenize stage
+        tokens = chain.from_iterable(timed_iteration('tokenize', iter_token_streams(source_code)))
+    with stage('parse'):
+        tree = parse(tokens)
+    with stage('annotate_types'):
+        annotate_types(tree, build_typechecker_root_symtab())
+    with stage('generate_ir'):
+        return generate_ir(ROOT_TYPES, tree)
+
+
+def call_compiler(source_code: str | Iterable[str], input_file_name: str, backend: str = 'builtin') -> bytes:
+    try:
+        return _compile(source_code, backend)[2]
+    except Exception as e:
+        raise RuntimeError(f"Failed to compile: {e}")
+
+
+def compile_with_stats(source_code: str | Iterable[str], input_file_name: str, backend: str = 'builtin') -> tuple[bytes, dict[str, Any]]:
+    """Like `call_compiler`, but also returns a `code_stats` report of the generated code."""
+    try:
+        instructions, assembly, executable = _compile(source_code, backend)
+    except Exception as e:
+        raise RuntimeError(f"Failed to compile: {e}")
+    return executable, code_stats(instructions, assembly, executable)
+
+
+def _compile(source_code: str | Iterable[str], backend: str) -> tuple[list[ir.Instruction], str, bytes]:
+    with stage('compile'):
+        instructions = generate_program_ir(source_code)
+        with stage('generate_assembly'):
+            assembly = generate_assembly(instructions)
+        with stage('assemble'):
+            executable = assemble_and_get_executable(
+                assembly_code=assembly,
+                workdir=None,
+                tempfile_basename="program",
+                link_with_c=False,
+                extra_libraries=[],
+                backend=backend
+            )
+    return instructions, assembly, executable
+
+
+def call_jit(
+    source_code: str | Iterable[str],
+    stdin: TextIO | str,
+    isolated: bool = False,
+    timeout: float | None = None,
+) -> "jit.JitResult":
+    """Runs the program with `jit.run`, or with `jit.run_in_child` and `timeout` if `isolated`."""
+    from compiler import jit
+    try:
+        instructions = generate_program_ir(source_code)
+    except Exception as e:
+        raise RuntimeError(f"Failed to compile: {e}")
+    with stage('jit'):
+        return jit.run_in_child(instructions, stdin, timeout) if isolated else jit.run(instructions, stdin)
@@ -0,0 +1,122 @@
+"""Where a single compilation spends its time and memory.
+
+`time_passes` reports wall time, CPU time and peak memory of every stage in
+`compiler.instrument`, and `profile` runs code under cProfile. They back the
+`--time-passes` and `--profile=FILE` flags.
+"""
+import cProfile
+import resource
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, TextIO
+
+from compiler.instrument import add_observer, add_recorder, remove_observer, remove_recorder
+
+
+@dataclass
+class PassTime:
+    name: str
+    depth: int
+    wall: float = 0.0
+    cpu: float = 0.0
+    # Most memory allocated on top of what was allocated when the stage started
+    peak_bytes: int = 0
+
+
+class PassTimer:
+    """Observes stages and measures each of them.
+
+    CPU time includes child processes, so it covers `as` and `ld`. Peak
+    memory is only measured while tracemalloc is tracing.
+    """
+    passes: list[PassTime]
+    _open: list[tuple[PassTime, int]]
+
+    def __init__(self) -> None:
+        self.passes = []
+        self._open = []
+
+    @contextmanager
+    def timed(self, name: str) -> Iterator[None]:
+        entry = PassTime(name, len(self._open))
+        self.passes.append(entry)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self._open:
+                # The peak is reset for this stage, so save the enclosing one's so far
+                parent, parent_start = self._open[-1]
+                parent.peak_bytes = max(parent.peak_bytes, peak - parent_start)
+            tracemalloc.reset_peak()
+            self._open.append((entry, current))
+        start_wall = time.perf_counter()
+        start_cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            entry.wall = time.perf_counter() - start_wall
+            entry.cpu = _cpu_time() - start_cpu
+            if tracing:
+                _, start_bytes = self._open.pop()
+                peak = tracemalloc.get_traced_memory()[1]
+                entry.peak_bytes = max(entry.peak_bytes, peak - start_bytes)
+                if self._open:
+                    parent, parent_start = self._open[-1]
+                    parent.peak_bytes = max(parent.peak_bytes, peak - parent_start)
+
+    def record_stage(self, name: str, wall: float, cpu: float) -> None:
+        """A recorder for `instrument.add_recorder`."""
+        self.passes.append(PassTime(name, len(self._open), wall, cpu))
+
+    def report(self) -> str:
+        lines = [f"{'Stage':<24}{'Wall (ms)':>12}{'CPU (ms)':>12}{'Peak (KiB)':>12}"]
+        for entry in self.passes:
+            name = "  " * entry.depth + entry.name
+            lines.append(
+                f"{name:<24}{entry.wall * 1000:>12.2f}{entry.cpu * 1000:>12.2f}{entry.peak_bytes / 1024:>12.1f}")
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def time_passes(enabled: bool, output: TextIO = sys.stderr) -> Iterator[None]:
+    """Writes a report of the stages run inside the block to `output`."""
+    if not enabled:
+        yield
+        return
+    timer = PassTimer()
+    started_tracing = not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    add_observer(timer.timed)
+    add_recorder(timer.record_stage)
+    try:
+        yield
+    finally:
+        remove_observer(timer.timed)
+        remove_recorder(timer.record_stage)
+        if started_tracing:
+            tracemalloc.stop()
+        output.write(timer.report())
+
+
+@contextmanager
+def profile(path: str | None) -> Iterator[None]:
+    """Runs the block under cProfile and saves the stats to `path` for pstats."""
+    if path is None:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(path)
+
+
+def _cpu_time() -> float:
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + children.ru_utime + children.ru_stime
@@ -0,0 +1,197 @@
+"""Framed protocol of the compile server.
+
+A connection that starts with `MAGIC` carries any number of frames in each
+direction instead of one JSON document per connection. A frame is
+
+    header length (4 bytes, big endian)
+    body length (4 bytes, big endian)
+    header: a JSON object
+    body: raw bytes, often empty
+
+A request header holds the same fields as a one-shot request, plus an `id`
+chosen by the client. A request body, if any, is the source code. Each
+response header echoes the `id` of its request. Clients may send requests
+without waiting for responses, and responses may come back in any order.
+
+Connections that don't start with `MAGIC` speak the one-shot protocol:
+one JSON request, a half-close, then one JSON response.
+
+Requests choose how executables in the response are encoded. With
+`"compression": "zlib"` or `"lzma"` they are compressed first, and the
+response says so in its own `compression` field. With `"encoding": "binary"`
+they are moved to the frame body as raw bytes, and the header holds
+{"$binary": [offset, length]} in their place. The default, base64 strings
+in JSON, also works on one-shot connections.
+"""
+import asyncio
+import io
+import json
+import lzma
+import struct
+import zlib
+from base64 import b64decode, b64encode
+from typing import Any
+
+MAGIC = b"\x00CF1"
+
+ENCODINGS = ('base64', 'binary')
+COMPRESSIONS = ('none', 'zlib', 'lzma')
+
+_LENGTHS = struct.Struct(">II")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def encode_frame(header: dict[str, Any], body: bytes = b"") -> bytes:
+    """Encodes a frame. Bytes values in the header are moved to the end of the body."""
+    binary = bytearray(body)
+    header_bytes = json.dumps(_extract_binary(header, binary)).encode()
+    return _LENGTHS.pack(len(header_bytes), len(binary)) + header_bytes + binary
+
+
+def frame_size(header: dict[str, Any], body: bytes) -> int:
+    """Size of the frame that was read as `header` and `body`, without encoding it again.
+
+    Bytes values in the header already are in `body`, so only their references
+    are counted. They're counted at offset 0, which may be a few digits short.
+    """
+    # Encoded as ASCII, so the characters are the bytes
+    return _LENGTHS.size + len(json.dumps(header, default=_binary_reference)) + len(body)
+
+
+def encode_executables(
+    result: dict[str, Any],
+    request: dict[str, Any],
+    framed: bool,
+) -> dict[str, Any]:
+    """Encodes the raw executables in a result the way the request asks for."""
+    encoding = request.get("encoding", "base64")
+    compression = request.get("compression", "none")
+    if encoding not in ENCODINGS:
+        raise ProtocolError(f"Unknown encoding: {encoding}")
+    if compression not in COMPRESSIONS:
+        raise ProtocolError(f"Unknown compression: {compression}")
+    if encoding == "binary" and not framed:
+        raise ProtocolError("The binary encoding needs a framed connection")
+
+    def encode(executable: bytes) -> bytes | str:
+        data = compress(executable, compression)
+        return data if encoding == "binary" else b64encode(data).decode()
+
+    result = dict(result)
+    if "program" in result:
+        result["program"] = encode(result["program"])
+    if "results" in result:
+        result["results"] = [
+            {**item, "program": encode(item["program"])} if "program" in item else item
+            for item in result["results"]
+        ]
+    if compression != "none" and ("program" in result or "results" in result):
+        result["compression"] = compression
+    return result
+
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data)
+    if compression == "lzma":
+        return lzma.compress(data)
+    return data
+
+
+def decode_executable(program: bytes | str, compression: str = "none") -> bytes:
+    """Inverse of `encode_executables` for one executable."""
+    data = b64decode(program) if isinstance(program, str) else program
+    if compression == "zlib":
+        return zlib.decompress(data)
+    if compression == "lzma":
+        return lzma.decompress(data)
+    return data
+
+
+def read_frame(stream: io.BufferedIOBase, max_bytes: int) -> tuple[dict[str, Any], bytes] | None:
+    """Reads one frame. Returns None if the stream ends between frames."""
+    lengths = stream.read(_LENGTHS.size)
+    if not lengths:
+        return None
+    header_length, body_length = _unpack_lengths(lengths, max_bytes)
+    data = stream.read(header_length + body_length)
+    if len(data) < header_length + body_length:
+        raise ProtocolError("Connection closed in the middle of a frame")
+    return _decode_frame(data, header_length)
+
+
+async def read_frame_async(reader: asyncio.StreamReader, max_bytes: int) -> tuple[dict[str, Any], bytes] | None:
+    """Like `read_frame`, but for asyncio streams."""
+    try:
+        lengths = await reader.readexactly(_LENGTHS.size)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ProtocolError("Connection closed in the middle of a frame")
+    header_length, body_length = _unpack_lengths(lengths, max_bytes)
+    try:
+        data = await reader.readexactly(header_length + body_length)
+    except asyncio.IncompleteReadError:
+        raise ProtocolError("Connection closed in the middle of a frame")
+    return _decode_frame(data, header_length)
+
+
+def frame_request(header: dict[str, Any], body: bytes) -> dict[str, Any]:
+    """Returns the command of a request frame in the one-shot request format."""
+    request = dict(header)
+    request.pop("id", None)
+    if body:
+        request["code"] = body.decode()
+    return request
+
+
+def _unpack_lengths(lengths: bytes, max_bytes: int) -> tuple[int, int]:
+    if len(lengths) < _LENGTHS.size:
+        raise ProtocolError("Connection closed in the middle of a frame")
+    header_length, body_length = _LENGTHS.unpack(lengths)
+    if header_length + body_length > max_bytes:
+        raise ProtocolError(f"Frame larger than {max_bytes} bytes")
+    return header_length, body_length
+
+
+def _decode_frame(data: bytes, header_length: int) -> tuple[dict[str, Any], bytes]:
+    try:
+        header = json.loads(data[:header_length])
+    except ValueError as e:
+        raise ProtocolError(f"Invalid frame header: {e}")
+    if not isinstance(header, dict):
+        raise ProtocolError("Frame header must be a JSON object")
+    body = data[header_length:]
+    return _restore_binary(header, body), body
+
+
+def _extract_binary(value: Any, body: bytearray) -> Any:
+    if isinstance(value, bytes):
+        offset = len(body)
+        body += value
+        return {"$binary": [offset, len(value)]}
+    if isinstance(value, dict):
+        return {k: _extract_binary(v, body) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_extract_binary(v, body) for v in value]
+    return value
+
+
+def _binary_reference(value: Any) -> Any:
+    if isinstance(value, bytes):
+        return {"$binary": [0, len(value)]}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _restore_binary(value: Any, body: bytes) -> Any:
+    if isinstance(value, dict):
+        if value.keys() == {"$binary"}:
+            offset, length = value["$binary"]
+            return body[offset:offset + length]
+        return {k: _restore_binary(v, body) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_restore_binary(v, body) for v in value]
+    return value
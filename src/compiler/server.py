@@ -0,0 +1,348 @@
+"""The compile server behind `compiler.sh serve`.
+
+Clients either send one JSON request per connection and half-close it,
+then read one JSON response, or keep the connection open and exchange
+frames as described in `compiler.protocol`.
+
+By default the server pre-forks a pool of long-lived workers that
+accept connections from the shared listening socket. Workers are
+recycled after a number of requests or when they grow too large.
+A worker serves one connection at a time and closes framed connections
+that are idle for `keep_alive_timeout` seconds. With more busy keep-alive
+clients than workers, prefer `compiler.async_server`.
+
+With `metrics` set, the `stats` command reports latency histograms of
+requests and compile stages, and request and response sizes. With
+`stats_file` set too, the server writes them to that file on SIGUSR1 and
+at shutdown. With `trace_file` set, every process of the server appends
+spans of its work to that file (see `compiler.trace`).
+
+A compile request with `"code_stats": true` is always compiled rather than
+answered from the cache, and its response includes a `code_stats` report
+(see `compiler.code_stats`).
+"""
+import io
+import os
+import select
+import signal
+import socket
+import sys
+import time
+import json
+from socketserver import ForkingTCPServer, StreamRequestHandler, TCPServer
+from traceback import format_exception
+from typing import Any
+
+from compiler.assembler import default_stdlib_cache
+from compiler.executable_cache import ExecutableCache
+from compiler.instrument import add_observer, add_recorder, stage
+from compiler.metrics import Metrics
+from compiler.trace import Tracer
+from compiler.pipeline import call_compiler, call_jit, compile_with_stats
+from compiler.protocol import (
+    MAGIC, ProtocolError, encode_executables, encode_frame, frame_request, frame_size, read_frame,
+)
+from compiler.server_options import BACKPRESSURE_POLICIES, SERVER_MODELS, ServerOptions
+
+
+def handle_command(input: dict[str, Any], options: ServerOptions, framed: bool = False) -> dict[str, Any]:
+    """Runs one request and returns the response. Errors propagate to the caller."""
+    return encode_executables(run_command(input, options), input, framed)
+
+
+def run_command(input: dict[str, Any], options: ServerOptions) -> dict[str, Any]:
+    """Like `handle_command`, but leaves executables as raw bytes."""
+    result: dict[str, Any] = {}
+    cache = options.cache
+    if input["command"] == "compile":
+        source_code = input["code"]
+        key = ExecutableCache.key(source_code, {"backend": options.backend})
+        executable = cache.get(key) if cache is not None and not input.get("code_stats") else None
+        if executable is None:
+            if input.get("code_stats"):
+                executable, result["code_stats"] = compile_with_stats(source_code, "(source code)", options.backend)
+            else:
+                executable = call_compiler(source_code, "(source code)", options.backend)
+            if cache is not None:
+                cache.put(key, executable)
+        result["program"] = executable
+    elif input["command"] == "compile_many":
+        result["results"] = compile_many(input["programs"], options)
+    elif input["command"] == "jit":
+        # In a child process, so that crashing or endless programs don't take the worker with them
+        run = call_jit(input["code"], input.get("input", ""), isolated=True, timeout=options.jit_timeout)
+        result["stdout"] = run.stdout
+        result["stderr"] = run.stderr
+        result["exit_code"] = run.exit_code
+    elif input["command"] == "ping":
+        pass
+    elif input["command"] == "stats":
+        result["cache"] = cache.stats() if cache is not None else None
+        result["pid"] = os.getpid()
+        result["metrics"] = options.metrics.snapshot() if options.metrics is not None else None
+    else:
+        result["error"] = "Unknown command: " + input['command']
+    return result
+
+
+def compile_many(sources: list[str], options: ServerOptions) -> list[dict[str, Any]]:
+    """Compiles a batch of programs one after another.
+
+    Each result is either {"program": executable} or {"error": message}.
+    The servers already keep every core busy with their workers, so a
+    batch doesn't fork processes of its own. The asyncio server splits
+    batches into one request per program instead.
+    """
+    cache = options.cache
+    keys = [ExecutableCache.key(source_code, {"backend": options.backend}) for source_code in sources]
+    executables = [cache.get(key) if cache is not None else None for key in keys]
+    missing = [i for i, executable in enumerate(executables) if executable is None]
+    compiled = [_compile_or_error(sources[i], options.backend) for i in missing]
+
+    results: list[dict[str, Any]] = [{} for _ in sources]
+    for i, output in zip(missing, compiled):
+        if isinstance(output, str):
+            results[i] = {"error": output}
+        else:
+            executables[i] = output
+            if cache is not None:
+                cache.put(keys[i], output)
+    for i, executable in enumerate(executables):
+        if executable is not None:
+            results[i] = {"program": executable}
+    return results
+
+
+def _compile_or_error(source_code: str, backend: str) -> bytes | str:
+    try:
+        return call_compiler(source_code, "(source code)", backend)
+    except Exception as e:
+        return str(e)
+
+
+def run_server(options: ServerOptions) -> None:
+    class Handler(StreamRequestHandler):
+        rfile: io.BufferedReader
+
+        def handle(self) -> None:
+            if self.rfile.peek(1)[:1] == MAGIC[:1]:
+                self.handle_frames()
+                return
+            result: dict[str, Any]
+            with stage('read'):
+                input_bytes = self.rfile.read()
+            start = time.perf_counter()
+            try:
+                result = handle_command(json.loads(input_bytes), options)
+            except ProtocolError as e:
+                result = {"error": str(e)}
+            except Exception as e:
+                result = {"error": "".join(format_exception(e))}
+            output_bytes = json.dumps(result).encode()
+            with stage('write'):
+                self.request.sendall(output_bytes)
+            record_request(options.metrics, start, len(input_bytes), len(output_bytes))
+
+        def handle_frames(self) -> None:
+            # Requests are answered in order, one at a time. A worker serves
+            # one connection at a time, so it drops idle ones quickly.
+            self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            try:
+                self.connection.settimeout(options.read_timeout)
+                if self.rfile.read(len(MAGIC)) != MAGIC:
+                    raise ProtocolError("Unknown protocol")
+                while True:
+                    self.connection.settimeout(options.keep_alive_timeout)
+                    if not self.rfile.peek(1):
+                        break
+                    self.connection.settimeout(options.read_timeout)
+                    with stage('read'):
+                        frame = read_frame(self.rfile, options.max_request_bytes)
+                    if frame is None:
+                        break
+                    header, body = frame
+                    start = time.perf_counter()
+                    result: dict[str, Any]
+                    try:
+                        result = handle_command(frame_request(header, body), options, framed=True)
+                    except ProtocolError as e:
+                        result = {"error": str(e)}
+                    except Exception as e:
+                        result = {"error": "".join(format_exception(e))}
+                    result["id"] = header.get("id")
+                    output_bytes = encode_frame(result)
+                    with stage('write'):
+                        self.wfile.write(output_bytes)
+                    record_request(options.metrics, start, frame_size(header, body), len(output_bytes))
+            except ProtocolError as e:
+                self.wfile.write(encode_frame({"id": None, "error": str(e)}))
+            except TimeoutError:
+                pass
+
+    warm_up(options)
+    # After warming up, so that the warm-up compilation isn't counted
+    metrics = options.metrics
+    if metrics is not None:
+        add_observer(metrics.observe)
+        add_recorder(metrics.record_stage)
+        if options.stats_file is not None:
+            stats_file = options.stats_file
+            signal.signal(signal.SIGUSR1, lambda signum, frame: metrics.dump(stats_file))
+    if options.trace_file is not None:
+        tracer = Tracer(options.trace_file)
+        add_observer(tracer.span)
+        add_recorder(tracer.record_stage)
+    signal.signal(signal.SIGTERM, _raise_keyboard_interrupt)
+
+    print(f"Starting TCP server at {options.host}:{options.port}")
+    try:
+        if options.model == 'forking':
+            with _ForkingServer((options.host, options.port), Handler) as forking_server:
+                forking_server.serve_forever()
+        else:
+            with _Server((options.host, options.port), Handler) as server:
+                _run_worker_pool(server, options)
+    finally:
+        dump_stats(options)
+
+
+class _ForkingServer(ForkingTCPServer):
+    allow_reuse_address = True
+    request_queue_size = 32
+
+
+class _Server(TCPServer):
+    allow_reuse_address = True
+    request_queue_size = 128
+
+
+def _raise_keyboard_interrupt(signum: int, frame: object) -> None:
+    raise KeyboardInterrupt
+
+
+def record_request(metrics: Metrics | None, start: float, request_bytes: int, response_bytes: int) -> None:
+    if metrics is not None:
+        metrics.record("request", time.perf_counter() - start)
+        metrics.record("request_bytes", request_bytes)
+        metrics.record("response_bytes", response_bytes)
+
+
+def dump_stats(options: ServerOptions) -> None:
+    if options.metrics is not None and options.stats_file is not None:
+        options.metrics.dump(options.stats_file)
+
+
+def warm_up(options: ServerOptions) -> None:
+    """Builds per-process state once, so that forked workers inherit it."""
+    default_stdlib_cache.warm()
+    call_compiler("print_int(1)", "(warm-up)", options.backend)
+
+
+# Workers that exit with an error are replaced after a delay that doubles
+# with every recent crash, and the server gives up on too many of them.
+_RESPAWN_DELAY = 0.1
+_MAX_RESPAWN_DELAY = 5.0
+_MAX_CRASHES_PER_MINUTE = 10
+
+# How often an idle worker checks whether it has been asked to stop
+_IDLE_POLL_SECONDS = 0.5
+
+
+def _run_worker_pool(server: _Server, options: ServerOptions) -> None:
+    workers: set[int] = set()
+    crash_times: list[float] = []
+
+    def spawn() -> None:
+        # Keep SIGTERM pending until the new worker is recorded here.
+        # The worker inherits it blocked, see `_worker_main`.
+        signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                code = _worker_main(server, options)
+            finally:
+                os._exit(code)
+        workers.add(pid)
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+
+    try:
+        for _ in range(options.workers):
+            spawn()
+        while True:
+            pid, status = os.wait()
+            workers.discard(pid)
+            if os.waitstatus_to_exitcode(status) != 0:
+                now = time.monotonic()
+                crash_times = [t for t in crash_times if now - t < 60] + [now]
+                if len(crash_times) > _MAX_CRASHES_PER_MINUTE:
+                    raise Exception(f"{len(crash_times)} workers crashed within a minute, stopping the server")
+                time.sleep(min(_MAX_RESPAWN_DELAY, _RESPAWN_DELAY * 2 ** (len(crash_times) - 1)))
+            spawn()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for pid in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for pid in workers:
+            try:
+                os.waitpid(pid, 0)
+            except ChildProcessError:
+                pass
+
+
+def _worker_main(server: _Server, options: ServerOptions) -> int:
+    # SIGTERM stays blocked, as `spawn` left it, except while a request is
+    # handled. An idle worker polls for it, so a connection is never
+    # accepted and then dropped. During a request it's only noted, and the
+    # request is finished first.
+    stop_requested = False
+
+    def on_sigterm(signum: int, frame: object) -> None:
+        nonlocal stop_requested
+        stop_requested = True
+
+    signal.signal(signal.SIGTERM, on_sigterm)
+    # Ctrl-C reaches the whole process group. The parent handles it and stops us.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Every worker is woken up for a new connection, and the ones that
+    # lose the race for it give up accepting after this long.
+    server.socket.settimeout(_IDLE_POLL_SECONDS)
+
+    served = 0
+    while served < options.max_requests_per_worker and not stop_requested:
+        if signal.SIGTERM in signal.sigpending():
+            break
+        if not select.select([server.socket], [], [], _IDLE_POLL_SECONDS)[0]:
+            continue
+        try:
+            with stage('accept'):
+                request, client_address = server.get_request()
+        except OSError:
+            continue
+        served += 1
+        signal.pthread_sigmask(signal.SIG_UNBLOCK, {signal.SIGTERM})
+        try:
+            server.finish_request(request, client_address)
+        except Exception:
+            server.handle_error(request, client_address)
+        finally:
+            server.shutdown_request(request)
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGTERM})
+        if options.max_worker_rss_bytes is not None and _rss_bytes() > options.max_worker_rss_bytes:
+            break
+    sys.stdout.flush()
+    return 0
+
+
+def _rss_bytes() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        import resource
+        # Peak rather than current RSS, but good enough for recycling.
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,41 @@
+"""Settings of the compile servers.
+
+Kept apart from `compiler.server` so that the CLI can parse server flags
+without importing the servers themselves.
+"""
+import os
+from dataclasses import dataclass
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from compiler.executable_cache import ExecutableCache
+    from compiler.metrics import Metrics
+
+SERVER_MODELS = ('prefork', 'forking')
+BACKPRESSURE_POLICIES = ('reject', 'wait')
+
+
+@dataclass
+class ServerOptions:
+    host: str = "127.0.0.1"
+    port: int = 3000
+    backend: str = 'builtin'
+    cache: "ExecutableCache | None" = None
+    model: str = 'prefork'
+    workers: int = os.cpu_count() or 1
+    max_requests_per_worker: int = 1000
+    max_worker_rss_bytes: int | None = None
+    max_request_bytes: int = 16 * 1024 * 1024
+    read_timeout: float = 30.0
+    keep_alive_timeout: float = 2.0
+    # Programs run with the `jit` command are killed after this many seconds
+    jit_timeout: float = 10.0
+    metrics: "Metrics | None" = None
+    stats_file: str | None = None
+    trace_file: str | None = None
+    # Used by the asyncio server, see `compiler.async_server`
+    queue_depth: int = 64
+    backpressure: str = 'reject'
+    queue_timeout: float = 10.0
+    max_connections: int = 1024
+    max_frames_in_flight: int = 16
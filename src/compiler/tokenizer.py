@@ -1,5 +1,13 @@
+import codecs
+import io
+import mmap
+import os
 import re as regex
+import string
+from array import array
 from dataclasses import dataclass
+from sys import intern
+from typing import BinaryIO, Iterable, Iterator, NoReturn
 
 
 @dataclass(frozen=True)
@@ -24,58 +32,386 @@ class Token:
         return f'Token(loc={self.loc}, type="{self.type}", text="{self.text}")'
 
 
-TOKEN_PATTERNS = {
-    "comment": r'(//.*?(\n|$)|#.*?(\n|$)|/\*.*?\*/)',
-    "int_literal": r'\b[0-9]+\b',
-    "bool_literal": r'\b(true|false)\b',
-    "unary_op": r'\bnot\b',
-    "binary_op": r'and|or|!=|==|<=|>=|<|>|\%=?|\+=?|\/=?|\*=?|\-=?|\=(?!\d)',
-    "keyword": r'\bvar|while|if|else|then|do|Int|Bool\b',
-    "punctuation": r'[(),;{}:]',
-    "newline": r'\n',
-    "whitespace": r'[ \t]+',
-    "identifier": r'_?[A-Za-z_]+[a-zA-Z0-9_]*',
-    "except": r'.',
+# Every operator, keyword, punctuation character and boolean literal is
+# a token kind of its own, so that its text and type follow from its kind.
+FIXED_TOKENS = {
+    "true": "bool_literal",
+    "false": "bool_literal",
+    "not": "unary_op",
+    **{op: "binary_op" for op in (
+        "and", "or", "==", "!=", "<", "<=", ">", ">=", "+", "-", "*", "/", "%",
+        "=", "+=", "-=", "*=", "/=", "%=",
+    )},
+    **{word: "keyword" for word in ("var", "while", "if", "else", "then", "do", "Int", "Bool")},
+    **{char: "punctuation" for char in "(),;{}:"},
 }
 
+# Token kinds are small ints: these three, then those of `FIXED_TOKENS` in order.
+# `END` is the kind of the token the parser sees after the last one.
+END, INT_LITERAL, IDENTIFIER = range(3)
+KIND_TYPES = ("end", "int_literal", "identifier", *FIXED_TOKENS.values())
+KIND_TEXTS = ("", "", "", *FIXED_TOKENS)
+KINDS = {text: kind for kind, text in enumerate(KIND_TEXTS) if kind > IDENTIFIER}
+
+
+def kind_of(token: Token) -> int:
+    if token.type == "int_literal":
+        return INT_LITERAL
+    elif token.type == "identifier":
+        return IDENTIFIER
+    return KINDS[token.text]
+
+
+class TokenStream:
+    """The tokens of a piece of source code, stored as parallel arrays.
+
+    Token `i` has the kind `kinds[i]`, the text
+    `source_code[starts[i]:starts[i] + lengths[i]]` and the location
+    `Location(lines[i], columns[i])`. Iterating over the stream creates
+    `Token` objects one at a time, and `rows` creates tuples instead.
+    Identifiers are interned, so equal names are the same string.
+    """
+
+    def __init__(self, source_code: str) -> None:
+        self.source_code = source_code
+        self.kinds = array("B")
+        self.starts = array("Q")
+        self.lengths = array("I")
+        self.lines = array("I")
+        self.columns = array("I")
+
+    def __len__(self) -> int:
+        return len(self.kinds)
+
+    def __iter__(self) -> Iterator[Token]:
+        for kind, text, line, column in self.rows():
+            yield Token(Location(line, column), KIND_TYPES[kind], text)
+
+    def rows(self) -> Iterator[tuple[int, str, int, int]]:
+        """Yields the kind, text, line and column of each token."""
+        source_code = self.source_code
+        for kind, start, length, line, column in zip(self.kinds, self.starts, self.lengths, self.lines, self.columns):
+            if kind == IDENTIFIER:
+                yield kind, intern(source_code[start:start + length]), line, column
+            elif kind == INT_LITERAL:
+                yield kind, source_code[start:start + length], line, column
+            else:
+                yield kind, KIND_TEXTS[kind], line, column
+
+    def text(self, index: int) -> str:
+        kind = self.kinds[index]
+        if kind > IDENTIFIER:
+            return KIND_TEXTS[kind]
+        start = self.starts[index]
+        text = self.source_code[start:start + self.lengths[index]]
+        return intern(text) if kind == IDENTIFIER else text
+
+    def token(self, index: int) -> Token:
+        return Token(
+            Location(self.lines[index], self.columns[index]),
+            KIND_TYPES[self.kinds[index]],
+            self.text(index)
+        )
+
+
+# The scanner looks at the first character of a token to decide how to
+# scan the rest. Its results match those of the regex alternation this
+# module used to be, quirks included: `and`, `or` and most keywords are
+# split off the front of longer identifiers, and `var`, `Bool`, `true`,
+# `false`, `not` and integers need word boundaries.
+
+_SPACE, _NEWLINE, _LETTER, _DIGIT, _PUNCTUATION, _OPERATOR, _SLASH, _HASH, _EQUALS, _BANG = range(10)
+
+_CHAR_KINDS = {
+    **{char: _SPACE for char in " \t"},
+    "\n": _NEWLINE,
+    **{char: _LETTER for char in string.ascii_letters + "_"},
+    **{char: _DIGIT for char in string.digits},
+    **{char: _PUNCTUATION for char in "(),;{}:"},
+    # Optionally followed by `=`
+    **{char: _OPERATOR for char in "%+*-<>"},
+    "/": _SLASH,
+    "#": _HASH,
+    "=": _EQUALS,
+    "!": _BANG,
+}
+
+_WORD = regex.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+_DIGITS = regex.compile(r'[0-9]+')
+
+# Token kinds of words, and whether they need a word boundary before and after them
+_WORDS = {
+    "true": (KINDS["true"], True, True),
+    "false": (KINDS["false"], True, True),
+    "not": (KINDS["not"], True, True),
+    "and": (KINDS["and"], False, False),
+    "or": (KINDS["or"], False, False),
+    "var": (KINDS["var"], True, False),
+    "while": (KINDS["while"], False, False),
+    "if": (KINDS["if"], False, False),
+    "else": (KINDS["else"], False, False),
+    "then": (KINDS["then"], False, False),
+    "do": (KINDS["do"], False, False),
+    "Int": (KINDS["Int"], False, False),
+    "Bool": (KINDS["Bool"], False, True),
+}
+
+# Words that are tokens even at the start of a longer word, by first letter
+_PREFIXES = {
+    word[0]: word
+    for word, (_, _, needs_boundary_after) in _WORDS.items()
+    if not needs_boundary_after
+}
+
+
+def _is_word_char(char: str) -> bool:
+    """Whether `char` is matched by `\\w`."""
+    return char.isalnum() or char == "_"
+
+
+def _scan_word(source_code: str, start: int, stop: int) -> tuple[int, int]:
+    """Returns the kind and length of the token at the start of the word `source_code[start:stop]`."""
+    word = source_code[start:stop]
+    boundary_before = start == 0 or not _is_word_char(source_code[start - 1])
+    if word in _WORDS:
+        kind, needs_boundary_before, needs_boundary_after = _WORDS[word]
+        if (
+            (boundary_before or not needs_boundary_before)
+            and (not needs_boundary_after or stop == len(source_code) or not _is_word_char(source_code[stop]))
+        ):
+            return kind, len(word)
+    prefix = _PREFIXES.get(word[0])
+    if prefix is not None and word.startswith(prefix) and (boundary_before or not _WORDS[prefix][1]):
+        return _WORDS[prefix][0], len(prefix)
+    return IDENTIFIER, len(word)
+
 
 def tokenize(source_code: str) -> list[Token]:
-    tokens = []
+    return list(tokenize_stream(source_code))
+
+
+# Sources at least this long are tokenized on every core by default
+PARALLEL_THRESHOLD = 8 * 1024 * 1024
+
+
+def tokenize_stream(source_code: str, jobs: int | None = None) -> TokenStream:
+    """Like `tokenize`, but without creating a `Token` for every token.
+
+    With more than one job, the source is cut into runs of whole lines,
+    which are tokenized in a pool of `jobs` processes. By default that's
+    one per core for sources of at least `PARALLEL_THRESHOLD` characters.
+    The tokens are the same either way.
+    """
+    if jobs is None:
+        jobs = (os.cpu_count() or 1) if len(source_code) >= PARALLEL_THRESHOLD else 1
+    if jobs > 1:
+        return _tokenize_parallel(source_code, jobs)
+    stream = TokenStream(source_code)
+    _scan(stream, 1)
+    return stream
+
 
+# The source being tokenized in parallel, inherited by the forked workers
+_parallel_source = ""
+
+
+def _tokenize_parallel(source_code: str, jobs: int) -> TokenStream:
+    """Tokenizes runs of whole lines in worker processes and joins their tokens.
+
+    Tokens and comments never continue past the end of a line, so any
+    line break is a safe place to cut. Every run is scanned as if it
+    started on line 1, and its lines are shifted once the lines of the
+    runs before it are known, since a comment can count as a line of its own.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+    global _parallel_source
+
+    # More runs than jobs, so that the first ones are joined while the rest are still scanned
+    run_count = jobs * 4
+    cuts = [0]
+    for index in range(1, run_count):
+        cut = source_code.find("\n", max(cuts[-1], len(source_code) * index // run_count)) + 1
+        if cut == 0:
+            break
+        cuts.append(cut)
+    cuts.append(len(source_code))
+
+    stream = TokenStream(source_code)
     line = 1
-    column = 1
+    _parallel_source = source_code
+    try:
+        with ProcessPoolExecutor(jobs, mp_context=multiprocessing.get_context("fork")) as pool:
+            for kinds, starts, lengths, lines, columns, line_count in pool.map(_scan_run, cuts[:-1], cuts[1:]):
+                stream.kinds.extend(kinds)
+                stream.starts.extend(starts)
+                stream.lengths.extend(lengths)
+                stream.lines.extend(lines if line == 1 else array("I", map((line - 1).__add__, lines)))
+                stream.columns.extend(columns)
+                line += line_count
+    except RuntimeError:
+        # The error's line is relative to its run, so tokenize again to report it
+        return tokenize_stream(source_code, jobs=1)
+    finally:
+        _parallel_source = ""
+    return stream
 
-    pattern = regex.compile(
-        "|".join(
-            f"(?P<{token_type}>{pattern})" for token_type,
-            pattern in TOKEN_PATTERNS.items()
-        )
-    )
 
-    for match in regex.finditer(pattern, source_code):
-        token_type = match.lastgroup
-        value = match.group()
+def _scan_run(start: int, stop: int) -> tuple[array[int], array[int], array[int], array[int], array[int], int]:
+    stream = TokenStream(_parallel_source)
+    line_count = _scan(stream, 1, start, stop) - 1
+    return stream.kinds, stream.starts, stream.lengths, stream.lines, stream.columns, line_count
+
+
+def iter_tokens(source: str | Iterable[str]) -> Iterator[Token]:
+    """Tokenizes source code that arrives in chunks, as lazily as possible.
+
+    No token or comment continues past the end of a line, so chunks are
+    joined and cut at line breaks, and each run of whole lines is
+    tokenized on its own. Memory use grows with the chunk size and the
+    longest line, not with the whole source.
+    """
+    for stream in iter_token_streams(source):
+        yield from stream
+
+
+def iter_token_streams(source: str | Iterable[str]) -> Iterator[TokenStream]:
+    """Like `iter_tokens`, but yields the tokens of each run of whole lines as a `TokenStream`."""
+    if isinstance(source, str):
+        source = [source]
+    line = 1
+    # The rest of the current line, in pieces, so that long lines aren't copied over and over
+    pending: list[str] = []
+    for chunk in source:
+        cut = chunk.rfind("\n") + 1
+        if cut == 0:
+            pending.append(chunk)
+            continue
+        pending.append(chunk[:cut])
+        stream = TokenStream("".join(pending))
+        line = _scan(stream, line)
+        yield stream
+        pending = [chunk[cut:]]
+    stream = TokenStream("".join(pending))
+    _scan(stream, line)
+    yield stream
+
 
-        if token_type == "newline" or token_type == "comment":
+def read_chunks(file: BinaryIO | mmap.mmap, chunk_size: int = 64 * 1024) -> Iterator[str]:
+    """Decodes a binary file or an mmap in chunks, like reading it in text mode would."""
+    decoder = io.IncrementalNewlineDecoder(codecs.getincrementaldecoder("utf-8")(), translate=True)
+    while chunk := file.read(chunk_size):
+        yield decoder.decode(chunk)
+    yield decoder.decode(b"", final=True)
+
+
+def read_source(file: BinaryIO) -> str | Iterator[str]:
+    """Reads a source file in chunks, or whole if it's big enough to be tokenized in parallel."""
+    if os.fstat(file.fileno()).st_size >= PARALLEL_THRESHOLD:
+        return "".join(read_chunks(file))
+    return read_chunks(file)
+
+
+def _scan(stream: TokenStream, line: int, position: int = 0, end: int | None = None) -> int:
+    """Adds the tokens of whole lines starting at `line` to the stream, and returns the line after them.
+
+    Only `source_code[position:end]` is scanned, which must start at the
+    start of a line and end after a line break or at the end of the source.
+    """
+    source_code = stream.source_code
+    add_kind = stream.kinds.append
+    add_start = stream.starts.append
+    add_length = stream.lengths.append
+    add_line = stream.lines.append
+    add_column = stream.columns.append
+
+    column = 1
+    if end is None:
+        end = len(source_code)
+
+    while position < end:
+        char = source_code[position]
+        char_kind = _CHAR_KINDS.get(char)
+
+        if char_kind == _SPACE:
+            start = position
+            position += 1
+            while position < end and source_code[position] in " \t":
+                position += 1
+            column += position - start
+            continue
+        elif char_kind == _NEWLINE:
+            position += 1
             line += 1
             column = 1
             continue
-        elif token_type == "whitespace":
-            column += len(value)
-            continue
-        elif token_type == "except":
-            raise RuntimeError(
-                f"Caught unexpected value: '{value}' at position ({line},{column})."
-            )
-
-        tokens.append(
-            Token(
-                Location(line, column),
-                token_type,
-                value
-            )
-        )
+        elif char_kind == _LETTER:
+            match = _WORD.match(source_code, position)
+            assert match is not None
+            stop = match.end()
+            if source_code[position] in _PREFIXES or source_code[position:stop] in _WORDS:
+                kind, length = _scan_word(source_code, position, stop)
+            else:
+                kind, length = IDENTIFIER, stop - position
+        elif char_kind == _PUNCTUATION:
+            kind, length = KINDS[char], 1
+        elif char_kind == _DIGIT:
+            match = _DIGITS.match(source_code, position)
+            assert match is not None
+            stop = match.end()
+            if (
+                (position > 0 and _is_word_char(source_code[position - 1]))
+                or (stop < end and _is_word_char(source_code[stop]))
+            ):
+                _raise_unexpected(char, line, column)
+            kind, length = INT_LITERAL, stop - position
+        elif char_kind == _OPERATOR:
+            length = 2 if source_code.startswith("=", position + 1) else 1
+            kind = KINDS[source_code[position:position + length]]
+        elif char_kind == _SLASH or char_kind == _HASH:
+            next_char = source_code[position + 1:position + 2]
+            if char_kind == _HASH or next_char == "/":
+                stop = source_code.find("\n", position)
+                position = end if stop == -1 else stop + 1
+                line += 1
+                column = 1
+                continue
+            if next_char == "*":
+                # Block comments end on the line they start on
+                line_end = source_code.find("\n", position)
+                stop = source_code.find("*/", position + 2, end if line_end == -1 else line_end)
+                if stop != -1:
+                    position = stop + 2
+                    line += 1
+                    column = 1
+                    continue
+            kind, length = (KINDS["/="], 2) if next_char == "=" else (KINDS["/"], 1)
+        elif char_kind == _EQUALS:
+            next_char = source_code[position + 1:position + 2]
+            if next_char == "=":
+                kind, length = KINDS["=="], 2
+            elif next_char.isdecimal():
+                _raise_unexpected(char, line, column)
+            else:
+                kind, length = KINDS["="], 1
+        elif char_kind == _BANG and source_code.startswith("=", position + 1):
+            kind, length = KINDS["!="], 2
+        else:
+            _raise_unexpected(char, line, column)
 
-        column += len(value)
+        add_kind(kind)
+        add_start(position)
+        add_length(length)
+        add_line(line)
+        add_column(column)
 
-    return tokens
+        column += length
+        position += length
+
+    return line
+
+
+def _raise_unexpected(value: str, line: int, column: int) -> NoReturn:
+    raise RuntimeError(
+        f"Caught unexpected value: '{value}' at position ({line},{column})."
+    )
@@ -0,0 +1,63 @@
+"""Chrome trace-event output for single compilations, enabled with `--trace=FILE`.
+
+A `Tracer` observes the stages in `compiler.instrument` and appends one
+complete ("X") event per stage to the file. The file uses the JSON array
+format, whose closing bracket is optional, so processes forked from the
+server can all append to the same file and the result opens directly in
+chrome://tracing or Perfetto. Events carry the pid and thread id of the
+process that recorded them, and timestamps from the system-wide monotonic
+clock, so spans from different workers line up.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Iterator
+
+
+class Tracer:
+    _fd: int
+
+    def __init__(self, path: str) -> None:
+        # Appends are atomic, so concurrent writers never interleave events
+        self._fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, b"[\n")
+
+    @contextmanager
+    def span(self, name: str) -> Iterator[None]:
+        """An observer for `instrument.add_observer`."""
+        start = time.monotonic_ns()
+        try:
+            yield
+        finally:
+            self._write(name, start, time.monotonic_ns())
+
+    def record_stage(self, name: str, wall: float, cpu: float) -> None:
+        """A recorder for `instrument.add_recorder`. The span ends now."""
+        end = time.monotonic_ns()
+        self._write(name, end - int(wall * 1e9), end)
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+    def _write(self, name: str, start: int, end: int) -> None:
+        event = {
+            "name": name,
+            "cat": "compiler",
+            "ph": "X",
+            "ts": start / 1000,
+            "dur": (end - start) / 1000,
+            "pid": os.getpid(),
+            "tid": threading.get_native_id(),
+        }
+        os.write(self._fd, json.dumps(event).encode() + b",\n")
+
+
+def read_trace(path: str) -> list[dict[str, Any]]:
+    """Parses a trace file, which may lack its closing bracket."""
+    with open(path) as f:
+        text = f.read().rstrip().rstrip(",")
+    events: list[dict[str, Any]] = json.loads(text + "]")
+    return events
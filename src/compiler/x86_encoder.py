@@ -0,0 +1,531 @@
+"""A small in-process x86-64 assembler for the AT&T syntax we generate.
+
+It understands the instruction subset emitted by `assembly_generator`,
+`intrinsics` and the stdlib in `assembler`, which is enough to produce
+static executables without invoking `as` and `ld`.
+
+Each source file is parsed into a position independent `Unit`.
+`link` lays units out after each other, resolves symbols
+(non-global symbols are private to their unit, like with a real linker)
+and patches in the final addresses.
+"""
+import re
+from dataclasses import dataclass, field
+
+
+class AssemblyError(Exception):
+    pass
+
+
+REGISTERS_64 = {
+    'rax': 0, 'rcx': 1, 'rdx': 2, 'rbx': 3, 'rsp': 4, 'rbp': 5, 'rsi': 6, 'rdi': 7,
+    'r8': 8, 'r9': 9, 'r10': 10, 'r11': 11, 'r12': 12, 'r13': 13, 'r14': 14, 'r15': 15,
+}
+
+REGISTERS_8 = {
+    'al': 0, 'cl': 1, 'dl': 2, 'bl': 3, 'spl': 4, 'bpl': 5, 'sil': 6, 'dil': 7,
+    'r8b': 8, 'r9b': 9, 'r10b': 10, 'r11b': 11, 'r12b': 12, 'r13b': 13, 'r14b': 14, 'r15b': 15,
+}
+
+CONDITION_CODES = {
+    'o': 0, 'no': 1, 'b': 2, 'nae': 2, 'ae': 3, 'nb': 3, 'e': 4, 'z': 4, 'ne': 5, 'nz': 5,
+    'be': 6, 'na': 6, 'a': 7, 'nbe': 7, 's': 8, 'ns': 9, 'p': 10, 'np': 11,
+    'l': 12, 'nge': 12, 'ge': 13, 'nl': 13, 'le': 14, 'ng': 14, 'g': 15, 'nle': 15,
+}
+
+# mnemonic -> (opcode for 'op reg, r/m', opcode for 'op r/m, reg', /digit for immediates)
+ALU_OPERATIONS = {
+    'add': (0x01, 0x03, 0),
+    'or': (0x09, 0x0B, 1),
+    'and': (0x21, 0x23, 4),
+    'sub': (0x29, 0x2B, 5),
+    'xor': (0x31, 0x33, 6),
+    'cmp': (0x39, 0x3B, 7),
+}
+
+# mnemonic -> /digit of the 0xF7 (neg, idiv) or 0xFF (inc, dec) group
+UNARY_OPERATIONS = {
+    'neg': (0xF7, 3),
+    'idiv': (0xF7, 7),
+    'inc': (0xFF, 0),
+    'dec': (0xFF, 1),
+}
+
+SIZED_MNEMONICS = {'mov', 'movabs', 'push', 'pop', 'imul', *ALU_OPERATIONS, *UNARY_OPERATIONS}
+
+
+@dataclass(frozen=True)
+class Register:
+    number: int
+    size: int
+
+
+@dataclass(frozen=True)
+class Immediate:
+    expr: 'Expr'
+
+
+@dataclass(frozen=True)
+class Memory:
+    displacement: int
+    base: Register
+
+
+@dataclass(frozen=True)
+class Target:
+    """A jump or call destination given by a symbol."""
+    name: str
+
+
+@dataclass(frozen=True)
+class Indirect:
+    """A jump or call destination given by a register, e.g. `*%rax`."""
+    register: Register
+
+
+Operand = Register | Immediate | Memory | Target | Indirect
+
+# A linear expression: a constant plus signed symbol terms.
+# The location counter `.` is stored as a symbol bound when the expression is parsed.
+Expr = tuple[int, tuple[tuple[int, str], ...]]
+
+
+@dataclass
+class Fixup:
+    offset: int
+    kind: str  # 'rel32', 'abs32s' or 'abs64'
+    expr: Expr
+
+
+@dataclass
+class Unit:
+    """Machine code for one source file, before addresses are known."""
+    code: bytearray = field(default_factory=bytearray)
+    labels: dict[str, int] = field(default_factory=dict)
+    equates: dict[str, Expr] = field(default_factory=dict)
+    globals: set[str] = field(default_factory=set)
+    fixups: list[Fixup] = field(default_factory=list)
+
+
+@dataclass(frozen=True)
+class LinkedCode:
+    code: bytes
+    origin: int
+    symbols: dict[str, int]
+
+
+_SYMBOL = r'[A-Za-z_.$][\w.$]*'
+_LABEL_RE = re.compile(rf'\s*({_SYMBOL}):')
+_EQUATE_RE = re.compile(rf'\s*({_SYMBOL})\s*=\s*(.+)')
+_MEMORY_RE = re.compile(r'([-+]?\w*)\(%(\w+)\)')
+_TERM_RE = re.compile(rf'\s*([-+]?)\s*(0x[0-9a-fA-F]+|\d+|{_SYMBOL})\s*')
+
+
+def parse_unit(source: str) -> Unit:
+    """Assembles one source file into a relocatable unit."""
+    unit = Unit()
+    for line_number, raw_line in enumerate(source.splitlines(), start=1):
+        line = _strip_comment(raw_line)
+        try:
+            while (m := _LABEL_RE.match(line)) is not None:
+                _define(unit, m[1])
+                unit.labels[m[1]] = len(unit.code)
+                line = line[m.end():]
+            line = line.strip()
+            if not line:
+                continue
+            if (m := _EQUATE_RE.fullmatch(line)) is not None:
+                _define(unit, m[1])
+                unit.equates[m[1]] = _parse_expr(m[2], location=len(unit.code))
+            elif line.startswith('.'):
+                _directive(unit, line)
+            else:
+                mnemonic, _, rest = line.partition(' ')
+                _instruction(unit, mnemonic, [_parse_operand(o) for o in _split_operands(rest)])
+        except AssemblyError as e:
+            raise AssemblyError(f"line {line_number}: {e}: {raw_line.strip()}")
+        except ValueError as e:
+            # Wrong operand counts fail to unpack, e.g. `(target,) = operands`
+            raise AssemblyError(f"line {line_number}: unsupported input ({e}): {raw_line.strip()}")
+    return unit
+
+
+def link(units: list[Unit], origin: int) -> LinkedCode:
+    """Places the units after each other starting at address `origin`."""
+    bases: list[int] = []
+    code = bytearray()
+    exported: dict[str, int] = {}
+    for index, unit in enumerate(units):
+        while len(code) % 16 != 0:
+            code.append(0xCC)
+        bases.append(origin + len(code))
+        code += unit.code
+        for name in unit.globals:
+            if name in unit.labels or name in unit.equates:
+                if name in exported:
+                    raise AssemblyError(f"symbol '{name}' defined in multiple units")
+                exported[name] = index
+
+    def resolve(index: int, name: str, seen: frozenset[str] = frozenset()) -> int:
+        unit = units[index]
+        if name.startswith('.@'):
+            return bases[index] + int(name[2:])
+        if name in unit.labels:
+            return bases[index] + unit.labels[name]
+        if name in unit.equates:
+            if name in seen:
+                raise AssemblyError(f"circular definition of '{name}'")
+            return evaluate(index, unit.equates[name], seen | {name})
+        if name in exported:
+            return resolve(exported[name], name)
+        raise AssemblyError(f"undefined symbol '{name}'")
+
+    def evaluate(index: int, expr: Expr, seen: frozenset[str] = frozenset()) -> int:
+        constant, terms = expr
+        return constant + sum(sign * resolve(index, name, seen) for sign, name in terms)
+
+    for index, unit in enumerate(units):
+        for fixup in unit.fixups:
+            position = bases[index] - origin + fixup.offset
+            value = evaluate(index, fixup.expr)
+            if fixup.kind == 'rel32':
+                value -= origin + position + 4
+                code[position:position + 4] = _int32(value, "jump target out of range")
+            elif fixup.kind == 'abs32s':
+                code[position:position + 4] = _int32(value, "address does not fit in 32 bits")
+            else:
+                code[position:position + 8] = (value & (2**64 - 1)).to_bytes(8, 'little')
+
+    symbols = {name: resolve(index, name) for name, index in exported.items()}
+    return LinkedCode(code=bytes(code), origin=origin, symbols=symbols)
+
+
+def _define(unit: Unit, name: str) -> None:
+    if name in unit.labels or name in unit.equates:
+        raise AssemblyError(f"symbol '{name}' is already defined")
+
+
+def _strip_comment(line: str) -> str:
+    in_string = False
+    for i, c in enumerate(line):
+        if c == '"' and (i == 0 or line[i - 1] != '\\'):
+            in_string = not in_string
+        elif c == '#' and not in_string:
+            return line[:i]
+    return line
+
+
+def _split_operands(text: str) -> list[str]:
+    operands: list[str] = []
+    depth = 0
+    current = ''
+    for c in text:
+        if c == ',' and depth == 0:
+            operands.append(current.strip())
+            current = ''
+            continue
+        depth += (c == '(') - (c == ')')
+        current += c
+    if current.strip():
+        operands.append(current.strip())
+    return operands
+
+
+def _parse_register(text: str) -> Register:
+    name = text.removeprefix('%')
+    if name in REGISTERS_64:
+        return Register(REGISTERS_64[name], 64)
+    if name in REGISTERS_8:
+        return Register(REGISTERS_8[name], 8)
+    raise AssemblyError(f"unknown register '{text}'")
+
+
+def _parse_operand(text: str) -> Operand:
+    if text.startswith('%'):
+        return _parse_register(text)
+    if text.startswith('$'):
+        return Immediate(_parse_expr(text[1:], location=None))
+    if text.startswith('*%'):
+        return Indirect(_parse_register(text[1:]))
+    if (m := _MEMORY_RE.fullmatch(text)) is not None:
+        displacement = _parse_int(m[1]) if m[1] not in ('', '-', '+') else 0
+        return Memory(displacement, _parse_register(m[2]))
+    if re.fullmatch(_SYMBOL, text):
+        return Target(text)
+    raise AssemblyError(f"unsupported operand '{text}'")
+
+
+def _parse_expr(text: str, location: int | None) -> Expr:
+    constant = 0
+    terms: list[tuple[int, str]] = []
+    pos = 0
+    text = text.strip()
+    while pos < len(text):
+        m = _TERM_RE.match(text, pos)
+        if m is None or m.end() == pos:
+            raise AssemblyError(f"unsupported expression '{text}'")
+        sign = -1 if m[1] == '-' else 1
+        if pos > 0 and not m[1]:
+            raise AssemblyError(f"unsupported expression '{text}'")
+        term = m[2]
+        if term[0].isdigit():
+            constant += sign * _parse_int(term)
+        elif term == '.':
+            if location is None:
+                raise AssemblyError("'.' is only supported in symbol definitions")
+            terms.append((sign, f'.@{location}'))
+        else:
+            terms.append((sign, term))
+        pos = m.end()
+    return constant, tuple(terms)
+
+
+def _parse_int(text: str) -> int:
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise AssemblyError(f"unsupported number '{text}'")
+
+
+def _constant(operand: Immediate) -> int | None:
+    constant, terms = operand.expr
+    return None if terms else constant
+
+
+def _directive(unit: Unit, line: str) -> None:
+    name, _, rest = line.partition(' ')
+    rest = rest.strip()
+    if name in ('.global', '.globl'):
+        unit.globals.update(s.strip() for s in rest.split(','))
+    elif name in ('.extern', '.type', '.section', '.text', '.size', '.file'):
+        # Only a single text section is supported and everything lives in it.
+        if name == '.section' and rest.split(',')[0] != '.text':
+            raise AssemblyError(f"unsupported section '{rest}'")
+    elif name in ('.ascii', '.asciz', '.string'):
+        data = _parse_string(rest)
+        unit.code += data + (b'\0' if name != '.ascii' else b'')
+    else:
+        raise AssemblyError(f"unsupported directive '{name}'")
+
+
+def _parse_string(text: str) -> bytes:
+    if len(text) < 2 or text[0] != '"' or text[-1] != '"':
+        raise AssemblyError(f"expected a string literal, got {text}")
+    escapes = {'n': b'\n', 't': b'\t', '\\': b'\\', '"': b'"', '0': b'\0'}
+    result = bytearray()
+    chars = iter(text[1:-1])
+    for c in chars:
+        if c == '\\':
+            escaped = next(chars, '')
+            if escaped not in escapes:
+                raise AssemblyError(f"unsupported escape '\\{escaped}'")
+            result += escapes[escaped]
+        else:
+            result += c.encode()
+    return bytes(result)
+
+
+def _int32(value: int, message: str) -> bytes:
+    if not -2**31 <= value < 2**31:
+        raise AssemblyError(message)
+    return value.to_bytes(4, 'little', signed=True)
+
+
+def _fits_int8(value: int) -> bool:
+    return -128 <= value < 128
+
+
+def _modrm(reg_field: int, rm: Register | Memory) -> tuple[int, int, bytes]:
+    """Returns (REX.R, REX.B, ModRM + SIB + displacement bytes)."""
+    rex_r = (reg_field >> 3) & 1
+    if isinstance(rm, Register):
+        return rex_r, (rm.number >> 3) & 1, bytes([0xC0 | (reg_field & 7) << 3 | rm.number & 7])
+    base = rm.base.number
+    if rm.base.size != 64:
+        raise AssemblyError("memory operands need a 64-bit base register")
+    if rm.displacement == 0 and base & 7 != 5:
+        mod, disp = 0, b''
+    elif _fits_int8(rm.displacement):
+        mod, disp = 1, rm.displacement.to_bytes(1, 'little', signed=True)
+    else:
+        mod, disp = 2, _int32(rm.displacement, "displacement out of range")
+    encoded = bytes([mod << 6 | (reg_field & 7) << 3 | base & 7])
+    if base & 7 == 4:
+        encoded += b'\x24'  # SIB: no index, base = rsp/r12
+    return rex_r, (base >> 3) & 1, encoded + disp
+
+
+def _emit_modrm_insn(
+    unit: Unit,
+    opcode: bytes,
+    reg_field: int,
+    rm: Register | Memory,
+    size: int,
+    force_rex: bool = False,
+) -> None:
+    rex_r, rex_b, modrm = _modrm(reg_field, rm)
+    rex = 0x40 | (8 if size == 64 else 0) | rex_r << 2 | rex_b
+    # spl, bpl, sil and dil are only addressable with a REX prefix
+    needs_byte_rex = isinstance(rm, Register) and rm.size == 8 and 4 <= rm.number < 8
+    if rex != 0x40 or force_rex or needs_byte_rex:
+        unit.code.append(rex)
+    unit.code += opcode + modrm
+
+
+def _emit_immediate(unit: Unit, operand: Immediate, kind: str) -> None:
+    constant = _constant(operand)
+    if constant is not None and kind == 'abs32s':
+        unit.code += _int32(constant, "immediate out of range")
+        return
+    if constant is not None:
+        unit.code += (constant & (2**64 - 1)).to_bytes(8, 'little')
+        return
+    unit.fixups.append(Fixup(len(unit.code), kind, operand.expr))
+    unit.code += bytes(8 if kind == 'abs64' else 4)
+
+
+def _operand_size(mnemonic: str, operands: list[Operand]) -> tuple[str, int]:
+    """Splits a size suffix off the mnemonic, or infers the size from registers."""
+    for suffix, size in (('q', 64), ('b', 8)):
+        if mnemonic.endswith(suffix) and mnemonic[:-1] in SIZED_MNEMONICS:
+            return mnemonic[:-1], size
+    for operand in operands:
+        if isinstance(operand, Register):
+            return mnemonic, operand.size
+    return mnemonic, 64
+
+
+def _instruction(unit: Unit, mnemonic: str, operands: list[Operand]) -> None:
+    code = unit.code
+    if mnemonic in ('syscall', 'ret', 'retq', 'cqto', 'cqo') and not operands:
+        code += {'syscall': b'\x0f\x05', 'ret': b'\xc3', 'retq': b'\xc3'}.get(mnemonic, b'\x48\x99')
+        return
+
+    if mnemonic in ('jmp', 'jmpq', 'call', 'callq'):
+        (target,) = operands
+        if isinstance(target, Target):
+            code.append(0xE9 if mnemonic.startswith('jmp') else 0xE8)
+            unit.fixups.append(Fixup(len(code), 'rel32', (0, ((1, target.name),))))
+            code += bytes(4)
+        elif isinstance(target, Indirect):
+            _emit_modrm_insn(unit, b'\xff', 4 if mnemonic.startswith('jmp') else 2, target.register, 32)
+        else:
+            raise AssemblyError("unsupported jump target")
+        return
+
+    if mnemonic.startswith('j') and mnemonic[1:] in CONDITION_CODES:
+        (target,) = operands
+        if not isinstance(target, Target):
+            raise AssemblyError("conditional jumps need a label")
+        code += bytes([0x0F, 0x80 | CONDITION_CODES[mnemonic[1:]]])
+        unit.fixups.append(Fixup(len(code), 'rel32', (0, ((1, target.name),))))
+        code += bytes(4)
+        return
+
+    if mnemonic.startswith('set') and mnemonic[3:] in CONDITION_CODES:
+        (dest,) = operands
+        if not isinstance(dest, (Register, Memory)) or isinstance(dest, Register) and dest.size != 8:
+            raise AssemblyError("setcc needs an 8-bit destination")
+        _emit_modrm_insn(unit, bytes([0x0F, 0x90 | CONDITION_CODES[mnemonic[3:]]]), 0, dest, 8)
+        return
+
+    base, size = _operand_size(mnemonic, operands)
+    for operand in operands:
+        if isinstance(operand, Register) and operand.size != size:
+            raise AssemblyError("operand size mismatch")
+
+    if base == 'mov' and size == 64:
+        src, dest = operands
+        if isinstance(src, Register) and isinstance(dest, (Register, Memory)):
+            _emit_modrm_insn(unit, b'\x89', src.number, dest, 64)
+        elif isinstance(src, Memory) and isinstance(dest, Register):
+            _emit_modrm_insn(unit, b'\x8b', dest.number, src, 64)
+        elif isinstance(src, Immediate) and isinstance(dest, (Register, Memory)):
+            constant = _constant(src)
+            if constant is not None and not -2**31 <= constant < 2**31:
+                if not isinstance(dest, Register):
+                    raise AssemblyError("64-bit immediates can only be moved to registers")
+                _instruction(unit, 'movabsq', operands)
+                return
+            _emit_modrm_insn(unit, b'\xc7', 0, dest, 64)
+            _emit_immediate(unit, src, 'abs32s')
+        else:
+            raise AssemblyError("unsupported operands for mov")
+    elif base == 'mov' and size == 8:
+        src, dest = operands
+        if isinstance(src, Register) and isinstance(dest, (Register, Memory)):
+            _emit_modrm_insn(unit, b'\x88', src.number, dest, 8, force_rex=4 <= src.number < 8)
+        elif isinstance(src, Memory) and isinstance(dest, Register):
+            _emit_modrm_insn(unit, b'\x8a', dest.number, src, 8, force_rex=4 <= dest.number < 8)
+        elif isinstance(src, Immediate) and isinstance(dest, (Register, Memory)):
+            constant = _constant(src)
+            if constant is None or not -128 <= constant < 256:
+                raise AssemblyError("8-bit immediate out of range")
+            _emit_modrm_insn(unit, b'\xc6', 0, dest, 8)
+            code.append(constant & 0xFF)
+        else:
+            raise AssemblyError("unsupported operands for movb")
+    elif base == 'movabs':
+        src, dest = operands
+        if not isinstance(src, Immediate) or not isinstance(dest, Register) or dest.size != 64:
+            raise AssemblyError("movabs needs an immediate and a 64-bit register")
+        code += bytes([0x48 | dest.number >> 3, 0xB8 | dest.number & 7])
+        _emit_immediate(unit, src, 'abs64')
+    elif base in ALU_OPERATIONS and size == 64:
+        to_rm, from_rm, digit = ALU_OPERATIONS[base]
+        src, dest = operands
+        if isinstance(src, Register) and isinstance(dest, (Register, Memory)):
+            _emit_modrm_insn(unit, bytes([to_rm]), src.number, dest, 64)
+        elif isinstance(src, Memory) and isinstance(dest, Register):
+            _emit_modrm_insn(unit, bytes([from_rm]), dest.number, src, 64)
+        elif isinstance(src, Immediate) and isinstance(dest, (Register, Memory)):
+            constant = _constant(src)
+            if constant is not None and _fits_int8(constant):
+                _emit_modrm_insn(unit, b'\x83', digit, dest, 64)
+                code.append(constant & 0xFF)
+            else:
+                _emit_modrm_insn(unit, b'\x81', digit, dest, 64)
+                _emit_immediate(unit, src, 'abs32s')
+        else:
+            raise AssemblyError(f"unsupported operands for {base}")
+    elif base in UNARY_OPERATIONS and size == 64:
+        (operand,) = operands
+        if not isinstance(operand, (Register, Memory)):
+            raise AssemblyError(f"unsupported operand for {base}")
+        opcode, digit = UNARY_OPERATIONS[base]
+        _emit_modrm_insn(unit, bytes([opcode]), digit, operand, 64)
+    elif base == 'imul' and size == 64:
+        if len(operands) != 2:
+            raise AssemblyError("only two-operand imul is supported")
+        src, dest = operands
+        if not isinstance(dest, Register):
+            raise AssemblyError("imul needs a register destination")
+        if isinstance(src, (Register, Memory)):
+            _emit_modrm_insn(unit, b'\x0f\xaf', dest.number, src, 64)
+        elif isinstance(src, Immediate):
+            constant = _constant(src)
+            if constant is not None and _fits_int8(constant):
+                _emit_modrm_insn(unit, b'\x6b', dest.number, dest, 64)
+                code.append(constant & 0xFF)
+            else:
+                _emit_modrm_insn(unit, b'\x69', dest.number, dest, 64)
+                _emit_immediate(unit, src, 'abs32s')
+        else:
+            raise AssemblyError("unsupported operands for imul")
+    elif base in ('push', 'pop') and size == 64:
+        (operand,) = operands
+        if isinstance(operand, Register):
+            if operand.number >= 8:
+                code.append(0x41)
+            code.append((0x50 if base == 'push' else 0x58) | operand.number & 7)
+        elif base == 'push' and isinstance(operand, Immediate):
+            constant = _constant(operand)
+            if constant is not None and _fits_int8(constant):
+                code += bytes([0x6A, constant & 0xFF])
+            else:
+                code.append(0x68)
+                _emit_immediate(unit, operand, 'abs32s')
+        else:
+            raise AssemblyError(f"unsupported operand for {base}")
+    else:
+        raise AssemblyError(f"unsupported instruction '{mnemonic}'")
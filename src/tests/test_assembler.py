@@ -0,0 +1,111 @@
+import os
+import shutil
+import subprocess
+import tempfile
+
+import pytest
+
+from compiler.assembler import assemble, assemble_and_get_executable, StdlibObjectCache, BACKENDS
+from compiler.assembly_generator import generate_assembly
+from compiler.ir_generator import generate_ir, ROOT_TYPES
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.type_checker import annotate_types, build_typechecker_root_symtab
+
+pytestmark = pytest.mark.skipif(
+    shutil.which("as") is None or shutil.which("ld") is None,
+    reason="requires binutils"
+)
+
+
+def compile_to_assembly(source_code: str) -> str:
+    tree = parse(tokenize(source_code))
+    annotate_types(tree, build_typechecker_root_symtab())
+    return generate_assembly(generate_ir(ROOT_TYPES, tree)) + "\n"
+
+
+def run_executable(executable: bytes, stdin: str = "") -> str:
+    with tempfile.TemporaryDirectory() as wd:
+        path = os.path.join(wd, "a.out")
+        with open(path, "wb") as f:
+            f.write(executable)
+        os.chmod(path, 0o755)
+        return subprocess.run(
+            [path], input=stdin.encode(), capture_output=True, check=True).stdout.decode()
+
+
+def test_stdlib_cache_assembles_each_variant_once() -> None:
+    cache = StdlibObjectCache()
+    plain = cache.get(link_with_c=False)
+    assert cache.get(link_with_c=False) == plain
+    assert cache.get(link_with_c=True) != plain
+
+
+def test_stdlib_cache_reuses_objects_from_cache_dir() -> None:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        first = StdlibObjectCache(cache_dir).get(link_with_c=False)
+        mtime = os.stat(first).st_mtime_ns
+        second = StdlibObjectCache(cache_dir).get(link_with_c=False)
+        assert first == second
+        assert os.stat(second).st_mtime_ns == mtime
+
+
+def test_executables_linked_with_cached_stdlib_run() -> None:
+    cache = StdlibObjectCache()
+    for source_code, expected in [("1 + 2 * 3", "7\n"), ("not false", "true\n")]:
+        executable = assemble_and_get_executable(
+            compile_to_assembly(source_code), stdlib_cache=cache, backend="toolchain")
+        assert run_executable(executable) == expected
+
+
+def test_builtin_and_toolchain_backends_behave_identically() -> None:
+    programs = [
+        ("1 + 2 * 3", ""),
+        ("-7 / 2 + -7 % 2", ""),
+        ("print_int(-1234567890123); 9223372036854775807", ""),
+        ("var a = read_int(); var b = read_int(); print_bool(a < b); a * b", "-12\n5\n"),
+        ("""
+        var n: Int = 27;
+        var steps = 0;
+        while n > 1 do {
+            if n % 2 == 0 then { n = n / 2; } else { n = 3 * n + 1; }
+            steps = steps + 1;
+        }
+        print_int(steps);
+        not (n == 1 or steps < 0) and true
+        """, ""),
+    ]
+    for source_code, stdin in programs:
+        assembly = compile_to_assembly(source_code)
+        outputs = {
+            backend: run_executable(assemble_and_get_executable(assembly, backend=backend), stdin)
+            for backend in BACKENDS
+        }
+        assert outputs["builtin"] == outputs["toolchain"]
+        assert outputs["builtin"] != ""
+
+
+def test_builtin_backend_writes_runnable_executable_without_toolchain() -> None:
+    executable = assemble_and_get_executable(compile_to_assembly("print_int(42)"), backend="builtin")
+    assert executable.startswith(b"\x7fELF")
+    assert run_executable(executable) == "42\n"
+
+
+def test_builtin_backend_falls_back_to_toolchain_on_unsupported_input() -> None:
+    assembly = compile_to_assembly("print_int(42)") + """
+    unused:
+        movq unused(%rip), %rax
+        ret
+    """
+    executable = assemble_and_get_executable(assembly, backend="builtin")
+    assert run_executable(executable) == "42\n"
+
+
+def test_toolchain_writes_output_file_with_and_without_workdir() -> None:
+    assembly = compile_to_assembly("print_int(5)")
+    with tempfile.TemporaryDirectory() as wd:
+        for workdir in [None, wd]:
+            output_file = os.path.join(wd, "program")
+            assemble(assembly, output_file, workdir=workdir, backend="toolchain")
+            result = subprocess.run([output_file], capture_output=True, check=True)
+            assert result.stdout == b"5\n"
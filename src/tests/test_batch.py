@@ -0,0 +1,62 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+from compiler.batch import compile_batch, find_sources, output_paths
+
+
+def write_files(directory: str, files: dict[str, str]) -> None:
+    for name, content in files.items():
+        path = os.path.join(directory, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+
+def test_find_sources_expands_directories_and_globs() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        write_files(directory, {"a.src": "1", "sub/b.src": "2", "sub/notes.txt": "", "c.txt": "3"})
+        assert find_sources([directory]) == [
+            os.path.join(directory, "a.src"), os.path.join(directory, "sub", "b.src")]
+        assert find_sources([os.path.join(directory, "*.txt")]) == [os.path.join(directory, "c.txt")]
+        # Explicitly named files are compiled whatever their extension, and only once
+        assert find_sources([os.path.join(directory, "c.txt"), os.path.join(directory, "*.txt")]) == [
+            os.path.join(directory, "c.txt")]
+
+
+def test_output_paths_keep_the_directory_structure() -> None:
+    assert output_paths(["/p/a.src", "/p/sub/a.src"], "out") == ["out/a", "out/sub/a"]
+    assert output_paths(["/p/a.src"], "out") == ["out/a"]
+
+
+def test_compile_batch_continues_past_errors() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        write_files(directory, {"good1.src": "print_int(1)", "bad.src": "1 +", "good2.src": "print_int(2)"})
+        sources = [os.path.join(directory, name) for name in ("good1.src", "bad.src", "good2.src")]
+        output_dir = os.path.join(directory, "out")
+        for jobs in (1, 2):
+            results = list(compile_batch(sources, output_dir, jobs))
+            assert [result.source for result in results] == sources
+            assert [result.error is None for result in results] == [True, False, True]
+            assert "Failed to compile" in str(results[1].error)
+            for name in ("good1", "good2"):
+                with open(os.path.join(output_dir, name), "rb") as f:
+                    assert f.read(4) == b"\x7fELF"
+            assert not os.path.exists(os.path.join(output_dir, "bad"))
+
+
+def test_compile_batch_command_reports_every_file() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        write_files(directory, {"src/a.src": "print_int(1)", "src/b.src": "1 +"})
+        src_dir = os.path.dirname(os.path.dirname(__file__))
+        result = subprocess.run(
+            [sys.executable, "-m", "compiler", "compile-batch", os.path.join(directory, "src"),
+             f"--output-dir={directory}/out", "--jobs=2"],
+            capture_output=True, text=True, env={**os.environ, "PYTHONPATH": src_dir})
+        assert result.returncode == 1
+        lines = result.stdout.splitlines()
+        assert lines[0].startswith(f"ok      {directory}/src/a.src")
+        assert lines[1].startswith(f"FAILED  {directory}/src/b.src")
+        assert lines[2].startswith("1 compiled, 1 failed")
+        assert os.path.exists(os.path.join(directory, "out", "a"))
@@ -0,0 +1,15 @@
+from compiler.pipeline import call_compiler, compile_with_stats
+
+
+def test_code_stats_describe_the_generated_code() -> None:
+    source_code = "var x = 1; var y = x; while y < 3 do { y = y + 1 }; print_int(y)"
+    executable, stats = compile_with_stats(source_code, "(test)")
+    assert executable == call_compiler(source_code, "(test)")
+    assert stats["executable_bytes"] == len(executable)
+    mix = stats["ir_instruction_mix"]
+    assert stats["ir_instructions"] == sum(mix.values())
+    assert (stats["copies"], stats["jumps"], stats["cond_jumps"]) == (mix["Copy"], mix["Jump"], mix["CondJump"])
+    assert stats["cond_jumps"] == 1
+    assert stats["memory_to_memory_moves"] == stats["copies"]
+    assert stats["stack_bytes"] > 0 and stats["stack_bytes"] % 8 == 0
+    assert stats["assembly_lines"] > stats["assembly_instructions"] > stats["ir_instructions"]
@@ -0,0 +1,9 @@
+import pytest
+
+from benchmarks.complexity import growth_exponent
+
+
+def test_growth_exponent_of_power_laws() -> None:
+    sizes = [100, 200, 400, 800]
+    assert growth_exponent(sizes, [3e-6 * n for n in sizes]) == pytest.approx(1.0)
+    assert growth_exponent(sizes, [1e-8 * n * n for n in sizes]) == pytest.approx(2.0)
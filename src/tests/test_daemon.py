@@ -0,0 +1,117 @@
+import os
+import signal
+import socket
+import stat
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Iterator
+
+import pytest
+
+import compiler.daemon
+from compiler.daemon import send_to_daemon
+
+SRC_DIR = os.path.dirname(os.path.dirname(__file__))
+
+
+def run_compiler(*args: str, input: str = "") -> subprocess.CompletedProcess[str]:
+    return subprocess.run(
+        [sys.executable, "-m", "compiler", *args], input=input, capture_output=True, text=True,
+        env={**os.environ, "PYTHONPATH": SRC_DIR})
+
+
+@pytest.fixture
+def daemon_socket() -> Iterator[str]:
+    with tempfile.TemporaryDirectory() as directory:
+        socket_path = os.path.join(directory, "compiler.sock")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "compiler", "daemon", f"--socket={socket_path}"],
+            stdout=subprocess.DEVNULL,
+            env={**os.environ, "PYTHONPATH": SRC_DIR},
+        )
+        deadline = time.monotonic() + 10
+        while send_to_daemon(socket_path, {"command": "ping"}) is None:
+            assert time.monotonic() < deadline, "daemon did not start"
+            time.sleep(0.05)
+        yield socket_path
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) == 0
+        assert not os.path.exists(socket_path)
+
+
+def test_daemon_compiles_files_for_the_cli(daemon_socket: str) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "program.src")
+        with open(source, "w") as f:
+            f.write("print_int(1 + 2)")
+        script = (
+            "import sys\n"
+            "from compiler.__main__ import main\n"
+            f"sys.argv = ['compiler', 'compile', 'program.src', '--output=a.out', '--socket={daemon_socket}']\n"
+            "assert main() == 0\n"
+            "print(' '.join(sys.modules))\n"
+        )
+        # Relative paths are resolved by the client, not the daemon
+        output = subprocess.run(
+            [sys.executable, "-c", script], check=True, capture_output=True, text=True, cwd=directory,
+            env={**os.environ, "PYTHONPATH": SRC_DIR}).stdout
+        with open(os.path.join(directory, "a.out"), "rb") as f:
+            assert f.read(4) == b"\x7fELF"
+    assert "compiler.pipeline" not in output.split()
+
+
+def test_daemon_compiles_source_code_from_stdin(daemon_socket: str) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, "a.out")
+        result = run_compiler("compile", f"--output={output_file}", f"--socket={daemon_socket}", input="1 + 2")
+        assert result.returncode == 0
+        with open(output_file, "rb") as f:
+            assert f.read(4) == b"\x7fELF"
+
+
+def test_daemon_reports_compile_errors(daemon_socket: str) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        output_file = os.path.join(directory, "a.out")
+        result = run_compiler("compile", f"--output={output_file}", f"--socket={daemon_socket}", input="1 +")
+        assert result.returncode != 0
+        assert "Failed to compile" in result.stderr
+        assert not os.path.exists(output_file)
+
+
+def test_daemon_socket_is_private(daemon_socket: str) -> None:
+    assert stat.S_IMODE(os.stat(daemon_socket).st_mode) & 0o077 == 0
+
+
+def test_second_daemon_refuses_to_take_over_the_socket(daemon_socket: str) -> None:
+    result = run_compiler("daemon", f"--socket={daemon_socket}")
+    assert result.returncode != 0
+    assert "already running" in result.stderr
+    assert send_to_daemon(daemon_socket, {"command": "ping"}) is not None
+
+
+def test_compile_falls_back_to_compiling_itself_without_a_daemon() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        # A socket file left behind by a daemon that was killed
+        socket_path = os.path.join(directory, "compiler.sock")
+        with open(socket_path, "w"):
+            pass
+        output_file = os.path.join(directory, "a.out")
+        result = run_compiler("compile", f"--output={output_file}", f"--socket={socket_path}", input="1 + 2")
+        assert result.returncode == 0
+        with open(output_file, "rb") as f:
+            assert f.read(4) == b"\x7fELF"
+
+
+def test_client_sends_nothing_to_another_users_daemon(monkeypatch: pytest.MonkeyPatch) -> None:
+    with tempfile.TemporaryDirectory() as directory, socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as listener:
+        socket_path = os.path.join(directory, "compiler.sock")
+        listener.bind(socket_path)
+        listener.listen()
+        monkeypatch.setattr(compiler.daemon.os, "getuid", lambda: os.geteuid() + 1)
+        with pytest.raises(PermissionError):
+            send_to_daemon(socket_path, {"command": "compile", "code": "secret"})
+        connection, _ = listener.accept()
+        with connection:
+            assert connection.recv(1024) == b""
@@ -0,0 +1,67 @@
+import os
+import tempfile
+from pathlib import Path
+
+import pytest
+
+from compiler.executable_cache import ExecutableCache
+
+
+def test_key_depends_on_source_and_options() -> None:
+    key = ExecutableCache.key("1 + 2", {"backend": "builtin"})
+    assert key == ExecutableCache.key("1 + 2", {"backend": "builtin"})
+    assert key != ExecutableCache.key("1 + 3", {"backend": "builtin"})
+    assert key != ExecutableCache.key("1 + 2", {"backend": "toolchain"})
+
+
+def test_memory_tier_evicts_least_recently_used() -> None:
+    cache = ExecutableCache(max_entries=2)
+    cache.put("a", b"A")
+    cache.put("b", b"B")
+    assert cache.get("a") == b"A"
+    cache.put("c", b"C")
+    assert cache.stats()["memory_evictions"] == 1
+    assert cache.stats()["memory_entries"] == 2
+    # 'b' was evicted from memory but is still found in the shared directory
+    assert cache.get("b") == b"B"
+    stats = cache.stats()
+    assert (stats["memory_hits"], stats["disk_hits"], stats["misses"]) == (1, 1, 0)
+    assert cache.get("missing") is None
+    assert cache.stats()["misses"] == 1
+
+
+def test_directory_tier_survives_restart_and_respects_size_cap() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        cache = ExecutableCache(directory=directory, max_disk_bytes=250)
+        for i in range(5):
+            cache.put(f"key{i}", bytes(100))
+            os.utime(os.path.join(directory, f"key{i}.exe"), (i, i))
+        stats = cache.stats()
+        assert stats["disk_bytes"] <= 250
+        assert stats["disk_evictions"] >= 3
+
+        restarted = ExecutableCache(directory=directory)
+        assert restarted.get("key4") == bytes(100)
+        assert restarted.get("key0") is None
+        assert restarted.stats()["disk_bytes"] == stats["disk_bytes"]
+
+
+def test_counters_are_shared_with_forked_workers() -> None:
+    cache = ExecutableCache()
+    cache.put("a", b"A")
+    pid = os.fork()
+    if pid == 0:
+        cache.get("a")
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert cache.stats()["memory_hits"] == 1
+
+
+def test_concurrent_puts_of_same_entry_count_its_size_once(monkeypatch: pytest.MonkeyPatch) -> None:
+    cache = ExecutableCache()
+    # As if another worker wrote the entry between our check and our write
+    monkeypatch.setattr(Path, "exists", lambda self: False)
+    cache.put("a", b"12345")
+    cache.put("a", b"12345")
+    assert cache.stats()["disk_bytes"] == 5
+    assert sorted(os.listdir(cache.directory)) == ["a.exe"]
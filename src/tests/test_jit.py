@@ -0,0 +1,67 @@
+import signal
+import time
+
+from compiler.ir_generator import generate_ir, ROOT_TYPES
+from compiler.jit import run, run_in_child, READ_INT_ERROR
+from compiler.parser import parse
+from compiler.tokenizer import tokenize
+from compiler.type_checker import annotate_types, build_typechecker_root_symtab
+from compiler import ir
+
+
+def generate(source_code: str) -> list[ir.Instruction]:
+    tree = parse(tokenize(source_code))
+    annotate_types(tree, build_typechecker_root_symtab())
+    return generate_ir(ROOT_TYPES, tree)
+
+
+def test_jit_prints_result_of_expression() -> None:
+    result = run(generate("1 + 2 * 3"))
+    assert result.stdout == "7\n"
+    assert result.exit_code == 0
+
+
+def test_jit_runs_loops_and_builtins() -> None:
+    result = run(generate("""
+        var n: Int = read_int();
+        while n > 1 do {
+            if n % 2 == 0 then { n = n / 2; } else { n = 3 * n + 1; }
+            print_int(n);
+        }
+        print_bool(n == 1);
+        -7 / 2
+    """), "6\n")
+    assert result.stdout == "3\n10\n5\n16\n8\n4\n2\n1\ntrue\n-3\n"
+
+
+def test_jit_read_int_skips_junk_like_stdlib() -> None:
+    assert run(generate("read_int()"), "x-1a2\n").stdout == "-12\n"
+
+
+def test_jit_stops_program_when_input_runs_out() -> None:
+    result = run(generate("print_int(1); read_int(); print_int(2)"), "")
+    assert result.stdout == "1\n"
+    assert result.stderr == READ_INT_ERROR
+    assert result.exit_code == 1
+
+
+def test_jit_in_child_survives_crashing_program() -> None:
+    result = run_in_child(generate("print_int(1); var x = 0; 1 / x"))
+    assert result.stdout == "1\n"
+    assert result.exit_code == -signal.SIGFPE
+    assert "SIGFPE" in result.stderr
+
+
+def test_jit_in_child_reports_output_and_read_int_failure() -> None:
+    assert run_in_child(generate("print_int(read_int() * 2)"), "21\n").stdout == "42\n"
+    result = run_in_child(generate("print_int(1); read_int()"), "")
+    assert (result.stdout, result.stderr, result.exit_code) == ("1\n", READ_INT_ERROR, 1)
+
+
+def test_jit_in_child_kills_program_that_runs_too_long() -> None:
+    start = time.monotonic()
+    result = run_in_child(generate("print_int(1); while true do { }"), timeout=0.5)
+    assert time.monotonic() - start < 5
+    assert result.stdout == "1\n"
+    assert result.stderr == "Program timed out after 0.5s\n"
+    assert result.exit_code == -signal.SIGKILL
@@ -0,0 +1,60 @@
+import os
+import subprocess
+import sys
+import tempfile
+
+import pytest
+
+import compiler.tokenizer
+from compiler.__main__ import main
+from compiler.tokenizer import TokenStream
+
+SERVER_AND_TOOLING_MODULES = [
+    "asyncio", "multiprocessing", "socketserver", "concurrent.futures", "json", "base64",
+    "cProfile", "tracemalloc", "ctypes", "subprocess", "tempfile", "compiler.server",
+]
+
+
+def test_compile_command_imports_only_what_it_needs() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "program.src")
+        with open(source, "w") as f:
+            f.write("print_int(1 + 2)")
+        script = (
+            "import sys\n"
+            "from compiler.__main__ import main\n"
+            f"sys.argv = ['compiler', 'compile', {source!r}, '--output={directory}/a.out']\n"
+            "assert main() == 0\n"
+            "print(' '.join(sys.modules))\n"
+        )
+        src_dir = os.path.dirname(os.path.dirname(__file__))
+        output = subprocess.run(
+            [sys.executable, "-c", script], check=True, capture_output=True, text=True,
+            env={**os.environ, "PYTHONPATH": src_dir}).stdout
+        with open(os.path.join(directory, "a.out"), "rb") as f:
+            assert f.read(4) == b"\x7fELF"
+    modules = set(output.split())
+    assert "compiler.pipeline" in modules
+    assert [module for module in SERVER_AND_TOOLING_MODULES if module in modules] == []
+
+
+def test_compile_command_tokenizes_big_files_in_parallel(monkeypatch: pytest.MonkeyPatch) -> None:
+    job_counts = []
+    tokenize_parallel = compiler.tokenizer._tokenize_parallel
+
+    def spy(source_code: str, jobs: int) -> TokenStream:
+        job_counts.append(jobs)
+        return tokenize_parallel(source_code, jobs)
+
+    monkeypatch.setattr(compiler.tokenizer, "_tokenize_parallel", spy)
+    monkeypatch.setattr(compiler.tokenizer.os, "cpu_count", lambda: 2)
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, "program.src")
+        with open(source, "w") as f:
+            f.write("print_int(1 + 2);\nprint_int(3)\n")
+        monkeypatch.setattr(compiler.tokenizer, "PARALLEL_THRESHOLD", os.path.getsize(source))
+        monkeypatch.setattr(sys, "argv", ["compiler", "compile", source, f"--output={directory}/a.out", "--no-daemon"])
+        assert main() == 0
+        with open(os.path.join(directory, "a.out"), "rb") as executable:
+            assert executable.read(4) == b"\x7fELF"
+    assert job_counts == [2]
@@ -0,0 +1,61 @@
+import json
+import os
+import tempfile
+
+import pytest
+
+from compiler.instrument import stage
+from compiler.metrics import Metrics, collect_stages
+from compiler.pipeline import call_compiler
+
+
+def test_percentiles_are_within_a_bucket() -> None:
+    metrics = Metrics()
+    for i in range(1, 1001):
+        metrics.record("request_bytes", i)
+    summary = metrics.snapshot()["request_bytes"]
+    assert summary["count"] == 1000
+    assert summary["mean"] == pytest.approx(500.5)
+    assert summary["max"] == 1000
+    for p in (50, 90, 99):
+        assert summary[f"p{p}"] == pytest.approx(p * 10, rel=0.3)
+
+
+def test_durations_are_reported_in_seconds_and_empty_histograms_left_out() -> None:
+    metrics = Metrics()
+    metrics.record("request", 0.25)
+    metrics.record("no such histogram", 1)
+    snapshot = metrics.snapshot()
+    assert list(snapshot) == ["request"]
+    assert snapshot["request"]["max"] == pytest.approx(0.25)
+
+
+def test_collects_compile_stages() -> None:
+    with collect_stages() as stages:
+        call_compiler("print_int(1 + 2)", "(test)", "builtin")
+    names = [name for name, _ in stages]
+    for name in ("tokenize", "parse", "annotate_types", "generate_ir", "generate_assembly", "encode", "assemble"):
+        assert name in names
+    with stage("parse"):
+        pass
+    assert len(stages) == len(names)
+
+
+def test_dump_writes_the_snapshot() -> None:
+    metrics = Metrics()
+    with stage("unobserved"):
+        pass
+    with metrics.observe("parse"):
+        pass
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "stats.json")
+        metrics.dump(path)
+        with open(path) as f:
+            assert json.load(f)["parse"]["count"] == 1
+
+
+def test_collects_the_tokenize_stage_of_chunked_source() -> None:
+    with collect_stages() as stages:
+        call_compiler(["print_int(1 ", "+ 2);\n", "print_int(3)\n"], "(test)", "builtin")
+    names = [name for name, _ in stages]
+    assert names.count("tokenize") == 1 and "parse" in names
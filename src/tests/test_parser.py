@@ -1,6 +1,10 @@
+import weakref
+from typing import Iterator
+
 import compiler.ast as ast
+from benchmarks.synthetic import generate
 from compiler.parser import parse, ParsingException, EmptyListException
-from compiler.tokenizer import tokenize, Location
+from compiler.tokenizer import Token, iter_tokens, tokenize, tokenize_stream, Location
 
 
 def test_parse_plus_expression() -> None:
@@ -1218,3 +1222,41 @@ def test_parse_invalid_block_statements_2() -> None:
             e) == "L(line=1, column=24): incorrect expression: identifier should be followed by a binary operator or a statement."
     else:
         assert False, "Expected ParsingException was not raised"
+
+
+def test_parse_streamed_tokens_keeps_only_a_few_alive() -> None:
+    source_code = generate("while", 500)
+    alive: weakref.WeakSet[Token] = weakref.WeakSet()
+    most_alive = 0
+
+    def stream() -> Iterator[Token]:
+        nonlocal most_alive
+        for token in iter_tokens(line + "\n" for line in source_code.splitlines()):
+            alive.add(token)
+            most_alive = max(most_alive, len(alive))
+            yield token
+
+    assert repr(parse(stream())) == repr(parse(tokenize(source_code)))
+    assert most_alive <= 10
+
+
+def test_parse_empty_stream() -> None:
+    try:
+        parse(iter_tokens(["", "// only a comment"]))
+    except EmptyListException as e:
+        assert str(e) == "token list must not be empty."
+    else:
+        assert False, "Expected EmptyListException was not raised"
+
+
+def test_parse_token_stream() -> None:
+    source_code = generate("nested", 16) + generate("while", 50)
+    assert repr(parse(tokenize_stream(source_code))) == repr(parse(tokenize(source_code)))
+
+
+def test_parse_shares_interned_identifier_names() -> None:
+    tree = parse(tokenize_stream("total = total + 1"))
+    assert isinstance(tree, ast.BinaryOp)
+    assert isinstance(tree.left, ast.Identifier) and isinstance(tree.right, ast.BinaryOp)
+    assert isinstance(tree.right.left, ast.Identifier)
+    assert tree.left.name is tree.right.left.name
@@ -0,0 +1,63 @@
+import io
+import os
+import pstats
+import tempfile
+import tracemalloc
+
+from compiler.instrument import add_observer, remove_observer, stage
+from compiler.pipeline import call_compiler
+from compiler.profiling import PassTimer, profile, time_passes
+
+
+def test_time_passes_reports_every_stage() -> None:
+    output = io.StringIO()
+    with time_passes(True, output):
+        call_compiler("print_int(1 + 2)", "(test)", "builtin")
+    lines = output.getvalue().splitlines()
+    assert lines[0].split()[0] == "Stage"
+    names = [line.split()[0] for line in lines[1:]]
+    assert names == [
+        "compile", "tokenize", "parse", "annotate_types", "generate_ir", "generate_assembly", "assemble", "encode"]
+    assert not tracemalloc.is_tracing()
+
+
+def test_peak_memory_of_a_stage_includes_its_inner_stages() -> None:
+    timer = PassTimer()
+    add_observer(timer.timed)
+    tracemalloc.start()
+    try:
+        with stage("outer"):
+            with stage("inner"):
+                data = bytearray(1_000_000)
+            del data
+            with stage("small"):
+                pass
+    finally:
+        tracemalloc.stop()
+        remove_observer(timer.timed)
+    outer, inner, small = timer.passes
+    assert (outer.depth, inner.depth, small.depth) == (0, 1, 1)
+    assert inner.peak_bytes >= 1_000_000
+    assert outer.peak_bytes >= 1_000_000
+    assert small.peak_bytes < 100_000
+    assert outer.wall >= inner.wall
+
+
+def test_profile_saves_pstats() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "out.pstats")
+        with profile(path):
+            call_compiler("print_int(1 + 2)", "(test)", "builtin")
+        output = io.StringIO()
+        pstats.Stats(path, stream=output).print_stats("call_compiler")
+    assert "pipeline.py" in output.getvalue()
+
+
+def test_time_passes_reports_tokenizing_of_chunked_source_inside_parse() -> None:
+    output = io.StringIO()
+    with time_passes(True, output):
+        call_compiler(["print_int(1 ", "+ 2);\n", "print_int(3)\n"], "(test)", "builtin")
+    rows = [(len(line) - len(line.lstrip()), line.split()[0]) for line in output.getvalue().splitlines()[1:]]
+    parse_depth, tokenize_depth = (depth for depth, name in rows if name in ("parse", "tokenize"))
+    assert [name for _, name in rows][:3] == ["compile", "parse", "tokenize"]
+    assert tokenize_depth > parse_depth
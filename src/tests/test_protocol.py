@@ -0,0 +1,56 @@
+import io
+from typing import Any
+
+import pytest
+
+from compiler.protocol import (
+    MAGIC, ProtocolError, decode_executable, encode_executables, encode_frame, frame_request, frame_size,
+    read_frame,
+)
+
+
+def test_frames_round_trip_with_binary_values() -> None:
+    frame = encode_frame({"id": 1, "results": [{"program": b"\x7fELF"}, {"error": "x"}], "program": b"\x00"})
+    header, body = read_frame(io.BytesIO(frame), max_bytes=1024) or ({}, b"")
+    assert header == {"id": 1, "results": [{"program": b"\x7fELF"}, {"error": "x"}], "program": b"\x00"}
+    assert body == b"\x7fELF\x00"
+
+
+def test_read_frame_detects_truncated_and_oversized_frames() -> None:
+    frame = encode_frame({"command": "ping"}, b"body")
+    assert read_frame(io.BytesIO(b""), max_bytes=1024) is None
+    with pytest.raises(ProtocolError):
+        read_frame(io.BytesIO(frame[:-1]), max_bytes=1024)
+    with pytest.raises(ProtocolError):
+        read_frame(io.BytesIO(frame), max_bytes=4)
+
+
+def test_frame_size_matches_encoded_frame() -> None:
+    frames: list[tuple[dict[str, Any], bytes]] = [
+        ({"id": 1, "command": "compile", "name": "\u00e9"}, b"print_int(1)"),
+        ({"id": 2, "program": b"\x00" * 9}, b""),
+    ]
+    for header, body in frames:
+        frame = encode_frame(header, body)
+        assert frame_size(*(read_frame(io.BytesIO(frame), max_bytes=1024) or ({}, b""))) == len(frame)
+
+
+def test_frame_body_of_request_is_source_code() -> None:
+    assert frame_request({"id": 3, "command": "compile"}, b"1 + 2") == {"command": "compile", "code": "1 + 2"}
+    assert not MAGIC.startswith(b"{")
+
+
+@pytest.mark.parametrize("compression", ["none", "zlib", "lzma"])
+@pytest.mark.parametrize("encoding", ["base64", "binary"])
+def test_encoded_executables_decode_to_original(encoding: str, compression: str) -> None:
+    executable = b"\x7fELF" + bytes(4096)
+    request = {"encoding": encoding, "compression": compression}
+    result = encode_executables({"program": executable}, request, framed=True)
+    assert decode_executable(result["program"], result.get("compression", "none")) == executable
+    if compression != "none":
+        assert len(result["program"]) < 200
+
+
+def test_binary_encoding_needs_framed_connection() -> None:
+    with pytest.raises(ProtocolError):
+        encode_executables({"program": b""}, {"encoding": "binary"}, framed=False)
@@ -0,0 +1,12 @@
+import pytest
+
+from benchmarks.runtime import program_names, read_program
+from compiler.pipeline import call_jit
+
+
+@pytest.mark.parametrize("name", program_names())
+def test_runtime_programs_print_their_expected_output(name: str) -> None:
+    source_code, expected = read_program(name)
+    result = call_jit(source_code, "")
+    assert (result.stdout, result.exit_code) == (expected, 0)
+
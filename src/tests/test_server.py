@@ -0,0 +1,341 @@
+import base64
+import json
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from socketserver import StreamRequestHandler
+from typing import Iterator
+
+import pytest
+
+from compiler.client import Connection, send_request
+from compiler.executable_cache import ExecutableCache
+from compiler.protocol import MAGIC, decode_executable, read_frame
+import compiler.server as server_module
+from compiler.server import ServerOptions, compile_many
+from compiler.trace import read_trace
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+        return port
+
+
+@contextmanager
+def running_server(*args: str) -> Iterator[tuple[subprocess.Popen[bytes], int]]:
+    """Starts a server, waits until it answers and stops it with SIGTERM."""
+    port = free_port()
+    src_dir = os.path.dirname(os.path.dirname(__file__))
+    process = subprocess.Popen(
+        [sys.executable, "-m", "compiler", "serve", f"--port={port}", *args],
+        stdout=subprocess.DEVNULL,
+        env={**os.environ, "PYTHONPATH": src_dir},
+    )
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                send_request("127.0.0.1", port, {"command": "ping"}, timeout=1)
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "server did not start"
+                time.sleep(0.05)
+        yield process, port
+    finally:
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(timeout=10) == 0
+
+
+@pytest.fixture
+def server_port(request: pytest.FixtureRequest) -> Iterator[int]:
+    with running_server(*getattr(request, "param", [])) as (_, port):
+        yield port
+
+
+def test_server_compiles_programs(server_port: int) -> None:
+    response = send_request("127.0.0.1", server_port, {"command": "compile", "code": "1 + 2"})
+    assert base64.b64decode(response["program"]).startswith(b"\x7fELF")
+
+
+def test_server_reports_errors(server_port: int) -> None:
+    response = send_request("127.0.0.1", server_port, {"command": "compile", "code": "1 +"})
+    assert "Failed to compile" in response["error"]
+    response = send_request("127.0.0.1", server_port, {"command": "nope"})
+    assert response["error"] == "Unknown command: nope"
+
+
+@pytest.mark.parametrize(
+    "server_port", [["--workers=2", "--max-requests-per-worker=2"]], indirect=True)
+def test_prefork_server_recycles_workers(server_port: int) -> None:
+    pids = [send_request("127.0.0.1", server_port, {"command": "stats"}, timeout=10)["pid"] for _ in range(10)]
+    # Two workers serving two requests each must have been replaced at least three times
+    assert len(set(pids)) >= 5
+    assert all(pids.count(pid) <= 2 for pid in pids)
+
+
+@pytest.mark.parametrize("server_port", [["--workers=1", "--max-worker-rss-mb=1"]], indirect=True)
+def test_prefork_server_recycles_workers_over_rss_limit(server_port: int) -> None:
+    pids = [send_request("127.0.0.1", server_port, {"command": "stats"}, timeout=10)["pid"] for _ in range(5)]
+    assert len(set(pids)) == 5
+
+
+def test_prefork_server_gives_up_on_workers_that_keep_crashing(monkeypatch: pytest.MonkeyPatch) -> None:
+    def crash(server: server_module._Server, options: ServerOptions) -> int:
+        raise RuntimeError("broken worker")
+
+    monkeypatch.setattr(server_module, "_worker_main", crash)
+    monkeypatch.setattr(server_module, "_RESPAWN_DELAY", 0.01)
+    monkeypatch.setattr(server_module, "_MAX_CRASHES_PER_MINUTE", 3)
+    crashed_workers = []
+    spawn = os.fork
+
+    def fork() -> int:
+        pid = spawn()
+        crashed_workers.append(pid)
+        return pid
+
+    monkeypatch.setattr(server_module.os, "fork", fork)
+    with server_module._Server(("127.0.0.1", 0), StreamRequestHandler) as server:
+        start = time.monotonic()
+        with pytest.raises(Exception, match="4 workers crashed within a minute"):
+            server_module._run_worker_pool(server, ServerOptions(workers=1))
+    # Respawns back off instead of forking as fast as workers die
+    assert len(crashed_workers) == 4
+    assert time.monotonic() - start >= 0.01 + 0.02 + 0.04
+
+
+@pytest.mark.parametrize("server_port", [["--server=forking"]], indirect=True)
+def test_forking_server_still_works(server_port: int) -> None:
+    assert send_request("127.0.0.1", server_port, {"command": "ping"}) == {}
+
+
+def test_server_reports_crashing_jit_programs(server_port: int) -> None:
+    response = send_request(
+        "127.0.0.1", server_port, {"command": "jit", "code": "print_int(1); 1 / 0"}, timeout=10)
+    assert response["stdout"] == "1\n"
+    assert response["exit_code"] == -signal.SIGFPE
+    response = send_request("127.0.0.1", server_port, {"command": "jit", "code": "print_int(2)"}, timeout=10)
+    assert response == {"stdout": "2\n", "stderr": "", "exit_code": 0}
+
+
+@pytest.mark.parametrize("server_port", [["--async", "--workers=2"]], indirect=True)
+def test_async_server_compiles_and_runs_programs(server_port: int) -> None:
+    request = {"command": "compile", "code": "1 + 2"}
+    response = send_request("127.0.0.1", server_port, request, timeout=10)
+    assert base64.b64decode(response["program"]).startswith(b"\x7fELF")
+    assert send_request("127.0.0.1", server_port, request, timeout=10) == response
+    stats = send_request("127.0.0.1", server_port, {"command": "stats"}, timeout=10)
+    assert stats["cache"]["memory_hits"] == 1
+    request = {"command": "jit", "code": "print_int(read_int())", "input": "7\n"}
+    assert send_request("127.0.0.1", server_port, request, timeout=10)["stdout"] == "7\n"
+    response = send_request("127.0.0.1", server_port, {"command": "compile", "code": "1 +"}, timeout=10)
+    assert "Failed to compile" in response["error"]
+
+
+@pytest.mark.parametrize("server_port", [["--async", "--workers=1"]], indirect=True)
+def test_async_server_reports_crashing_jit_programs(server_port: int) -> None:
+    response = send_request("127.0.0.1", server_port, {"command": "jit", "code": "1 / 0"}, timeout=10)
+    assert response["exit_code"] == -signal.SIGFPE
+    response = send_request("127.0.0.1", server_port, {"command": "jit", "code": "print_int(2)"}, timeout=10)
+    assert response["stdout"] == "2\n"
+
+
+@pytest.mark.parametrize(
+    "server_port", [["--async", "--workers=1", "--queue-depth=0", "--backpressure=reject"]], indirect=True)
+def test_async_server_rejects_requests_beyond_queue_depth(server_port: int) -> None:
+    slow = {"command": "jit", "code": "var i = 0; while i < 3000000 do { i = i + 1; }"}
+    with ThreadPoolExecutor(4) as pool:
+        responses = list(pool.map(lambda _: send_request("127.0.0.1", server_port, slow, timeout=30), range(4)))
+    errors = [r["error"] for r in responses if "error" in r]
+    assert len(errors) >= 1
+    assert all(e.startswith("Server busy") for e in errors)
+    assert any("exit_code" in r for r in responses)
+
+
+@pytest.mark.parametrize(
+    "server_port", [["--async", "--workers=1", "--queue-depth=0", "--backpressure=reject"]], indirect=True)
+def test_async_server_admits_each_program_of_a_batch(server_port: int) -> None:
+    request = {"command": "compile_many", "programs": ["print_int(1)", "print_int(2)", "print_int(3)"]}
+    results = send_request("127.0.0.1", server_port, request, timeout=30)["results"]
+    assert "program" in results[0]
+    assert [result["error"].startswith("Server busy") for result in results[1:]] == [True, True]
+
+
+@pytest.mark.parametrize(
+    "server_port", [["--async", "--max-request-bytes=100", "--read-timeout=0.5"]], indirect=True)
+def test_async_server_limits_request_size_and_read_time(server_port: int) -> None:
+    request = {"command": "compile", "code": "1 + " * 100 + "1"}
+    response = send_request("127.0.0.1", server_port, request, timeout=10)
+    assert response["error"] == "Request larger than 100 bytes"
+    with socket.create_connection(("127.0.0.1", server_port), timeout=10) as sock:
+        sock.sendall(b'{"command": ')  # and never finish the request
+        response = json.loads(sock.makefile("rb").read())
+    assert response["error"] == "Request not received within 0.5s"
+
+
+def child_pids(pid: int) -> list[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+@pytest.mark.skipif(not os.path.exists(f"/proc/{os.getpid()}/task/{os.getpid()}/children"), reason="needs /proc")
+@pytest.mark.parametrize("server_port", [["--async", "--workers=2"]], indirect=True)
+def test_async_server_replaces_dead_workers(server_port: int) -> None:
+    server_pid = send_request("127.0.0.1", server_port, {"command": "stats"}, timeout=10)["pid"]
+    for child in child_pids(server_pid):
+        with open(f"/proc/{child}/cmdline") as f:
+            if "forkserver" in f.read():
+                for worker in child_pids(child):
+                    try:
+                        os.kill(worker, signal.SIGKILL)
+                    except ProcessLookupError:
+                        pass
+    time.sleep(0.2)
+    response = send_request("127.0.0.1", server_port, {"command": "jit", "code": "print_int(5)"}, timeout=10)
+    assert response["stdout"] == "5\n"
+
+
+@pytest.mark.parametrize("server_port", [[], ["--server=forking"], ["--async"]], indirect=True)
+def test_framed_connection_serves_many_requests(server_port: int) -> None:
+    with Connection("127.0.0.1", server_port, timeout=10) as connection:
+        response = connection.request({"command": "compile"}, b"1 + 2")
+        assert base64.b64decode(response["program"]).startswith(b"\x7fELF")
+        request = {"command": "jit", "code": "print_int(read_int() + 1)", "input": "41\n"}
+        assert connection.request(request)["stdout"] == "42\n"
+        assert "Failed to compile" in connection.request({"command": "compile", "code": "1 +"})["error"]
+        ids = [connection.send({"command": "ping"}) for _ in range(5)]
+        assert sorted(connection.receive()[0]["id"] for _ in ids) == ids
+    # The one-shot protocol still works next to it
+    assert send_request("127.0.0.1", server_port, {"command": "ping"}, timeout=10) == {}
+
+
+@pytest.mark.parametrize("server_port", [["--async", "--workers=2"]], indirect=True)
+def test_async_server_answers_pipelined_requests_out_of_order(server_port: int) -> None:
+    with Connection("127.0.0.1", server_port, timeout=30) as connection:
+        slow = connection.send({"command": "jit", "code": "var i = 0; while i < 3000000 do { i = i + 1; }"})
+        fast = connection.send({"command": "ping"})
+        assert connection.receive()[0]["id"] == fast
+        assert connection.receive()[0] == {"id": slow, "stdout": "", "stderr": "", "exit_code": 0}
+
+
+@pytest.mark.parametrize("server_port", [["--async", "--workers=2", "--max-frames-in-flight=1"]], indirect=True)
+def test_async_server_stops_reading_frames_at_the_in_flight_limit(server_port: int) -> None:
+    with Connection("127.0.0.1", server_port, timeout=30) as connection:
+        slow = connection.send({"command": "jit", "code": "var i = 0; while i < 3000000 do { i = i + 1; }"})
+        fast = connection.send({"command": "ping"})
+        # The ping isn't read before the jit request is answered
+        assert connection.receive()[0]["id"] == slow
+        assert connection.receive()[0]["id"] == fast
+
+
+@pytest.mark.parametrize("server_port", [[], ["--async"]], indirect=True)
+def test_framed_connection_rejects_oversized_frames(server_port: int) -> None:
+    with socket.create_connection(("127.0.0.1", server_port), timeout=10) as sock:
+        sock.sendall(MAGIC + struct.pack(">II", 2, 17 * 1024 * 1024) + b"{}")
+        frame = read_frame(sock.makefile("rb"), max_bytes=1024)
+    assert frame is not None
+    assert frame[0] == {"id": None, "error": f"Frame larger than {16 * 1024 * 1024} bytes"}
+
+
+def test_compile_many_reports_errors_per_item() -> None:
+    options = ServerOptions(workers=2, cache=ExecutableCache())
+    sources = ["print_int(1)", "1 +", "print_int(2)", "print_int(1)"]
+    results = compile_many(sources, options)
+    assert "Failed to compile" in results[1]["error"]
+    assert results[0] == results[3]
+    for result in [results[0], results[2]]:
+        assert result["program"].startswith(b"\x7fELF")
+    assert compile_many(sources, options) == results
+    assert options.cache is not None and options.cache.stats()["memory_hits"] == 3
+
+
+@pytest.mark.parametrize("server_port", [["--workers=2"], ["--async", "--workers=2"]], indirect=True)
+def test_server_compiles_batches(server_port: int) -> None:
+    request = {"command": "compile_many", "programs": ["print_int(1)", "1 +", "print_int(2)"]}
+    for _ in range(2):  # The second round comes from the cache
+        results = send_request("127.0.0.1", server_port, request, timeout=30)["results"]
+        assert [sorted(result) for result in results] == [["program"], ["error"], ["program"]]
+    stats = send_request("127.0.0.1", server_port, {"command": "stats"}, timeout=10)
+    assert stats["cache"]["memory_hits"] + stats["cache"]["disk_hits"] >= 2
+
+
+@pytest.mark.parametrize("server_port", [[], ["--async"]], indirect=True)
+def test_server_encodes_executables_as_requested(server_port: int) -> None:
+    request = {"command": "compile", "code": "print_int(1)"}
+    plain = decode_executable(send_request("127.0.0.1", server_port, request, timeout=10)["program"])
+    response = send_request("127.0.0.1", server_port, {**request, "compression": "lzma"}, timeout=10)
+    assert decode_executable(response["program"], response["compression"]) == plain
+    response = send_request("127.0.0.1", server_port, {**request, "encoding": "binary"}, timeout=10)
+    assert response == {"error": "The binary encoding needs a framed connection"}
+    with Connection("127.0.0.1", server_port, timeout=10) as connection:
+        response = connection.request({**request, "encoding": "binary", "compression": "zlib"})
+        assert decode_executable(response["program"], "zlib") == plain
+        response = connection.request(
+            {"command": "compile_many", "programs": ["print_int(1)", "1 +"], "encoding": "binary"})
+        assert response["results"][0]["program"] == plain
+        assert "error" in response["results"][1]
+        assert connection.request({**request, "compression": "gzip"})["error"] == "Unknown compression: gzip"
+
+
+@pytest.mark.parametrize("server_port", [[], ["--async"]], indirect=True)
+def test_server_reports_latency_histograms(server_port: int) -> None:
+    for code in ["1 + 2", "1 + 2", "print_int(3)"]:
+        send_request("127.0.0.1", server_port, {"command": "compile", "code": code}, timeout=10)
+    metrics = send_request("127.0.0.1", server_port, {"command": "stats"}, timeout=10)["metrics"]
+    # The repeated program is a cache hit and isn't compiled again
+    assert metrics["parse"]["count"] == 2
+    assert metrics["encode"]["count"] == 2
+    assert metrics["request"]["count"] >= 3
+    assert metrics["response_bytes"]["max"] > 1000
+    assert 0 < metrics["request"]["p50"] <= metrics["request"]["p99"] <= metrics["request"]["max"]
+
+
+def test_server_dumps_stats_on_sigusr1_and_shutdown() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        stats_file = os.path.join(directory, "stats.json")
+        with running_server(f"--stats-file={stats_file}") as (process, port):
+            send_request("127.0.0.1", port, {"command": "compile", "code": "1"}, timeout=10)
+            process.send_signal(signal.SIGUSR1)
+            deadline = time.monotonic() + 10
+            while not os.path.exists(stats_file):
+                assert time.monotonic() < deadline, "stats were not written"
+                time.sleep(0.05)
+            with open(stats_file) as f:
+                assert json.load(f)["parse"]["count"] == 1
+            send_request("127.0.0.1", port, {"command": "ping"}, timeout=10)
+        with open(stats_file) as f:
+            assert json.load(f)["request"]["count"] >= 2
+
+
+@pytest.mark.parametrize("args", [[], ["--async"]])
+def test_server_processes_write_spans_to_one_trace(args: list[str]) -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        trace_file = os.path.join(directory, "trace.json")
+        with running_server(f"--trace={trace_file}", *args) as (process, port):
+            send_request("127.0.0.1", port, {"command": "compile", "code": "print_int(1)"}, timeout=10)
+        events = read_trace(trace_file)
+    names = {event["name"] for event in events}
+    assert {"read", "write", "compile", "parse", "encode"} <= names
+    compile_pids = {event["pid"] for event in events if event["name"] == "compile"}
+    # Compiled in a worker, not in the process that started the server
+    assert process.pid not in compile_pids
+
+
+@pytest.mark.parametrize("server_port", [[], ["--async"]], indirect=True)
+def test_server_reports_code_stats_on_request(server_port: int) -> None:
+    request = {"command": "compile", "code": "var x = 1; var y = x; print_int(y)"}
+    assert "code_stats" not in send_request("127.0.0.1", server_port, request, timeout=10)
+    # Cached by now, but compiled again to measure the code
+    response = send_request("127.0.0.1", server_port, {**request, "code_stats": True}, timeout=10)
+    stats = response["code_stats"]
+    assert stats["executable_bytes"] == len(base64.b64decode(response["program"]))
+    assert stats["copies"] >= 2
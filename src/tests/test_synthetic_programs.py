@@ -0,0 +1,23 @@
+import pytest
+
+from benchmarks.compile_stages import find_regressions
+from benchmarks.synthetic import SHAPES, generate
+from compiler.pipeline import call_jit
+
+
+@pytest.mark.parametrize("shape", SHAPES)
+@pytest.mark.parametrize("size", [1, 7, 64])
+def test_generated_programs_are_valid_and_reproducible(shape: str, size: int) -> None:
+    source_code = generate(shape, size)
+    assert generate(shape, size) == source_code
+    assert generate(shape, size, seed=1) != source_code or size == 1
+    result = call_jit(source_code, "")
+    assert result.exit_code == 0 and result.stdout
+
+
+def test_regressions_allow_for_noise() -> None:
+    baseline = {"wide/250": {"parse": 0.010, "tokenize": 0.0001}}
+    results = {"wide/250": {"parse": 0.012, "tokenize": 0.0003}, "wide/1000": {"parse": 1.0}}
+    assert find_regressions(baseline, results, 1.25) == []
+    results["wide/250"]["parse"] = 0.02
+    assert find_regressions(baseline, results, 1.25) == ["wide/250 parse: 10.00 ms -> 20.00 ms (2.00x)"]
@@ -1,4 +1,14 @@
-from compiler.tokenizer import tokenize, Token, Location
+import mmap
+import random
+import tempfile
+from typing import Callable
+
+import pytest
+
+from benchmarks.tokenizer_throughput import corpus
+import compiler.tokenizer
+from compiler.tokenizer import TokenStream, IDENTIFIER, INT_LITERAL, KIND_TEXTS, KIND_TYPES, KINDS, iter_tokens, kind_of, read_chunks, tokenize, tokenize_stream, Token, Location
+from tests.tokenizer_reference import regex_tokenize, token_tuples
 
 L = Location(0, 0)
 
@@ -169,3 +179,154 @@ def test_incorrect_source_code_raises_an_error() -> None:
         assert str(e) == "Caught unexpected value: '!' at position (1,3)."
     else:
         assert False, "Expected RuntimeError was not raised"
+
+
+# Fragments that run into the corner cases of the old regex tokenizer
+FRAGMENTS = [
+    "var", "while", "if", "else", "then", "do", "Int", "Bool", "true", "false", "not", "and", "or",
+    "x", "_", "e", "a", "o", "t", "v", "B", "1", "23", " ", "\t", "\n", "//", "#", "/*", "*/",
+    "/", "*", "=", "==", "!", "!=", "<", ">=", "%", "+", "-", "(", ")", "{", ";", ":", "é", "\r", "٣",
+]
+
+
+def tokenize_or_error(tokenizer: Callable[[str], list[Token]], source_code: str) -> object:
+    try:
+        return token_tuples(tokenizer(source_code))
+    except RuntimeError as e:
+        return str(e)
+
+
+def test_tokenizer_matches_the_regex_tokenizer_it_replaced() -> None:
+    rng = random.Random(0)
+    for _ in range(5000):
+        source_code = "".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(1, 12)))
+        assert tokenize_or_error(tokenize, source_code) == tokenize_or_error(regex_tokenize, source_code), source_code
+    source_code = corpus(0.05)
+    assert token_tuples(tokenize(source_code)) == token_tuples(regex_tokenize(source_code))
+
+
+def test_keywords_are_split_off_longer_words() -> None:
+    assert [(token.type, token.text) for token in tokenize("order ifx variable Boolean not1")] == [
+        ("binary_op", "or"), ("identifier", "der"),
+        ("keyword", "if"), ("identifier", "x"),
+        ("keyword", "var"), ("identifier", "iable"),
+        ("identifier", "Boolean"),
+        ("identifier", "not1"),
+    ]
+
+
+SPLIT_SOURCE = """var x = 10; // a comment
+/* block */ while x > 0 do { x = x - 1; } # another
+print_int(x) /* unterminated
+if true then 1 else 23456 ;
+"""
+
+
+def test_iter_tokens_matches_tokenize_wherever_the_chunks_are_split() -> None:
+    expected = token_tuples(tokenize(SPLIT_SOURCE))
+    for first in range(len(SPLIT_SOURCE)):
+        for second in (first, first + 1, first + 7):
+            chunks = [SPLIT_SOURCE[:first], SPLIT_SOURCE[first:second], SPLIT_SOURCE[second:]]
+            assert token_tuples(list(iter_tokens(chunks))) == expected, (first, second)
+    assert token_tuples(list(iter_tokens(SPLIT_SOURCE))) == expected
+
+
+def test_iter_tokens_reports_errors_at_the_same_position() -> None:
+    source_code = "a\n/* x */ b\n\nc d $"
+    assert tokenize_or_error(lambda s: list(iter_tokens(s)), source_code) == tokenize_or_error(tokenize, source_code)
+    assert tokenize_or_error(lambda s: list(iter_tokens(iter(s))), source_code) == tokenize_or_error(tokenize, source_code)
+
+
+def test_read_chunks_decodes_like_text_mode() -> None:
+    source_code = "var é = 1; // ää\r\nprint_int(2)\r\n"
+    with tempfile.TemporaryFile() as f:
+        f.write(source_code.encode())
+        f.flush()
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            # Small enough chunks to split the two-byte characters
+            assert "".join(read_chunks(buffer, chunk_size=3)) == source_code.replace("\r\n", "\n")
+
+
+def test_token_stream_holds_the_same_tokens_as_tokenize() -> None:
+    stream = tokenize_stream(SPLIT_SOURCE)
+    tokens = tokenize(SPLIT_SOURCE)
+    assert len(stream) == len(tokens)
+    assert token_tuples(list(stream)) == token_tuples(tokens)
+    for index, token in enumerate(tokens):
+        assert KIND_TYPES[stream.kinds[index]] == token.type
+        assert kind_of(token) == stream.kinds[index]
+        assert stream.text(index) == token.text
+        assert (stream.lines[index], stream.columns[index]) == (token.loc.line, token.loc.column)
+        assert token_tuples([stream.token(index)]) == token_tuples([token])
+
+
+def test_token_kinds_tell_operators_and_keywords_apart() -> None:
+    stream = tokenize_stream("if x <= 10 then x %= y and not true")
+    assert list(stream.kinds) == [
+        KINDS["if"], IDENTIFIER, KINDS["<="], INT_LITERAL, KINDS["then"],
+        IDENTIFIER, KINDS["%="], IDENTIFIER, KINDS["and"], KINDS["not"], KINDS["true"],
+    ]
+    assert [KIND_TEXTS[kind] for kind in stream.kinds if kind in KINDS.values()] == [
+        "if", "<=", "then", "%=", "and", "not", "true"]
+
+
+def test_identifiers_are_interned() -> None:
+    stream = tokenize_stream("counter = counter + 1")
+    assert stream.text(0) is stream.text(2)
+    rows = list(stream.rows())
+    assert rows[0][1] is rows[2][1]
+    tokens = list(stream)
+    assert tokens[0].text is tokens[2].text
+
+
+def test_token_stream_takes_a_few_bytes_per_token() -> None:
+    stream = tokenize_stream(corpus(0.05))
+    arrays = (stream.kinds, stream.starts, stream.lengths, stream.lines, stream.columns)
+    assert sum(array.itemsize for array in arrays) <= 24
+
+
+def stream_arrays(stream: TokenStream) -> list[list[int]]:
+    return [list(array) for array in (stream.kinds, stream.starts, stream.lengths, stream.lines, stream.columns)]
+
+
+def test_parallel_tokenize_stream_matches_serial() -> None:
+    rng = random.Random(1)
+    # Lines of fragments, so that runs are cut next to comments, blank lines and all
+    lines = ["".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(0, 8))) for _ in range(2000)]
+    valid_lines = [line for line in lines if not isinstance(tokenize_or_error(tokenize, line), str)]
+    source_code = "\n".join(valid_lines) + "\n" + corpus(0.05) + SPLIT_SOURCE * 50
+    serial = stream_arrays(tokenize_stream(source_code, jobs=1))
+    for jobs in (2, 3):
+        assert stream_arrays(tokenize_stream(source_code, jobs=jobs)) == serial
+    assert stream_arrays(tokenize_stream("", jobs=2)) == stream_arrays(tokenize_stream("", jobs=1))
+
+
+def test_parallel_tokenize_stream_reports_errors_at_the_same_position() -> None:
+    source_code = SPLIT_SOURCE * 100 + "a $" + SPLIT_SOURCE * 100
+    assert (
+        tokenize_or_error(lambda s: list(tokenize_stream(s, jobs=3)), source_code)
+        == tokenize_or_error(tokenize, source_code)
+        == "Caught unexpected value: '$' at position (501,3)."
+    )
+
+
+def test_tokenize_goes_parallel_above_the_threshold(monkeypatch: pytest.MonkeyPatch) -> None:
+    job_counts = []
+    tokenize_parallel = compiler.tokenizer._tokenize_parallel
+
+    def spy(source_code: str, jobs: int) -> TokenStream:
+        job_counts.append(jobs)
+        return tokenize_parallel(source_code, jobs)
+
+    monkeypatch.setattr(compiler.tokenizer, "_tokenize_parallel", spy)
+    monkeypatch.setattr(compiler.tokenizer.os, "cpu_count", lambda: 2)
+    monkeypatch.setattr(compiler.tokenizer, "PARALLEL_THRESHOLD", len(SPLIT_SOURCE))
+    assert token_tuples(tokenize(SPLIT_SOURCE[:-1])) == token_tuples(list(tokenize_stream(SPLIT_SOURCE[:-1], jobs=1)))
+    assert job_counts == []
+    assert token_tuples(tokenize(SPLIT_SOURCE)) == token_tuples(list(tokenize_stream(SPLIT_SOURCE, jobs=1)))
+    assert job_counts == [2]
+
+
+def test_iter_tokens_handles_a_long_line_in_many_chunks() -> None:
+    source_code = " + ".join(f"x{index}" for index in range(2000)) + "\n1"
+    assert token_tuples(list(iter_tokens(iter(source_code)))) == token_tuples(tokenize(source_code))
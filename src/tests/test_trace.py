@@ -0,0 +1,69 @@
+import os
+import tempfile
+from contextlib import nullcontext
+
+from compiler.instrument import add_observer, add_recorder, remove_observer, remove_recorder, stage
+from compiler.pipeline import call_compiler
+from compiler.trace import Tracer, read_trace
+
+
+def test_spans_of_a_compilation_nest_inside_it() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.json")
+        tracer = Tracer(path)
+        add_observer(tracer.span)
+        try:
+            call_compiler("print_int(1 + 2)", "(test)", "builtin")
+        finally:
+            remove_observer(tracer.span)
+            tracer.close()
+        events = read_trace(path)
+    by_name = {event["name"]: event for event in events}
+    assert set(by_name) == {
+        "compile", "tokenize", "parse", "annotate_types", "generate_ir", "generate_assembly", "assemble", "encode"}
+    outer = by_name["compile"]
+    for event in events:
+        assert event["ph"] == "X" and event["pid"] == os.getpid()
+        assert outer["ts"] <= event["ts"]
+        assert event["ts"] + event["dur"] <= outer["ts"] + outer["dur"]
+
+
+def test_processes_append_to_the_same_file() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.json")
+        tracer = Tracer(path)
+        with tracer.span("parent"):
+            pid = os.fork()
+            if pid == 0:
+                with Tracer(path).span("child"):
+                    pass
+                os._exit(0)
+            os.waitpid(pid, 0)
+        tracer.close()
+        events = read_trace(path)
+    assert sorted(event["name"] for event in events) == ["child", "parent"]
+    assert {event["pid"] for event in events} == {os.getpid(), pid}
+
+
+def test_stages_do_nothing_without_observers() -> None:
+    assert isinstance(stage("parse"), nullcontext)
+
+
+def test_tokenizing_of_chunked_source_is_one_span_inside_parse() -> None:
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "trace.json")
+        tracer = Tracer(path)
+        add_observer(tracer.span)
+        add_recorder(tracer.record_stage)
+        try:
+            call_compiler(["print_int(1 ", "+ 2);\n", "print_int(3)\n"], "(test)", "builtin")
+        finally:
+            remove_observer(tracer.span)
+            remove_recorder(tracer.record_stage)
+            tracer.close()
+        events = read_trace(path)
+    assert [event["name"] for event in events].count("tokenize") == 1
+    by_name = {event["name"]: event for event in events}
+    parse, tokenize = by_name["parse"], by_name["tokenize"]
+    assert parse["ts"] <= tokenize["ts"]
+    assert tokenize["ts"] + tokenize["dur"] <= parse["ts"] + parse["dur"]
@@ -0,0 +1,59 @@
+import pytest
+
+from compiler.x86_encoder import parse_unit, link, AssemblyError
+
+
+def encode(source_code: str) -> bytes:
+    return link([parse_unit(source_code)], origin=0x1000).code
+
+
+def test_encodes_stack_slot_moves() -> None:
+    assert encode("movq -8(%rbp), %rax") == bytes.fromhex("488b45f8")
+    assert encode("movq %rax, -2048(%rbp)") == bytes.fromhex("48898500f8ffff")
+    assert encode("movq $5, -8(%rbp)") == bytes.fromhex("48c745f805000000")
+
+
+def test_encodes_extended_registers_and_rsp_base() -> None:
+    assert encode("movq (%r12), %r13") == bytes.fromhex("4d8b2c24")
+    assert encode("pushq %r12") == bytes.fromhex("4154")
+    assert encode("movb %dl, (%rsp)") == bytes.fromhex("881424")
+
+
+def test_resolves_jumps_and_label_differences() -> None:
+    code = encode("""
+    start:
+        jmp end
+    msg:
+        .ascii "hi\\n"
+    msg_len = . - msg
+    end:
+        movq $msg_len, %rdx
+    """)
+    assert code[:5] == bytes.fromhex("e903000000")
+    assert code[5:8] == b"hi\n"
+    assert code[8:] == bytes.fromhex("48c7c203000000")
+
+
+def test_symbols_are_private_unless_global() -> None:
+    caller = parse_unit("call helper")
+    with pytest.raises(AssemblyError):
+        link([caller, parse_unit("helper: ret")], origin=0)
+    linked = link([caller, parse_unit(".global helper\nhelper: ret")], origin=0)
+    assert linked.symbols == {"helper": 16}
+
+
+def test_rejects_unsupported_instructions() -> None:
+    with pytest.raises(AssemblyError):
+        parse_unit("cvtsi2sd %rax, %xmm0")
+
+
+@pytest.mark.parametrize("source", [
+    "movq foo(%rip), %rax",
+    "movq $08, %rax",
+    "jmp",
+    "movq %rax",
+    "negq %rax, %rbx",
+])
+def test_rejects_unsupported_operands_with_assembly_error(source: str) -> None:
+    with pytest.raises(AssemblyError):
+        parse_unit(source)
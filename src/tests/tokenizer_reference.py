@@ -0,0 +1,66 @@
+"""The regex tokenizer that `tokenize` replaced, as a reference to test it against."""
+import re
+
+from compiler.tokenizer import Location, Token
+
+TOKEN_PATTERNS = {
+    "comment": r'(//.*?(\n|$)|#.*?(\n|$)|/\*.*?\*/)',
+    "int_literal": r'\b[0-9]+\b',
+    "bool_literal": r'\b(true|false)\b',
+    "unary_op": r'\bnot\b',
+    "binary_op": r'and|or|!=|==|<=|>=|<|>|\%=?|\+=?|\/=?|\*=?|\-=?|\=(?!\d)',
+    "keyword": r'\bvar|while|if|else|then|do|Int|Bool\b',
+    "punctuation": r'[(),;{}:]',
+    "newline": r'\n',
+    "whitespace": r'[ \t]+',
+    "identifier": r'_?[A-Za-z_]+[a-zA-Z0-9_]*',
+    "except": r'.',
+}
+
+
+def regex_tokenize(source_code: str) -> list[Token]:
+    """The tokenizer as it was before the hand-written scanner."""
+    tokens = []
+
+    line = 1
+    column = 1
+
+    pattern = re.compile(
+        "|".join(
+            f"(?P<{token_type}>{pattern})" for token_type,
+            pattern in TOKEN_PATTERNS.items()
+        )
+    )
+
+    for match in re.finditer(pattern, source_code):
+        token_type = match.lastgroup
+        value = match.group()
+
+        if token_type == "newline" or token_type == "comment":
+            line += 1
+            column = 1
+            continue
+        elif token_type == "whitespace":
+            column += len(value)
+            continue
+        elif token_type == "except":
+            raise RuntimeError(
+                f"Caught unexpected value: '{value}' at position ({line},{column})."
+            )
+
+        tokens.append(
+            Token(
+                Location(line, column),
+                token_type,
+                value
+            )
+        )
+
+        column += len(value)
+
+    return tokens
+
+
+def token_tuples(tokens: list[Token]) -> list[tuple[int, int, str | None, str]]:
+    """Tokens as tuples, since locations always compare equal."""
+    return [(token.loc.line, token.loc.column, token.type, token.text) for token in tokens]